@@ -6,13 +6,20 @@
 2. 从steps聚合所有对象名（避免"multiple objects"）
 3. 如果对象过多(>3)，列出前3个+类别
 """
+import argparse
+import heapq
+import itertools
 import json
+import os
 import re
+import tempfile
 from collections import defaultdict, Counter
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import logging
 
+from object_taxonomy import OBJECT_TAXONOMY
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
@@ -60,9 +67,7 @@ def aggregate_objects(objects: List[str], max_display: int = 3) -> Dict[str, Any
         }
     else:
         # 提取类别（通常是第一个词，如"E MS Kabel"中的"E"）
-        categories = [obj.split()[0] for obj in unique_objects if ' ' in obj]
-        category_counts = Counter(categories)
-        most_common_category = category_counts.most_common(1)[0][0] if category_counts else None
+        most_common_category = OBJECT_TAXONOMY.most_common_head(unique_objects)
         
         # 显示前N个 + 类别
         top_objects = unique_objects[:max_display]
@@ -80,191 +85,307 @@ def aggregate_objects(objects: List[str], max_display: int = 3) -> Dict[str, Any
 
 
 def infer_object_category(objects: List[str]) -> str:
-    """从对象列表推断对象类别（高层次概括）"""
-    if not objects:
-        return "objects"
-    
-    # 提取对象类型前缀（如 E MS, E HS, E LS）
-    type_counts = Counter()
-    for obj in objects:
-        parts = obj.split()
-        if len(parts) >= 2:
-            # 提取类型前缀（如 "E MS", "E HS"）
-            prefix = ' '.join(parts[:2])
-            type_counts[prefix] += 1
-    
-    # 如果有明确的主要类型
-    if type_counts:
-        most_common = type_counts.most_common(2)
-        if len(most_common) == 1:
-            return f"{most_common[0][0]} components"
-        elif len(most_common) >= 2:
-            return f"{most_common[0][0]}/{most_common[1][0]} components"
-    
-    # 提取对象类别关键词（如 Kabel, Installatie, Aardingstrafo）
-    category_keywords = []
-    for obj in objects:
-        # 取最后一个有意义的词作为类别
-        words = [w for w in obj.split() if w not in ['FP', 'E', 'MS', 'HS', 'LS', 'Sec']]
-        if words:
-            category_keywords.append(words[-1])
-    
-    if category_keywords:
-        category_counts = Counter(category_keywords)
-        main_category = category_counts.most_common(1)[0][0]
-        if category_counts[main_category] > 1:
-            return f"{main_category} components"
-        else:
-            return f"electrical components"
-    
-    return "objects"
+    """从对象列表推断对象类别（高层次概括，基于预计算的对象分类索引）"""
+    return OBJECT_TAXONOMY.infer_category(objects)
 
 
-def aggregate_file_instruction(file_id: str, steps: List[Dict]) -> Dict[str, Any]:
-    """从steps聚合生成file级指令（高层次任务描述）"""
-    
-    # 1. 从文件名推断主要任务
-    task = infer_task_from_filename(file_id)
-    
-    # 2. 聚合所有步骤的信息
-    all_objects = []
-    all_actions = []
-    all_databases = set()
-    all_keywords = []
-    test_app = None
-    is_high_quality = any(s.get('is_high_quality', False) for s in steps)
-    
-    for step in steps:
-        # 对象
-        if 'structure' in step and 'object' in step['structure']:
-            obj = step['structure']['object']
-            if obj and obj not in ['object', 'objects']:  # 过滤泛化词
-                # 清理对象名（去掉"object"后缀）
-                obj_clean = re.sub(r'\s+object$', '', obj, flags=re.IGNORECASE)
-                all_objects.append(obj_clean)
-        
-        # 动作
-        if 'structure' in step and 'action' in step['structure']:
-            action = step['structure']['action']
-            if action:
-                all_actions.append(action.lower())
-        
+# 辅助动作（open, switch, navigate等），不作为file级主要动作
+AUXILIARY_ACTIONS = {'open', 'switch', 'navigate', 'select', 'close'}
+CRUD_ACTIONS = ['create', 'update', 'delete']
+GENERIC_OBJECT_WORDS = {'object', 'objects'}
+GENERIC_DATABASE_WORDS = {'object', 'objects', 'dataset', 'system', 'database'}
+OBJECT_SUFFIX_RE = re.compile(r'\s+object$', flags=re.IGNORECASE)
+APP_NAME_RE = re.compile(r'in (NRG [^\.]+)')
+
+
+class FileInstructionAccumulator:
+    """
+    File级指令的在线累加器
+
+    在生成step时逐步更新，结束时直接产出file级记录，无需再读一遍step级JSONL。
+    所有字段都可合并（merge），多个分片的累加器可以合并成同一个文件的结果：
+    - object_counts: 对象出现次数（按首次出现保序）
+    - action_counts: 动作出现次数
+    - databases: 数据库（按首次出现保序去重）
+    - keyword_weights: 每个关键词的最高权重
+    """
+
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+        self.object_counts: Dict[str, int] = {}
+        self.action_counts: Counter = Counter()
+        self.databases: Dict[str, None] = {}
+        self.keyword_weights: Dict[str, float] = {}
+        self.test_app: Optional[str] = None
+        self.is_high_quality = False
+        self.total_steps = 0
+
+    def add(
+        self,
+        action: Optional[str] = None,
+        obj: Optional[str] = None,
+        databases: Iterable[str] = (),
+        keywords: Iterable[Tuple[str, float]] = (),
+        test_app: Optional[str] = None,
+        is_high_quality: bool = False
+    ):
+        """记录一个step的已知信息（生成器直接调用，无需正则恢复）"""
+        self.total_steps += 1
+        self.is_high_quality = self.is_high_quality or bool(is_high_quality)
+
+        # 对象（过滤泛化词，去掉"object"后缀）
+        if obj and obj not in GENERIC_OBJECT_WORDS:
+            obj_clean = OBJECT_SUFFIX_RE.sub('', obj)
+            self.object_counts[obj_clean] = self.object_counts.get(obj_clean, 0) + 1
+
+        if action:
+            self.action_counts[action.lower()] += 1
+
+        for db in databases:
+            if db:
+                self.databases[db] = None
+
+        self._update_keywords(keywords)
+
+        if test_app:
+            self.test_app = test_app
+
+    def _update_keywords(self, keywords: Iterable[Tuple[str, float]]):
+        for kw, weight in keywords:
+            if kw not in self.keyword_weights or weight > self.keyword_weights[kw]:
+                self.keyword_weights[kw] = weight  # 取最高权重
+
+    def add_step_record(self, step: Dict):
+        """从已写出的step级记录中恢复信息（兼容离线聚合）"""
+        structure = step.get('structure', {})
+
         # 数据库/上下文
-        if 'structure' in step:
-            # 从context字段提取
-            if 'context' in step['structure']:
-                ctx = step['structure']['context']
-                if ctx:
-                    all_databases.add(ctx)
-            
-            # 从adverbials提取（如"in elektra dataset"）
-            if 'adverbials' in step['structure']:
-                adverbs = step['structure']['adverbials']
-                # 查找"in XXX dataset/system"模式
-                for i, adv in enumerate(adverbs):
-                    if adv == 'in' and i + 1 < len(adverbs):
-                        next_word = adverbs[i + 1]
-                        # 过滤掉泛化词
-                        if next_word not in ['object', 'objects', 'dataset', 'system', 'database']:
-                            all_databases.add(next_word)
-        
-        # 关键词
-        if 'keywords' in step:
-            all_keywords.extend(step['keywords'])
-        
-        # 应用名
+        databases = []
+        if structure.get('context'):
+            databases.append(structure['context'])
+        # 从adverbials提取（如"in elektra dataset"）
+        adverbs = structure.get('adverbials', [])
+        for i, adv in enumerate(adverbs):
+            if adv == 'in' and i + 1 < len(adverbs):
+                next_word = adverbs[i + 1]
+                if next_word not in GENERIC_DATABASE_WORDS:
+                    databases.append(next_word)
+
+        # 应用名（通常在instruction末尾）
+        test_app = None
         if 'instruction' in step:
-            # 尝试从instruction提取app名（通常在末尾）
-            match = re.search(r'in (NRG [^\.]+)', step['instruction'])
+            match = APP_NAME_RE.search(step['instruction'])
             if match:
                 test_app = match.group(1).strip()
-    
-    # 3. 推断主要动作（只取最主要的业务动作，忽略辅助动作）
-    action_counts = Counter(all_actions)
-    # 过滤掉辅助动作（open, switch, navigate等）
-    auxiliary_actions = {'open', 'switch', 'navigate', 'select', 'close'}
-    business_actions = {action: count for action, count in action_counts.items() 
-                       if action not in auxiliary_actions}
-    
-    if business_actions:
+
+        self.add(
+            action=structure.get('action'),
+            obj=structure.get('object'),
+            databases=databases,
+            keywords=step.get('keywords', []),
+            test_app=test_app,
+            is_high_quality=step.get('is_high_quality', False)
+        )
+
+    def merge(self, other: 'FileInstructionAccumulator') -> 'FileInstructionAccumulator':
+        """合并另一个累加器（other中的step视为排在self之后）"""
+        for obj, count in other.object_counts.items():
+            self.object_counts[obj] = self.object_counts.get(obj, 0) + count
+        self.action_counts.update(other.action_counts)
+        self.databases.update(other.databases)
+        self._update_keywords(other.keyword_weights.items())
+        self.total_steps += other.total_steps
+        if other.test_app:
+            self.test_app = other.test_app
+        self.is_high_quality = self.is_high_quality or other.is_high_quality
+        return self
+
+    def _primary_action(self, task: str) -> str:
+        """推断主要动作（只取最主要的业务动作，忽略辅助动作）"""
+        business_actions = {action: count for action, count in self.action_counts.items()
+                           if action not in AUXILIARY_ACTIONS}
+        if not business_actions:
+            # 如果没有业务动作，使用推断的任务
+            return task
+
         # 如果有CRUD动作（create/update/delete），优先使用
-        crud_actions = ['create', 'update', 'delete']
-        crud_found = [a for a in crud_actions if a in business_actions]
-        
+        crud_found = [a for a in CRUD_ACTIONS if a in business_actions]
         if len(crud_found) >= 2:
             # 多个CRUD动作，使用"manage"
-            primary_action = 'manage'
+            return 'manage'
         elif crud_found:
-            # 单个CRUD动作
-            primary_action = crud_found[0]
-        else:
-            # 取最频繁的业务动作
-            primary_action = max(business_actions, key=business_actions.get)
-    else:
-        # 如果没有业务动作，使用推断的任务
-        primary_action = task
-    
-    # 4. 推断对象类别（高层次概括）
-    object_category = infer_object_category(all_objects)
-    
-    # 5. 提取数据库和应用信息
-    database_str = ', '.join(all_databases) if all_databases else None
-    app_str = test_app
-    
-    # 6. 构建高层次的instruction文本
-    # 格式："Manage E MS components in elektra system" 或 "Create cables for NRG Beheerkaart"
-    instruction_parts = []
-    
-    # 主要动作 + 对象类别
-    instruction_parts.append(f"{primary_action.capitalize()} {object_category}")
-    
-    # 添加上下文（优先database，其次app）
-    if database_str:
-        instruction_parts.append(f"in {database_str} system")
-    elif app_str:
-        instruction_parts.append(f"for {app_str}")
-    
-    instruction = ' '.join(instruction_parts)
-    instruction = ' '.join(instruction_parts)
-    
-    # 7. 聚合关键词（去重并保留权重）
-    keyword_dict = {}
-    for kw, weight in all_keywords:
-        if kw in keyword_dict:
-            keyword_dict[kw] = max(keyword_dict[kw], weight)  # 取最高权重
-        else:
-            keyword_dict[kw] = weight
-    
-    aggregated_keywords = [[kw, weight] for kw, weight in keyword_dict.items()]
-    
-    # 8. 保存详细的对象列表（用于训练数据）
-    unique_objects = list(dict.fromkeys(all_objects))  # 去重保序
-    
-    # 9. 返回结果
-    return {
-        'file_id': file_id,
-        'is_high_quality': is_high_quality,
-        'instruction': instruction,
-        'provider': 'step_aggregation_v2',
-        'test_app': app_str,
-        'total_steps': len(steps),
-        'keywords': aggregated_keywords,
-        'primary_action': primary_action,
-        'object_category': object_category,
-        'objects': unique_objects,  # 保留详细对象列表
-        'object_count': len(unique_objects),
-        'databases': list(all_databases),
-        'inferred_task': task
-    }
+            return crud_found[0]
+        # 取最频繁的业务动作
+        return max(business_actions, key=business_actions.get)
 
+    def finalize(self) -> Dict[str, Any]:
+        """生成file级记录"""
+        # 1. 从文件名推断主要任务
+        task = infer_task_from_filename(self.file_id)
+        primary_action = self._primary_action(task)
 
-def main():
-    """主函数"""
-    input_file = Path('data/processed/step_level_instructions_weighted.jsonl')
-    output_file = Path('data/processed/file_level_instructions_aggregated.jsonl')
-    
-    logging.info(f"📖 Reading step-level instructions from {input_file}")
-    
+        # 2. 推断对象类别（高层次概括）
+        object_category = OBJECT_TAXONOMY.infer_category_counts(self.object_counts.items())
+
+        # 3. 构建高层次的instruction文本
+        # 格式："Manage E MS components in elektra system" 或 "Create cables for NRG Beheerkaart"
+        instruction_parts = [f"{primary_action.capitalize()} {object_category}"]
+        # 添加上下文（优先database，其次app）
+        if self.databases:
+            instruction_parts.append(f"in {', '.join(self.databases)} system")
+        elif self.test_app:
+            instruction_parts.append(f"for {self.test_app}")
+        instruction = ' '.join(instruction_parts)
+
+        unique_objects = list(self.object_counts)
+        return {
+            'file_id': self.file_id,
+            'is_high_quality': self.is_high_quality,
+            'instruction': instruction,
+            'provider': 'step_aggregation_v2',
+            'test_app': self.test_app,
+            'total_steps': self.total_steps,
+            'keywords': [[kw, weight] for kw, weight in self.keyword_weights.items()],
+            'primary_action': primary_action,
+            'object_category': object_category,
+            'objects': unique_objects,  # 保留详细对象列表
+            'object_count': len(unique_objects),
+            'databases': list(self.databases),
+            'inferred_task': task
+        }
+
+
+def aggregate_file_instruction(file_id: str, steps: List[Dict]) -> Dict[str, Any]:
+    """从steps聚合生成file级指令（高层次任务描述）"""
+    accumulator = FileInstructionAccumulator(file_id)
+    for step in steps:
+        accumulator.add_step_record(step)
+    return accumulator.finalize()
+
+
+class UnsortedInputError(ValueError):
+    """step级输入未按file_id分组"""
+
+
+def iter_step_groups(input_file: Path) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    按file_id顺序流式产出step分组（要求输入已按file_id分组）
+
+    step级JSONL由生成器按workflow顺序写出，同一文件的steps天然相邻；
+    每当file_id变化就产出上一组，内存只保留当前workflow。
+    如果某个file_id在其分组结束后再次出现，抛出 UnsortedInputError。
+    """
+    closed_ids = set()
+    current_id = None
+    current_steps: List[Dict] = []
+
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            step = json.loads(line)
+            file_id = step['file_id']
+            if file_id != current_id:
+                if current_id is not None:
+                    yield current_id, current_steps
+                    closed_ids.add(current_id)
+                if file_id in closed_ids:
+                    raise UnsortedInputError(f"file_id {file_id} 不连续，输入未按file_id分组")
+                current_id = file_id
+                current_steps = []
+            current_steps.append(step)
+
+    if current_id is not None:
+        yield current_id, current_steps
+
+
+def _file_id_of(line: str) -> str:
+    return json.loads(line)['file_id']
+
+
+def external_sort_by_file_id(input_file: Path, output_file: Path, chunk_lines: int = 100000) -> int:
+    """
+    外部归并排序：按file_id对step级JSONL排序
+
+    1. 每次读入chunk_lines行，按file_id稳定排序后写成临时run文件
+    2. 用heapq.merge多路归并所有run（run按输入顺序排列，保证同一文件内step顺序不变）
+
+    内存上限由chunk_lines决定，与语料总量无关。
+
+    Returns:
+        排序后的行数
+    """
+    run_files = []
+    total = 0
+    with tempfile.TemporaryDirectory(prefix='step_sort_', dir=output_file.parent) as tmp_dir:
+        with open(input_file, 'r', encoding='utf-8') as f:
+            while True:
+                chunk = [line if line.endswith('\n') else line + '\n'
+                         for line in itertools.islice(f, chunk_lines) if line.strip()]
+                if not chunk:
+                    break
+                chunk.sort(key=_file_id_of)
+                run_path = Path(tmp_dir) / f"run_{len(run_files):05d}.jsonl"
+                with open(run_path, 'w', encoding='utf-8') as run_f:
+                    run_f.writelines(chunk)
+                run_files.append(run_path)
+                total += len(chunk)
+
+        logging.info(f"🔀 Merging {len(run_files)} sorted runs ({total} steps)")
+        handles = [open(p, 'r', encoding='utf-8') for p in run_files]
+        try:
+            with open(output_file, 'w', encoding='utf-8') as fout:
+                fout.writelines(heapq.merge(*handles, key=_file_id_of))
+        finally:
+            for h in handles:
+                h.close()
+
+    return total
+
+
+def aggregate_streaming(input_file: Path, output_file: Path, chunk_lines: int = 100000) -> Dict[str, Any]:
+    """
+    流式聚合：每个file_id的分组结束后立即聚合并写出
+
+    峰值内存取决于最大的单个workflow，而不是整个语料。
+    若输入未按file_id分组，先做外部归并排序再重新流式聚合。
+    结果先写入临时文件，成功后再原子替换输出文件。
+    """
+    tmp_output = output_file.with_name(output_file.name + '.tmp')
+    try:
+        stats = _write_aggregated_groups(iter_step_groups(input_file), tmp_output)
+    except UnsortedInputError as e:
+        logging.warning(f"⚠️  {e}，改用外部排序")
+        sorted_input = output_file.with_name(input_file.stem + '.sorted.jsonl')
+        try:
+            external_sort_by_file_id(input_file, sorted_input, chunk_lines=chunk_lines)
+            stats = _write_aggregated_groups(iter_step_groups(sorted_input), tmp_output)
+        finally:
+            if sorted_input.exists():
+                sorted_input.unlink()
+    os.replace(tmp_output, output_file)
+    return stats
+
+
+def _write_aggregated_groups(groups: Iterable[Tuple[str, List[Dict]]], output_file: Path) -> Dict[str, Any]:
+    """逐组聚合并写出，只保留累计统计和少量样本"""
+    stats = {'files': 0, 'steps': 0, 'multiple_objects': 0, 'samples': []}
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for file_id, steps in groups:
+            inst = aggregate_file_instruction(file_id, steps)
+            f.write(json.dumps(inst, ensure_ascii=False) + '\n')
+
+            stats['files'] += 1
+            stats['steps'] += inst['total_steps']
+            if 'multiple objects' in inst['instruction'].lower():
+                stats['multiple_objects'] += 1
+            if len(stats['samples']) < 5:
+                stats['samples'].append(inst)
+    return stats
+
+
+def aggregate_in_memory(input_file: Path, output_file: Path) -> Dict[str, Any]:
+    """原始实现：先把所有step按file_id分组读入内存，再逐个聚合"""
     # 1. 读取step级数据并按file_id分组
     steps_by_file = defaultdict(list)
     with open(input_file, 'r', encoding='utf-8') as f:
@@ -274,34 +395,53 @@ def main():
     
     logging.info(f"✅ Loaded {len(steps_by_file)} files with {sum(len(steps) for steps in steps_by_file.values())} total steps")
     
-    # 2. 聚合生成file级指令
+    # 2. 聚合生成file级指令并保存
     logging.info("📝 Aggregating file-level instructions from steps...")
-    file_instructions = []
-    for file_id, steps in steps_by_file.items():
-        file_inst = aggregate_file_instruction(file_id, steps)
-        file_instructions.append(file_inst)
+    return _write_aggregated_groups(steps_by_file.items(), output_file)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="从Step级指令聚合生成File级指令")
+    parser.add_argument('--input', type=str,
+                       default='data/processed/step_level_instructions_weighted.jsonl',
+                       help='step级指令文件')
+    parser.add_argument('--output', type=str,
+                       default='data/processed/file_level_instructions_aggregated.jsonl',
+                       help='file级指令输出文件')
+    parser.add_argument('--streaming', action='store_true',
+                       help='流式聚合（内存只保留单个workflow，未分组输入自动外部排序）')
+    parser.add_argument('--sort-chunk-lines', type=int, default=100000,
+                       help='外部排序每个run的行数')
+    args = parser.parse_args()
+
+    input_file = Path(args.input)
+    output_file = Path(args.output)
     
-    # 3. 保存结果
-    logging.info(f"💾 Saving to {output_file}")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for inst in file_instructions:
-            f.write(json.dumps(inst, ensure_ascii=False) + '\n')
+    logging.info(f"📖 Reading step-level instructions from {input_file}")
+    
+    if args.streaming:
+        logging.info("🌊 Streaming aggregation by file_id groups...")
+        stats = aggregate_streaming(input_file, output_file, chunk_lines=args.sort_chunk_lines)
+    else:
+        stats = aggregate_in_memory(input_file, output_file)
+    logging.info(f"💾 Saved to {output_file}")
     
-    # 4. 统计"multiple objects"出现次数
-    multiple_count = sum(1 for inst in file_instructions if 'multiple objects' in inst['instruction'].lower())
+    # 3. 统计"multiple objects"出现次数
+    file_count = max(stats['files'], 1)
     
     logging.info("\n" + "="*60)
     logging.info("🎉 聚合完成！")
     logging.info(f"📄 输出文件: {output_file}")
     logging.info(f"📊 统计:")
-    logging.info(f"   - 总文件数: {len(file_instructions)}")
-    logging.info(f"   - 含\"multiple objects\"的文件: {multiple_count} ({multiple_count/len(file_instructions)*100:.1f}%)")
-    logging.info(f"   - 平均每个文件步骤数: {sum(inst['total_steps'] for inst in file_instructions) / len(file_instructions):.1f}")
+    logging.info(f"   - 总文件数: {stats['files']}")
+    logging.info(f"   - 含\"multiple objects\"的文件: {stats['multiple_objects']} ({stats['multiple_objects']/file_count*100:.1f}%)")
+    logging.info(f"   - 平均每个文件步骤数: {stats['steps'] / file_count:.1f}")
     logging.info("="*60)
     
-    # 5. 显示样本
+    # 4. 显示样本
     logging.info("\n=== Sample aggregated instructions ===")
-    for inst in file_instructions[:5]:
+    for inst in stats['samples']:
         logging.info(f"\nFile: {inst['file_id']}")
         logging.info(f"  Task: {inst['inferred_task']} -> Action: {inst['primary_action']}")
         logging.info(f"  Category: {inst['object_category']}")
@@ -4,6 +4,8 @@
 import json
 from collections import Counter
 
+from object_taxonomy import OBJECT_TAXONOMY
+
 print("🔍 分析 'multiple objects' 问题")
 print("=" * 80)
 
@@ -59,6 +61,8 @@ for i, example in enumerate(multiple_examples, 1):
     print(f"当前指令: {example['instruction']}")
     print(f"实际对象列表: {example['objects']}")
     print(f"对象数量: {len(example['objects'])}")
+    print(f"对象类别: {OBJECT_TAXONOMY.infer_category(example['objects'])}")
+    print(f"电压等级: {', '.join(OBJECT_TAXONOMY.voltage_classes(example['objects'])) or '-'}")
     print(f"总步骤数: {example['total_steps']}")
     
     # 获取原始workflow
@@ -87,7 +91,8 @@ for i, example in enumerate(multiple_examples, 1):
         print(f"\n  每个对象的操作:")
         for obj, actions in sorted(object_actions.items()):
             unique_actions = list(set(actions))
-            print(f"    {obj}: {', '.join(unique_actions)}")
+            entry = OBJECT_TAXONOMY.entry(obj)
+            print(f"    {obj} [{entry.prefix or '-'} / {entry.category or '-'}]: {', '.join(unique_actions)}")
         
         # 建议的更好指令
         main_objects = list(object_actions.keys())[:3]  # 取前3个主要对象
@@ -0,0 +1,307 @@
+"""
+Token预算分析：用训练tokenizer统计每种训练数据和prompt格式的长度分布
+
+DataArguments.max_length=2048、generate(max_new_tokens=512) 都是拍脑袋定的，不知道
+tokenize时有多少样本被截断。这里对每个训练数据文件（step级 / 文件级 / 层次化 / 划分后）
+的每种格式做一遍多进程tokenize：
+
+- train:          训练prompt（prompt + 输出，train_lora.py 的 format_prompt）
+- inference:      推理prompt（load_model.py 的 generate()），输出长度即生成所需token数
+- train_dsl / inference_dsl: 输出换成紧凑DSL（data_processing/workflow_dsl.py）后的同样两种格式
+- multi_turn:     层次化数据的工作流级多轮序列（training/multi_turn.py，按max_length切窗口）
+
+按格式和step_type报告长度分位数、截断率、padding浪费（按batch动态padding / 固定padding
+到max_length），并给出 max_length 和 max_new_tokens 的建议值。
+
+用法:
+    python scripts/analyze_token_budget.py
+    python scripts/analyze_token_budget.py --inputs data/training/training_data_train.jsonl --workers 8
+    python scripts/analyze_token_budget.py --tokenizer Qwen/Qwen2.5-Coder-7B-Instruct --output reports/token_budget.json
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+from collections import defaultdict
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from data_processing.workflow_dsl import encode_step, encode_workflow
+from training.columnar import iter_samples
+from training.multi_turn import build_multi_turn_sequences
+from training.prompts import format_inference_prompt, format_prompt
+from training.step_sampler import sample_attributes
+
+DEFAULT_TOKENIZER = "Qwen/Qwen2.5-Coder-7B-Instruct"
+# 各脚本实际写出的文件：step级/文件级（prepare_*、build_training_sets.py 写 {stem}_train/_val.json）、
+# 层次化（prepare_hierarchical_training_data.py）、划分后（split_training_data.py）
+DEFAULT_INPUTS = [
+    "data/training/training_data_train.json",
+    "data/training/training_data_val.json",
+    "data/training/file_level_training_data_train.json",
+    "data/training/file_level_training_data_val.json",
+    "data/processed/hierarchical_training_data.json",
+    "data/training/training_data_train.jsonl",
+    "data/training/training_data_val.jsonl",
+]
+PERCENTILES = (50, 90, 95, 99)
+CHUNK_SIZE = 256
+
+_tokenizer = None
+
+
+def _init_worker(tokenizer_name: str):
+    global _tokenizer
+    from transformers import AutoTokenizer
+    _tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, trust_remote_code=True)
+
+
+def to_dsl(output: str) -> Optional[str]:
+    """JSON输出（单个step或 {"workflow": …}）→ 紧凑DSL；不是这两种结构时返回None"""
+    try:
+        parsed = json.loads(output)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(parsed, dict):
+        return None
+    if isinstance(parsed.get('workflow'), dict):
+        workflow = parsed['workflow']
+        return encode_workflow(workflow.get('steps', []), workflow.get('metadata'))
+    if 'module' in parsed:
+        return encode_step(parsed)
+    return None
+
+
+def sample_step_type(sample: Dict) -> str:
+    """按输出步骤分类（与训练时的step_type采样一致）；文件级为workflow"""
+    return sample_attributes(sample)['step_type']
+
+
+def format_texts(sample: Dict) -> Dict[str, Tuple[str, str]]:
+    """每种格式的 (prompt, 输出)；训练格式的完整文本 = prompt + 输出"""
+    instruction, context, output = sample.get('instruction', ''), sample.get('input', ''), sample.get('output', '')
+    texts = {
+        'train': (format_prompt({'instruction': instruction, 'input': context, 'output': ''})['text'], output),
+        'inference': (format_inference_prompt(instruction, context), output),
+    }
+    dsl = to_dsl(output)
+    if dsl is not None:
+        texts['train_dsl'] = (texts['train'][0], dsl)
+        texts['inference_dsl'] = (texts['inference'][0], dsl)
+    return texts
+
+
+def _count(texts: List[str]) -> List[int]:
+    return [len(ids) for ids in _tokenizer(texts, add_special_tokens=True)['input_ids']]
+
+
+def _measure_chunk(samples: List[Dict]) -> List[Dict[str, Tuple[int, int]]]:
+    """每个样本、每种格式的 (prompt token数, 输出token数)"""
+    per_sample = [format_texts(s) for s in samples]
+    keys, prompts, fulls = [], [], []
+    for i, texts in enumerate(per_sample):
+        for fmt, (prompt, output) in texts.items():
+            keys.append((i, fmt))
+            prompts.append(prompt)
+            fulls.append(prompt + output)
+    # 训练格式按完整文本tokenize（与 _tokenize_function 相同），输出长度 = 完整 - prompt
+    prompt_lengths = _count(prompts)
+    full_lengths = _count(fulls)
+    results: List[Dict[str, Tuple[int, int]]] = [{} for _ in samples]
+    for (i, fmt), prompt_len, full_len in zip(keys, prompt_lengths, full_lengths):
+        results[i][fmt] = (prompt_len, max(full_len - prompt_len, 0))
+    return results
+
+
+def measure(samples: List[Dict], tokenizer_name: str, workers: int = 1) -> List[Dict[str, Tuple[int, int]]]:
+    chunks = [samples[i:i + CHUNK_SIZE] for i in range(0, len(samples), CHUNK_SIZE)]
+    if workers <= 1:
+        _init_worker(tokenizer_name)
+        chunk_results = [_measure_chunk(chunk) for chunk in chunks]
+    else:
+        with Pool(workers, initializer=_init_worker, initargs=(tokenizer_name,)) as pool:
+            chunk_results = pool.map(_measure_chunk, chunks)
+    return [result for chunk in chunk_results for result in chunk]
+
+
+def percentile(sorted_values: Sequence[int], p: float) -> int:
+    if not sorted_values:
+        return 0
+    rank = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def pad_waste(lengths: Sequence[int], batch_size: int, seed: int = 0) -> float:
+    """随机分batch、每个batch pad到batch内最长（DataCollatorForSeq2Seq）时pad token的占比"""
+    if not lengths:
+        return 0.0
+    shuffled = list(lengths)
+    random.Random(seed).shuffle(shuffled)
+    padded = 0
+    for i in range(0, len(shuffled), batch_size):
+        batch = shuffled[i:i + batch_size]
+        padded += max(batch) * len(batch)
+    return 1 - sum(shuffled) / padded
+
+
+def distribution(sorted_values: Sequence[int]) -> Dict[str, int]:
+    summary = {f'p{p}': percentile(sorted_values, p) for p in PERCENTILES}
+    summary['max'] = sorted_values[-1] if sorted_values else 0
+    return summary
+
+
+def round_up(value: int, multiple: int) -> int:
+    return max(multiple, -(-value // multiple) * multiple)
+
+
+def summarize(prompt_lengths: List[int], output_lengths: List[int], max_length: int,
+              max_new_tokens: int, batch_size: int) -> Dict:
+    totals = sorted(p + o for p, o in zip(prompt_lengths, output_lengths))
+    outputs = sorted(output_lengths)
+    n = len(totals)
+    truncated = [min(t, max_length) for t in totals]
+    return {
+        'samples': n,
+        'total': distribution(totals),
+        'output': distribution(outputs),
+        'truncation_rate': sum(t > max_length for t in totals) / n if n else 0.0,
+        'output_lost_rate': sum(p >= max_length for p in prompt_lengths) / n if n else 0.0,
+        'pad_waste_dynamic': pad_waste(truncated, batch_size),
+        'pad_waste_max_length': 1 - sum(truncated) / (n * max_length) if n else 0.0,
+        # 生成时还需要一个eos
+        'generation_cut_rate': sum(o + 1 > max_new_tokens for o in outputs) / n if n else 0.0,
+    }
+
+
+def analyze_file(path: str, tokenizer_name: str, max_length: int, max_new_tokens: int,
+                 batch_size: int, workers: int) -> Dict:
+    samples = list(iter_samples(path))
+    lengths = measure(samples, tokenizer_name, workers)
+    step_types = [sample_step_type(s) for s in samples]
+
+    groups: Dict[Tuple[str, str], Tuple[List[int], List[int]]] = defaultdict(lambda: ([], []))
+    for step_type, per_format in zip(step_types, lengths):
+        for fmt, (prompt_len, output_len) in per_format.items():
+            for key in ((fmt, 'all'), (fmt, step_type)):
+                groups[key][0].append(prompt_len)
+                groups[key][1].append(output_len)
+
+    report = {'path': path, 'samples': len(samples), 'formats': {}}
+    for (fmt, step_type), (prompt_lengths, output_lengths) in sorted(groups.items()):
+        report['formats'].setdefault(fmt, {})[step_type] = summarize(
+            prompt_lengths, output_lengths, max_length, max_new_tokens, batch_size)
+
+    if any((s.get('metadata') or {}).get('file_id') for s in samples[:100]):
+        report['formats']['multi_turn'] = {'all': analyze_multi_turn(path, tokenizer_name, max_length, batch_size)}
+    report['recommendations'] = recommend(groups, max_length)
+    return report
+
+
+def analyze_multi_turn(path: str, tokenizer_name: str, max_length: int, batch_size: int) -> Dict:
+    """多轮序列按窗口切分，不截断；报告窗口长度和padding浪费"""
+    _init_worker(tokenizer_name)
+    stats: Dict[str, int] = {}
+    windows = sorted(len(w['input_ids']) for w in build_multi_turn_sequences(_tokenizer, path, max_length, stats))
+    return {
+        'samples': len(windows),
+        'total': distribution(windows),
+        'workflows': stats['workflows'],
+        'tokens': stats['tokens'],
+        'per_step_tokens': stats['per_step_tokens'],
+        'pad_waste_dynamic': pad_waste(windows, batch_size),
+        'pad_waste_max_length': 1 - sum(windows) / (len(windows) * max_length) if windows else 0.0,
+    }
+
+
+def recommend(groups, max_length: int) -> Dict:
+    """max_length取训练格式p99向上取整到64；max_new_tokens取输出p99+eos向上取整到32"""
+    recommendations = {}
+    for fmt in ('train', 'train_dsl'):
+        if (fmt, 'all') in groups:
+            prompts, outputs = groups[(fmt, 'all')]
+            totals = sorted(p + o for p, o in zip(prompts, outputs))
+            recommended = round_up(percentile(totals, 99), 64)
+            recommendations[f'max_length ({fmt})'] = {
+                'value': recommended,
+                'truncation_rate': sum(t > recommended for t in totals) / len(totals),
+                'current_truncation_rate': sum(t > max_length for t in totals) / len(totals),
+            }
+    for fmt in ('inference', 'inference_dsl'):
+        if (fmt, 'all') in groups:
+            outputs = sorted(groups[(fmt, 'all')][1])
+            recommended = round_up(percentile(outputs, 99) + 1, 32)
+            recommendations[f'max_new_tokens ({fmt})'] = {
+                'value': recommended,
+                'generation_cut_rate': sum(o + 1 > recommended for o in outputs) / len(outputs),
+            }
+    return recommendations
+
+
+def print_report(report: Dict, max_length: int, max_new_tokens: int):
+    print(f"\n📄 {report['path']} ({report['samples']} 样本)")
+    header = (f"   {'格式/step_type':32s} {'n':>7s} {'p50':>6s} {'p95':>6s} {'p99':>6s} {'max':>6s} "
+              f"{'输出p99':>7s} {'截断':>7s} {'pad动态':>7s} {'pad定长':>7s} {'生成截断':>7s}")
+    print(header)
+    for fmt, by_type in report['formats'].items():
+        for step_type, s in sorted(by_type.items(), key=lambda kv: (kv[0] != 'all', kv[0])):
+            name = fmt if step_type == 'all' else f"  {step_type}"
+            output_p99 = f"{s['output']['p99']:7d}" if 'output' in s else f"{'-':>7s}"
+            truncation = f"{s['truncation_rate']:7.1%}" if 'truncation_rate' in s else f"{'-':>7s}"
+            cut = f"{s['generation_cut_rate']:7.1%}" if 'generation_cut_rate' in s else f"{'-':>7s}"
+            print(f"   {name:32s} {s['samples']:7d} {s['total']['p50']:6d} {s['total']['p95']:6d} "
+                  f"{s['total']['p99']:6d} {s['total']['max']:6d} {output_p99} {truncation} "
+                  f"{s['pad_waste_dynamic']:7.1%} {s['pad_waste_max_length']:7.1%} {cut}")
+    print(f"   💡 建议（当前 max_length={max_length}, max_new_tokens={max_new_tokens}）:")
+    for name, r in report['recommendations'].items():
+        detail = (f"截断 {r['truncation_rate']:.1%}（当前 {r['current_truncation_rate']:.1%}）"
+                  if 'truncation_rate' in r else f"生成截断 {r['generation_cut_rate']:.1%}")
+        print(f"      {name:28s} = {r['value']:5d}  {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按训练tokenizer分析各训练数据和prompt格式的token预算")
+    parser.add_argument('--inputs', nargs='+', help='训练数据文件（JSON/JSONL/分片glob，默认使用存在的标准输出文件）')
+    parser.add_argument('--tokenizer', type=str, default=DEFAULT_TOKENIZER, help='训练使用的tokenizer')
+    parser.add_argument('--max-length', type=int, default=2048, help='当前训练的max_length')
+    parser.add_argument('--max-new-tokens', type=int, default=512, help='当前推理的max_new_tokens')
+    parser.add_argument('--batch-size', type=int, default=4, help='估计动态padding浪费用的batch大小')
+    parser.add_argument('--workers', type=int, default=4, help='tokenize进程数')
+    parser.add_argument('--output', type=str, help='把完整报告保存为JSON')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Token预算分析")
+    print("=" * 60)
+
+    inputs = args.inputs
+    if not inputs:
+        inputs = [p for p in DEFAULT_INPUTS if Path(p).exists()]
+        skipped = [p for p in DEFAULT_INPUTS if p not in inputs]
+        if not inputs:
+            print(f"❌ 没有找到训练数据文件: {', '.join(DEFAULT_INPUTS)}")
+            return
+        for path in skipped:
+            print(f"⚠️  跳过不存在的默认输入: {path}")
+    print(f"🔤 Tokenizer: {args.tokenizer}")
+
+    reports = []
+    for path in inputs:
+        report = analyze_file(path, args.tokenizer, args.max_length, args.max_new_tokens,
+                              args.batch_size, args.workers)
+        print_report(report, args.max_length, args.max_new_tokens)
+        reports.append(report)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 报告已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,123 +1,279 @@
 """
 脱敏脚本：将file_id转换为匿名序号
-将原始的file_id映射为file_id_001, file_id_002等格式
+将原始的file_id映射为file_id_00001, file_id_00002等格式
+
+映射保存在持久化的SQLite映射库中，按首次出现的顺序增量分配ID：
+已有file_id的编号永远不变，新workflow只会追加新编号。
+每个JSONL文件只流式读写一遍，多个文件可并行脱敏。
 """
 
+import argparse
 import json
 import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+DATA_DIR = Path("data/processed")
+
+# 主输入：在脱敏的同时为新file_id分配编号
+PRIMARY_INPUT = DATA_DIR / "parsed_workflows.jsonl"
+
+# 旧版输出文件名（其余文件输出为 <stem>_anonymized.jsonl）
+LEGACY_OUTPUT_NAMES = {
+    "parsed_workflows.jsonl": "parsed_workflows_anonymized.jsonl",
+    "file_level_instructions_weighted_variants_marked.jsonl": "file_level_instructions_anonymized.jsonl",
+}
+DEFAULT_INPUTS = [
+    PRIMARY_INPUT,
+    DATA_DIR / "file_level_instructions_weighted_variants_marked.jsonl",
+]
+
+
+def anonymized_output_path(input_path: Path) -> Path:
+    name = LEGACY_OUTPUT_NAMES.get(input_path.name, f"{input_path.stem}_anonymized.jsonl")
+    return input_path.with_name(name)
+
 
-def anonymize_file_ids():
+class FileIdMappingStore:
     """
-    脱敏数据中的file_ids，将具体的文件夹和文件名替换为序号
+    持久化的file_id映射库（SQLite）
+
+    - 原始file_id → 序号，序号一旦分配不再改变
+    - 首次使用时从已有的file_id_mapping.json导入，保持历史编号
+    - 导出为file_id_mapping.json，兼容下游脚本
     """
-    data_dir = Path("data/processed")
-    
-    # 输入文件
-    parsed_workflows_path = data_dir / "parsed_workflows.jsonl"
-    file_level_instructions_path = data_dir / "file_level_instructions_weighted_variants_marked.jsonl"
-    
-    # 输出文件
-    anonymized_workflows_path = data_dir / "parsed_workflows_anonymized.jsonl"
-    anonymized_instructions_path = data_dir / "file_level_instructions_anonymized.jsonl"
-    anonymized_mapping_path = data_dir / "file_id_mapping.json"
-    
-    # 第1步：读取parsed_workflows.jsonl并收集所有唯一的file_ids
-    print("Step 1: 收集所有唯一的file_ids...")
-    file_ids_set = OrderedDict()  # 保持顺序
-    
-    if not parsed_workflows_path.exists():
-        print(f"ERROR: {parsed_workflows_path} not found!")
-        return
-    
-    with open(parsed_workflows_path, 'r', encoding='utf-8') as f:
-        for i, line in enumerate(f, 1):
-            try:
-                workflow = json.loads(line.strip())
-                original_file_id = workflow.get("file_id", "")
-                if original_file_id and original_file_id not in file_ids_set:
-                    file_ids_set[original_file_id] = None
-            except json.JSONDecodeError as e:
-                print(f"Warning: 第 {i} 行无法解析: {e}")
-    
-    print(f"找到 {len(file_ids_set)} 个唯一的file_ids")
-    
-    # 第2步：创建file_id映射 (原始file_id -> 序号file_id)
-    print("\nStep 2: 创建file_id映射...")
-    file_id_mapping = {}
-    for idx, original_file_id in enumerate(file_ids_set.keys(), 1):
-        anonymized_id = f"file_id_{idx:05d}"  # file_id_00001, file_id_00002 等
-        file_id_mapping[original_file_id] = anonymized_id
-        if idx <= 10 or idx % 100 == 0:  # 打印前10个和每100个
-            print(f"  {original_file_id:50s} -> {anonymized_id}")
-    
-    # 第3步：脱敏parsed_workflows.jsonl
-    print(f"\nStep 3: 脱敏 {parsed_workflows_path}...")
-    with open(parsed_workflows_path, 'r', encoding='utf-8') as fin, \
-         open(anonymized_workflows_path, 'w', encoding='utf-8') as fout:
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            "seq INTEGER PRIMARY KEY, original TEXT UNIQUE NOT NULL)"
+        )
+        self._cache: Dict[str, int] = dict(
+            self.conn.execute("SELECT original, seq FROM file_ids")
+        )
+        self._next_seq = max(self._cache.values(), default=0) + 1
+        self._new: List[Tuple[int, str]] = []
+
+    @staticmethod
+    def format_id(seq: int) -> str:
+        return f"file_id_{seq:05d}"  # file_id_00001, file_id_00002 等
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def bootstrap_from_json(self, mapping_path: Path) -> int:
+        """映射库为空时导入已有的JSON映射表，返回导入数量"""
+        if self._cache or not mapping_path.exists():
+            return 0
+        with open(mapping_path, 'r', encoding='utf-8') as f:
+            mapping = json.load(f)
+        for original, anonymized in mapping.items():
+            seq = int(anonymized.rsplit('_', 1)[-1])
+            self._cache[original] = seq
+            self._new.append((seq, original))
+        self._next_seq = max(self._cache.values(), default=0) + 1
+        self.commit()
+        return len(mapping)
+
+    def get_or_assign(self, original: str) -> str:
+        """查询映射，不存在时分配下一个序号"""
+        seq = self._cache.get(original)
+        if seq is None:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._cache[original] = seq
+            self._new.append((seq, original))
+        return self.format_id(seq)
+
+    def commit(self) -> int:
+        """写入新分配的映射，返回新增数量"""
+        new_count = len(self._new)
+        if self._new:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO file_ids (seq, original) VALUES (?, ?)", self._new
+                )
+            self._new = []
+        return new_count
+
+    def to_dict(self) -> Dict[str, str]:
+        return {original: self.format_id(seq)
+                for original, seq in sorted(self._cache.items(), key=lambda kv: kv[1])}
+
+    def export_json(self, mapping_path: Path):
+        tmp_path = mapping_path.with_name(mapping_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, mapping_path)
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class FileIdLookup:
+    """
+    只读映射查询：先直接匹配；不带文件夹的file_id再按映射中的文件名匹配
+
+    带文件夹前缀但不在映射中的file_id视为未映射（同一文件名可能出现在多个文件夹中，
+    不能借用其他文件夹的匿名id）
+    """
+
+    def __init__(self, mapping: Dict[str, str]):
+        self.mapping = mapping
+        self.by_basename: Dict[str, str] = {}
+        for original, anonymized in mapping.items():
+            self.by_basename.setdefault(original.split('/')[-1], anonymized)
+
+    def __call__(self, original: str) -> Optional[str]:
+        anonymized = self.mapping.get(original)
+        if anonymized is None and '/' not in original:
+            anonymized = self.by_basename.get(original)
+        return anonymized
+
+
+def anonymize_record(record: Dict, anonymized_id: Optional[str]) -> Dict:
+    """替换file_id，并把file_path中的原始路径换成匿名文件名"""
+    if anonymized_id is None:
+        return record
+    record["file_id"] = anonymized_id
+    if record.get("file_path"):
+        record["file_path"] = f"{anonymized_id}.json"
+    return record
+
+
+def rewrite_jsonl(input_path: Path, output_path: Path, resolve) -> Tuple[int, int]:
+    """
+    流式脱敏单个JSONL文件（只读一遍）
+
+    Args:
+        resolve: 原始file_id → 匿名id（None表示保持原值）
+
+    Returns:
+        (写出行数, 未能映射的行数)
+    """
+    written = unmapped = 0
+    tmp_path = output_path.with_name(output_path.name + '.tmp')
+    with open(input_path, 'r', encoding='utf-8') as fin, \
+         open(tmp_path, 'w', encoding='utf-8') as fout:
         for i, line in enumerate(fin, 1):
+            if not line.strip():
+                continue
             try:
-                workflow = json.loads(line.strip())
-                original_file_id = workflow.get("file_id", "")
-                workflow["file_id"] = file_id_mapping.get(original_file_id, original_file_id)
-                fout.write(json.dumps(workflow, ensure_ascii=False) + "\n")
+                record = json.loads(line)
             except json.JSONDecodeError as e:
-                print(f"Warning: 第 {i} 行无法解析: {e}")
-    
-    print(f"✓ 已脱敏 {i} 行到 {anonymized_workflows_path}")
-    
-    # 第4步：脱敏file_level_instructions_weighted_variants_marked.jsonl（如果存在）
-    print(f"\nStep 4: 脱敏 {file_level_instructions_path}...")
-    if file_level_instructions_path.exists():
-        instruction_count = 0
-        with open(file_level_instructions_path, 'r', encoding='utf-8') as fin, \
-             open(anonymized_instructions_path, 'w', encoding='utf-8') as fout:
-            for i, line in enumerate(fin, 1):
-                try:
-                    instruction = json.loads(line.strip())
-                    original_file_id = instruction.get("file_id", "")
-                    
-                    # 尝试直接映射，如果失败则尝试添加文件夹前缀
-                    if original_file_id in file_id_mapping:
-                        instruction["file_id"] = file_id_mapping[original_file_id]
-                    else:
-                        # 尝试寻找匹配的带有文件夹前缀的key
-                        found = False
-                        for full_file_id, anonymized_id in file_id_mapping.items():
-                            if full_file_id.endswith("/" + original_file_id) or full_file_id.split('/')[-1] == original_file_id:
-                                instruction["file_id"] = anonymized_id
-                                found = True
-                                break
-                        if not found:
-                            # 如果还是没找到，保持原值
-                            instruction["file_id"] = original_file_id
-                    
-                    fout.write(json.dumps(instruction, ensure_ascii=False) + "\n")
-                    instruction_count += 1
-                except json.JSONDecodeError as e:
-                    print(f"Warning: 第 {i} 行无法解析: {e}")
-        
-        print(f"✓ 已脱敏 {instruction_count} 行到 {anonymized_instructions_path}")
-    else:
-        print(f"! {file_level_instructions_path} 不存在，跳过")
-    
-    # 第5步：保存映射表
-    print(f"\nStep 5: 保存映射表...")
-    with open(anonymized_mapping_path, 'w', encoding='utf-8') as f:
-        json.dump(file_id_mapping, f, ensure_ascii=False, indent=2)
-    print(f"✓ 映射表已保存到 {anonymized_mapping_path}")
-    
+                print(f"Warning: {input_path.name} 第 {i} 行无法解析: {e}")
+                continue
+            original_file_id = record.get("file_id", "")
+            anonymized_id = resolve(original_file_id) if original_file_id else None
+            if original_file_id and anonymized_id is None:
+                unmapped += 1
+            fout.write(json.dumps(anonymize_record(record, anonymized_id), ensure_ascii=False) + "\n")
+            written += 1
+    os.replace(tmp_path, output_path)
+    return written, unmapped
+
+
+def _rewrite_with_mapping(args: Tuple[Path, Path, Dict[str, str]]) -> Tuple[Path, int, int]:
+    input_path, output_path, mapping = args
+    written, unmapped = rewrite_jsonl(input_path, output_path, FileIdLookup(mapping))
+    return input_path, written, unmapped
+
+
+def anonymize_file_ids(
+    inputs: Optional[List[Path]] = None,
+    store_path: Path = DATA_DIR / "file_id_mapping.sqlite",
+    mapping_path: Path = DATA_DIR / "file_id_mapping.json",
+    workers: int = 4
+) -> Dict[str, str]:
+    """
+    脱敏数据中的file_ids，将具体的文件夹和文件名替换为序号
+
+    1. 主输入（parsed_workflows.jsonl）流式脱敏，同时为新file_id增量分配编号
+    2. 导出file_id_mapping.json
+    3. 其余文件只查询映射，按文件并行脱敏
+    """
+    inputs = [Path(p) for p in (inputs or DEFAULT_INPUTS)]
+    primary = next((p for p in inputs if p.name == PRIMARY_INPUT.name), None)
+    others = [p for p in inputs if p != primary]
+
+    store = FileIdMappingStore(store_path)
+    imported = store.bootstrap_from_json(mapping_path)
+    if imported:
+        print(f"从 {mapping_path} 导入 {imported} 条已有映射")
+    print(f"映射库: {store_path} ({len(store)} 条映射)")
+
+    # 第1步：主输入单遍脱敏 + 增量分配
+    if primary is not None:
+        if not primary.exists():
+            print(f"ERROR: {primary} not found!")
+            store.close()
+            return {}
+        output_path = anonymized_output_path(primary)
+        print(f"\nStep 1: 脱敏 {primary} -> {output_path}...")
+        written, _ = rewrite_jsonl(primary, output_path, store.get_or_assign)
+        new_count = store.commit()
+        print(f"✓ 已脱敏 {written} 行，新分配 {new_count} 个file_id")
+
+    # 第2步：导出映射表
+    print(f"\nStep 2: 导出映射表...")
+    mapping = store.to_dict()
+    store.export_json(mapping_path)
+    store.close()
+    print(f"✓ 映射表已保存到 {mapping_path}")
+
+    # 第3步：其余文件并行脱敏（只读映射）
+    tasks = []
+    for input_path in others:
+        if input_path.exists():
+            tasks.append((input_path, anonymized_output_path(input_path), mapping))
+        else:
+            print(f"! {input_path} 不存在，跳过")
+
+    if tasks:
+        print(f"\nStep 3: 并行脱敏 {len(tasks)} 个文件 (workers={workers})...")
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(tasks)))) as pool:
+            for input_path, written, unmapped in pool.map(_rewrite_with_mapping, tasks):
+                note = f"，{unmapped} 行未找到映射（保持原值）" if unmapped else ""
+                print(f"✓ {input_path.name}: 已脱敏 {written} 行 -> {anonymized_output_path(input_path).name}{note}")
+
     # 统计信息
     print("\n" + "="*60)
     print("脱敏完成统计：")
-    print(f"  原始file_ids数量: {len(file_id_mapping)}")
-    print(f"  脱敏后的workflow文件: {anonymized_workflows_path}")
-    print(f"  脱敏后的instruction文件: {anonymized_instructions_path}")
-    print(f"  映射表: {anonymized_mapping_path}")
+    print(f"  file_ids数量: {len(mapping)}")
+    for input_path in inputs:
+        print(f"  {input_path.name} -> {anonymized_output_path(input_path).name}")
+    print(f"  映射库: {store_path}")
+    print(f"  映射表: {mapping_path}")
     print("="*60)
-    
-    return file_id_mapping
+
+    return mapping
+
+
+def main():
+    parser = argparse.ArgumentParser(description="脱敏JSONL数据中的file_id")
+    parser.add_argument('--inputs', nargs='+', type=Path,
+                        help='需要脱敏的JSONL文件（默认: parsed_workflows + 文件级指令）')
+    parser.add_argument('--store', type=Path, default=DATA_DIR / "file_id_mapping.sqlite",
+                        help='持久化映射库路径')
+    parser.add_argument('--mapping', type=Path, default=DATA_DIR / "file_id_mapping.json",
+                        help='导出的JSON映射表路径')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='并行脱敏的进程数')
+    args = parser.parse_args()
+
+    anonymize_file_ids(
+        inputs=args.inputs,
+        store_path=args.store,
+        mapping_path=args.mapping,
+        workers=args.workers
+    )
+
 
 if __name__ == "__main__":
-    anonymize_file_ids()
+    main()
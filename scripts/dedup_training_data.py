@@ -0,0 +1,349 @@
+"""
+训练样本近重复去除（MinHash LSH）
+
+位于 prepare_hierarchical_training_data.py 和 split_training_data.py 之间：
+语料中大量 "navigate … tab" / "click … button" 样本只有步骤序号不同。
+
+1. 每个样本取 instruction（数字归一化）+ output，切成词级n-gram（shingle）
+2. 计算MinHash签名（单次排列哈希：每个shingle只算一次哈希，空桶用旋转致密化补齐）
+3. LSH分带：签名切成bands段，同一段完全相同的样本成为候选对，
+   候选对的签名估计相似度 ≥ threshold 时并入同一簇（并查集）
+4. 每个簇最多保留 max_per_cluster 个样本，高质量（is_high_quality）样本优先
+
+整体复杂度与样本数线性相关（每个桶只和少量代表比较），可以处理百万级样本。
+输入流式读取两遍：第一遍只保留每个样本的签名、质量标记和token数，第二遍写出保留的样本。
+节省的token数用 --tokenizer 指定的训练tokenizer统计（训练格式的完整prompt），
+不指定时按约4字符/token估算。
+
+用法:
+    python scripts/dedup_training_data.py
+    python scripts/dedup_training_data.py --threshold 0.9 --max-per-cluster 3
+    python scripts/dedup_training_data.py --tokenizer Qwen/Qwen2.5-Coder-7B-Instruct
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import struct
+import sys
+import time
+from collections import defaultdict
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from training.columnar import iter_samples
+from training.fast_json import INDENT, dumps_indented
+from training.prompts import format_prompt
+
+INPUT_FILE = Path("data/processed/hierarchical_training_data.json")
+OUTPUT_FILE = Path("data/processed/hierarchical_training_data_dedup.json")
+
+WORD_RE = re.compile(r"\w+|[^\w\s]")
+DIGITS_RE = re.compile(r"\d+")
+
+# 每个桶最多与多少个代表比较（保证不会退化成平方复杂度）
+MAX_BUCKET_REPRESENTATIVES = 8
+
+
+def shingles(text: str, n: int = 3) -> set:
+    """词级n-gram集合"""
+    tokens = WORD_RE.findall(text.lower())
+    if len(tokens) < n:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+
+def sample_text(sample: Dict) -> str:
+    """instruction中的数字（步骤序号、进度）归一化，output保持原样"""
+    instruction = DIGITS_RE.sub("0", sample.get('instruction', ''))
+    return f"{instruction}\n{sample.get('output', '')}"
+
+
+class MinHasher:
+    """
+    MinHash签名（单次排列哈希 + 旋转致密化）
+
+    每个shingle只算一次64位哈希：低位决定落入哪个桶，其余位作为桶内取最小的值；
+    空桶借用右侧最近的非空桶的值（加上距离偏移，避免不同来源的值偶然相等）。
+    与k次独立排列的MinHash一样，签名中相等位置的比例是Jaccard相似度的估计，
+    但每个样本的代价与shingle数成正比，而不是 shingle数 × num_perm。
+    """
+
+    EMPTY_OFFSET = 1 << 64
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        self.num_perm = num_perm
+        self.key = struct.pack("<Q", seed)
+
+    def signature(self, shingle_set: Iterable[str]) -> Tuple[int, ...]:
+        k = self.num_perm
+        bins: List[Optional[int]] = [None] * k
+        for s in shingle_set:
+            h = int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8, key=self.key).digest(), "little")
+            b, v = h % k, h // k
+            current = bins[b]
+            if current is None or v < current:
+                bins[b] = v
+        if all(v is None for v in bins):
+            return (0,) * k
+
+        # 旋转致密化：从右向左扫描两圈，记录右侧最近的非空桶
+        signature = [0] * k
+        nearest, distance = None, 0
+        for j in range(2 * k - 1, -1, -1):
+            v = bins[j % k]
+            if v is not None:
+                nearest, distance = v, 0
+            else:
+                distance += 1
+            if j < k:
+                signature[j] = v if v is not None else nearest + distance * self.EMPTY_OFFSET
+        return tuple(signature)
+
+
+_hasher: Optional[MinHasher] = None
+_shingle_size = 3
+_tokenizer = None
+
+
+def _init_worker(num_perm: int, shingle_size: int, tokenizer_name: Optional[str] = None):
+    global _hasher, _shingle_size, _tokenizer
+    _hasher = MinHasher(num_perm)
+    _shingle_size = shingle_size
+    if tokenizer_name:
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, trust_remote_code=True)
+
+
+def approx_tokens(sample: Dict) -> int:
+    """粗略token数（约4字符/token），没有指定tokenizer时用于估算节省"""
+    return (len(sample.get("instruction", "")) + len(sample.get("input", "")) +
+            len(sample.get("output", ""))) // 4
+
+
+def count_tokens(sample: Dict) -> int:
+    """训练时的token数（train_lora.py 的 format_prompt 完整文本）；没有tokenizer时为估算值"""
+    if _tokenizer is None:
+        return approx_tokens(sample)
+    return len(_tokenizer(format_prompt(sample)["text"], add_special_tokens=True)["input_ids"])
+
+
+def _record_of(sample: Dict) -> Tuple[Tuple[int, ...], bool, int]:
+    """(MinHash签名, 是否高质量, token数)"""
+    signature = _hasher.signature(shingles(sample_text(sample), _shingle_size))
+    is_high_quality = bool(sample.get("metadata", {}).get("is_high_quality", False))
+    return signature, is_high_quality, count_tokens(sample)
+
+
+def compute_records(samples: Iterable[Dict], num_perm: int, shingle_size: int, workers: int = 1,
+                    tokenizer_name: Optional[str] = None) -> Iterator[Tuple[Tuple[int, ...], bool, int]]:
+    """按输入顺序逐个产出样本的 (签名, 是否高质量, token数)，不保留样本本身"""
+    if workers <= 1:
+        _init_worker(num_perm, shingle_size, tokenizer_name)
+        yield from map(_record_of, samples)
+        return
+    with Pool(workers, initializer=_init_worker, initargs=(num_perm, shingle_size, tokenizer_name)) as pool:
+        yield from pool.imap(_record_of, samples, chunksize=2000)
+
+
+def choose_bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """选择 (bands, rows)：使LSH的S曲线拐点 (1/b)^(1/r) 最接近阈值"""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        knee = (1 / bands) ** (1 / rows)
+        # 拐点略低于阈值更好（少漏召回，多出的候选会被签名相似度过滤）
+        score = abs(knee - threshold) + (0.05 if knee > threshold else 0)
+        if best is None or score < best[0]:
+            best = (score, bands, rows)
+    return best[1], best[2]
+
+
+def estimated_similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # 保留较小的下标作为根（簇代表是最早出现的样本）
+            if ra < rb:
+                self.parent[rb] = ra
+            else:
+                self.parent[ra] = rb
+
+
+def cluster_near_duplicates(signatures: List[Tuple[int, ...]], threshold: float,
+                            bands: int, rows: int) -> List[int]:
+    """LSH分带 + 签名相似度验证，返回每个样本所属簇的根下标"""
+    uf = UnionFind(len(signatures))
+    for band in range(bands):
+        start = band * rows
+        buckets: Dict[Tuple[int, ...], List[int]] = {}
+        for idx, sig in enumerate(signatures):
+            key = sig[start:start + rows]
+            reps = buckets.get(key)
+            if reps is None:
+                buckets[key] = [idx]
+                continue
+            for rep in reps:
+                if uf.find(rep) == uf.find(idx):
+                    break
+                if estimated_similarity(signatures[rep], sig) >= threshold:
+                    uf.union(rep, idx)
+                    break
+            else:
+                if len(reps) < MAX_BUCKET_REPRESENTATIVES:
+                    reps.append(idx)
+    return [uf.find(i) for i in range(len(signatures))]
+
+
+def select_kept(high_quality: List[bool], roots: List[int], max_per_cluster: int) -> List[int]:
+    """每个簇保留至多max_per_cluster个样本：高质量优先，其次按原始顺序；返回保留下标（保序）"""
+    clusters: Dict[int, List[int]] = defaultdict(list)
+    for idx, root in enumerate(roots):
+        clusters[root].append(idx)
+
+    kept = []
+    for members in clusters.values():
+        members.sort(key=lambda i: (not high_quality[i], i))
+        kept.extend(members[:max_per_cluster])
+    return sorted(kept)
+
+
+def save_kept(input_path: Path, kept_idx: List[int], path: Path):
+    """再流式读一遍输入，只写出保留的样本（JSONL或与 json.dump(indent=2) 相同的JSON数组）"""
+    kept = set(kept_idx)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    jsonl = path.suffix == ".jsonl"
+    with tmp_path.open("w", encoding="utf-8") as f:
+        written = 0
+        for idx, sample in enumerate(iter_samples(str(input_path))):
+            if idx not in kept:
+                continue
+            if jsonl:
+                f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+            else:
+                f.write(("[\n" if written == 0 else ",\n") + INDENT + dumps_indented(sample, INDENT))
+            written += 1
+        if not jsonl:
+            f.write("\n]" if written else "[]")
+    tmp_path.replace(path)
+
+
+def dedup(input_path: Path, threshold: float = 0.85, num_perm: int = 128, shingle_size: int = 3,
+          max_per_cluster: int = 1, workers: int = 1,
+          tokenizer_name: Optional[str] = None) -> Tuple[List[int], Dict]:
+    """流式计算签名并聚类，返回 (保留样本的下标, 统计信息)"""
+    bands, rows = choose_bands(num_perm, threshold)
+
+    start = time.time()
+    signatures: List[Tuple[int, ...]] = []
+    high_quality: List[bool] = []
+    tokens: List[int] = []
+    for signature, is_high_quality, num_tokens in compute_records(
+            iter_samples(str(input_path)), num_perm, shingle_size, workers, tokenizer_name):
+        signatures.append(signature)
+        high_quality.append(is_high_quality)
+        tokens.append(num_tokens)
+    signature_time = time.time() - start
+
+    start = time.time()
+    roots = cluster_near_duplicates(signatures, threshold, bands, rows)
+    kept_idx = select_kept(high_quality, roots, max_per_cluster)
+    cluster_time = time.time() - start
+
+    stats = {
+        "samples_before": len(signatures),
+        "samples_after": len(kept_idx),
+        "clusters": len(set(roots)),
+        "duplicate_clusters": sum(1 for c in _cluster_sizes(roots).values() if c > 1),
+        "tokens_before": sum(tokens),
+        "tokens_after": sum(tokens[i] for i in kept_idx),
+        "tokens_estimated": tokenizer_name is None,
+        "bands": bands,
+        "rows": rows,
+        "signature_seconds": signature_time,
+        "cluster_seconds": cluster_time,
+    }
+    return kept_idx, stats
+
+
+def _cluster_sizes(roots: List[int]) -> Dict[int, int]:
+    sizes: Dict[int, int] = defaultdict(int)
+    for root in roots:
+        sizes[root] += 1
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MinHash LSH去除近重复训练样本")
+    parser.add_argument("--input", type=Path, default=INPUT_FILE, help="输入（JSON数组或JSONL）")
+    parser.add_argument("--output", type=Path, default=OUTPUT_FILE, help="输出（与输入同格式）")
+    parser.add_argument("--threshold", type=float, default=0.85, help="Jaccard相似度阈值")
+    parser.add_argument("--num-perm", type=int, default=128, help="MinHash签名长度")
+    parser.add_argument("--shingle-size", type=int, default=3, help="词级n-gram的n")
+    parser.add_argument("--max-per-cluster", type=int, default=1,
+                        help="每个近重复簇最多保留的样本数（高质量样本优先）")
+    parser.add_argument("--workers", type=int, default=4, help="计算签名的进程数")
+    parser.add_argument("--tokenizer", type=str,
+                        help="训练使用的tokenizer，用于统计节省的token数（不指定时按约4字符/token估算）")
+    parser.add_argument("--tokens-per-second", type=float,
+                        help="训练吞吐（token/s），提供时把节省的token换算成每个epoch节省的时间")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("MinHash LSH 近重复去除")
+    print("=" * 60)
+
+    if not args.input.exists():
+        print(f"❌ 输入文件不存在: {args.input}")
+        return
+
+    print(f"\n📖 流式读取数据: {args.input}")
+    kept_idx, stats = dedup(args.input, args.threshold, args.num_perm, args.shingle_size,
+                            args.max_per_cluster, args.workers, args.tokenizer)
+    print(f"✅ 总样本数: {stats['samples_before']}")
+
+    removed = stats["samples_before"] - stats["samples_after"]
+    saved_tokens = stats["tokens_before"] - stats["tokens_after"]
+    saved_ratio = saved_tokens / stats["tokens_before"] if stats["tokens_before"] else 0.0
+    print(f"\n🔎 LSH: {stats['bands']} bands × {stats['rows']} rows, 阈值 {args.threshold}")
+    print(f"   签名 {stats['signature_seconds']:.1f}s, 聚类 {stats['cluster_seconds']:.1f}s")
+    print(f"✅ 簇数: {stats['clusters']}（其中 {stats['duplicate_clusters']} 个含近重复）")
+    print(f"✅ 保留: {stats['samples_after']} 样本，删除 {removed} "
+          f"({removed / max(stats['samples_before'], 1):.1%})")
+    if stats["tokens_estimated"]:
+        print(f"✅ 约节省 {saved_tokens:,} tokens/epoch（按4字符/token估算，--tokenizer 可精确统计）"
+              f" ({saved_ratio:.1%}，≈ 同比例的epoch时间)")
+    else:
+        print(f"✅ 节省 {saved_tokens:,} tokens/epoch（{args.tokenizer}）"
+              f" ({saved_ratio:.1%}，≈ 同比例的epoch时间)")
+    if args.tokens_per_second:
+        print(f"   按 {args.tokens_per_second:,.0f} tokens/s 计，每个epoch节省约 "
+              f"{saved_tokens / args.tokens_per_second / 60:.1f} 分钟")
+
+    save_kept(args.input, kept_idx, args.output)
+    print(f"\n💾 已保存: {args.output}")
+    print("   split_training_data.py 会优先使用去重后的文件")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,8 @@ import logging
 from tqdm import tqdm
 import random
 
+from aggregate_step_to_file_instructions import FileInstructionAccumulator
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -373,21 +375,28 @@ class WeightedInstructionGenerator:
         return 0
     
     def generate_step_instruction(self, step: Dict) -> Dict[str, Any]:
-        """生成步骤级指令（带权重信息）"""
+        """
+        生成步骤级指令（带权重信息）
+        
+        action/object 是生成时选中的动作词和清理后的对象名（每个模式的第一个关键词
+        就是它选中的动作），下游直接使用，不必再从指令文本里拆分
+        """
         method = step.get('method', '')
+        obj = self._clean_object_name(step.get('object', ''))
         
         # 使用对应的模式生成
         if method in self.action_patterns:
             instruction, weights = self.action_patterns[method](step)
         else:
             # 默认模式
-            obj = self._clean_object_name(step.get('object', ''))
             instruction = f"{method} {obj}"
             weights = [(method, KeywordWeights.NORMAL), (obj, KeywordWeights.MEDIUM)]
         
         return {
             "instruction": instruction,
             "weights": weights,
+            "action": weights[0][0] if weights else method,
+            "object": obj,
             "structure": self._analyze_structure(instruction)
         }
     
@@ -489,6 +498,8 @@ def main():
                        help='在输出中标记关键词权重（**关键** *重要*）')
     parser.add_argument('--max-workflows', type=int,
                        help='最大处理工作流数量（用于测试）')
+    parser.add_argument('--fused-file-level', action='store_true',
+                       help='生成step时在线累加，直接输出聚合后的file级指令（无需再运行aggregate脚本）')
     
     args = parser.parse_args()
     
@@ -530,6 +541,7 @@ def main():
     
     file_output = output_dir / f"file_level_instructions{suffix}.jsonl"
     step_output = output_dir / f"step_level_instructions{suffix}.jsonl"
+    aggregated_output = output_dir / f"file_level_instructions_aggregated{suffix[len('_weighted'):]}.jsonl"
     
     # 生成文件级指令
     logger.info("📝 Generating file-level instructions...")
@@ -560,14 +572,29 @@ def main():
     # 生成步骤级指令
     logger.info("📝 Generating step-level instructions...")
     step_results = []
+    aggregated_results = []
     for workflow in tqdm(workflows, desc="Step-level"):
         file_id = workflow.get("file_id", "")
         is_hq = workflow.get("is_high_quality", False)
         steps = workflow.get("steps", [])
+        test_app = workflow.get("test_app", "")
+        accumulator = FileInstructionAccumulator(file_id) if args.fused_file_level else None
         
         for i, step in enumerate(steps):
             result = generator.generate_step_instruction(step)
             
+            if accumulator is not None:
+                # 生成器已知对象/动作/数据库/应用名，直接累加
+                database = step.get("database", "").replace(':', '')
+                accumulator.add(
+                    action=result["action"],
+                    obj=result["object"],
+                    databases=[database] if database else [],
+                    keywords=result["weights"],
+                    test_app=test_app if test_app and test_app != "Unknown" else None,
+                    is_high_quality=is_hq
+                )
+            
             output = {
                 "file_id": file_id,
                 "step_index": i,
@@ -581,6 +608,9 @@ def main():
                 "structure": result["structure"]  # 结构分析
             }
             step_results.append(output)
+        
+        if accumulator is not None:
+            aggregated_results.append(accumulator.finalize())
     
     with open(step_output, 'w', encoding='utf-8') as f:
         for result in step_results:
@@ -588,11 +618,19 @@ def main():
     
     logger.info(f"✅ Step-level instructions saved to {step_output}")
     
+    if args.fused_file_level:
+        with open(aggregated_output, 'w', encoding='utf-8') as f:
+            for result in aggregated_results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+        logger.info(f"✅ Aggregated file-level instructions saved to {aggregated_output}")
+    
     # 统计信息
     logger.info("\n" + "="*60)
     logger.info("🎉 增强版指令生成完成！")
     logger.info(f"📄 文件级: {file_output}")
     logger.info(f"📝 步骤级: {step_output}")
+    if args.fused_file_level:
+        logger.info(f"📦 聚合文件级: {aggregated_output}")
     logger.info(f"⚙️  选项:")
     logger.info(f"   - 使用同义词变体: {args.use_variants}")
     logger.info(f"   - 标记权重: {args.mark_weights}")
@@ -0,0 +1,150 @@
+"""
+对象分类索引（Object Taxonomy）
+
+对象词表是封闭且很小的（"E MS Kabel", "E HS Aardingstrafo FP", ...），
+因此每个对象只解析一次：对象 → 首词、类型前缀（"E MS"）、类别词（"Kabel"）、电压等级（MS/HS/LS）。
+之后的类别推断只是在驻留ID上做几次计数，并按冻结的对象多重集做LRU缓存。
+
+供 aggregate_step_to_file_instructions.py 和 analyze_multiple_objects.py 共用。
+"""
+import json
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# 不作为类别词的修饰词
+NON_CATEGORY_WORDS = frozenset(['FP', 'E', 'MS', 'HS', 'LS', 'Sec'])
+VOLTAGE_CLASSES = ('MS', 'HS', 'LS')
+
+# 冻结的对象多重集：按首次出现顺序排列的 (对象ID, 出现次数)
+FrozenObjects = Tuple[Tuple[int, int], ...]
+
+
+class ObjectEntry(NamedTuple):
+    """单个对象的预计算分类信息"""
+    name: str
+    head: Optional[str]       # 首词（多词对象才有），如 "E"
+    prefix: Optional[str]     # 类型前缀，如 "E MS"
+    category: Optional[str]   # 类别词，如 "Kabel"
+    voltage: Optional[str]    # 电压等级，如 "MS"
+
+
+def parse_object(name: str) -> ObjectEntry:
+    """解析对象名（每个对象只调用一次）"""
+    parts = name.split()
+    words = [w for w in parts if w not in NON_CATEGORY_WORDS]
+    voltage = next((w for w in parts if w in VOLTAGE_CLASSES), None)
+    return ObjectEntry(
+        name=name,
+        head=parts[0] if ' ' in name else None,
+        prefix=' '.join(parts[:2]) if len(parts) >= 2 else None,
+        category=words[-1] if words else None,
+        voltage=voltage
+    )
+
+
+class ObjectTaxonomy:
+    """对象 → 分类信息 的驻留索引，带LRU缓存的类别推断"""
+
+    def __init__(self, vocabulary: Iterable[str] = (), cache_size: int = 4096):
+        self._ids: Dict[str, int] = {}
+        self.entries: List[ObjectEntry] = []
+        for name in vocabulary:
+            self.intern(name)
+        self._infer_cached = lru_cache(maxsize=cache_size)(self._infer_category)
+        self._head_cached = lru_cache(maxsize=cache_size)(self._most_common_head)
+
+    @classmethod
+    def from_jsonl(cls, path: Path, field: str = 'objects') -> 'ObjectTaxonomy':
+        """从file级指令JSONL的objects字段预建索引"""
+        taxonomy = cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    for name in json.loads(line).get(field, []):
+                        taxonomy.intern(name)
+        return taxonomy
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def intern(self, name: str) -> int:
+        """返回对象ID，首次出现时解析并登记"""
+        obj_id = self._ids.get(name)
+        if obj_id is None:
+            obj_id = len(self.entries)
+            self._ids[name] = obj_id
+            self.entries.append(parse_object(name))
+        return obj_id
+
+    def entry(self, name: str) -> ObjectEntry:
+        return self.entries[self.intern(name)]
+
+    def freeze(self, objects: Iterable[str]) -> FrozenObjects:
+        """对象列表 → 冻结多重集（保留首次出现顺序，决定计数并列时的结果）"""
+        counts: Dict[int, int] = {}
+        for name in objects:
+            obj_id = self.intern(name)
+            counts[obj_id] = counts.get(obj_id, 0) + 1
+        return tuple(counts.items())
+
+    def freeze_counts(self, object_counts: Iterable[Tuple[str, int]]) -> FrozenObjects:
+        """已计数的 (对象, 次数) → 冻结多重集"""
+        return tuple((self.intern(name), count) for name, count in object_counts)
+
+    def infer_category(self, objects: Iterable[str]) -> str:
+        """从对象列表推断对象类别（高层次概括）"""
+        return self._infer_cached(self.freeze(objects))
+
+    def infer_category_counts(self, object_counts: Iterable[Tuple[str, int]]) -> str:
+        return self._infer_cached(self.freeze_counts(object_counts))
+
+    def most_common_head(self, unique_objects: Iterable[str]) -> Optional[str]:
+        """多词对象中最常见的首词（如"E MS Kabel"中的"E"）"""
+        return self._head_cached(tuple(self.intern(name) for name in unique_objects))
+
+    def voltage_classes(self, objects: Iterable[str]) -> List[str]:
+        """对象列表涉及的电压等级（按首次出现保序）"""
+        seen = dict.fromkeys(self.entry(name).voltage for name in objects)
+        return [v for v in seen if v]
+
+    def _infer_category(self, frozen: FrozenObjects) -> str:
+        if not frozen:
+            return "objects"
+
+        # 类型前缀计数（如 E MS, E HS）
+        type_counts = Counter()
+        for obj_id, count in frozen:
+            prefix = self.entries[obj_id].prefix
+            if prefix:
+                type_counts[prefix] += count
+
+        if type_counts:
+            most_common = type_counts.most_common(2)
+            if len(most_common) == 1:
+                return f"{most_common[0][0]} components"
+            return f"{most_common[0][0]}/{most_common[1][0]} components"
+
+        # 类别关键词计数（如 Kabel, Installatie, Aardingstrafo）
+        category_counts = Counter()
+        for obj_id, count in frozen:
+            category = self.entries[obj_id].category
+            if category:
+                category_counts[category] += count
+
+        if category_counts:
+            main_category, main_count = category_counts.most_common(1)[0]
+            if main_count > 1:
+                return f"{main_category} components"
+            return "electrical components"
+
+        return "objects"
+
+    def _most_common_head(self, object_ids: Tuple[int, ...]) -> Optional[str]:
+        head_counts = Counter(self.entries[i].head for i in object_ids if self.entries[i].head)
+        return head_counts.most_common(1)[0][0] if head_counts else None
+
+
+# 进程内共享的默认索引
+OBJECT_TAXONOMY = ObjectTaxonomy()
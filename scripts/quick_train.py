@@ -6,6 +6,7 @@
   python scripts/quick_train.py           # 使用默认配置
   python scripts/quick_train.py --test    # 快速测试模式
   python scripts/quick_train.py --full    # 完整训练
+  python scripts/quick_train.py --benchmark  # CPU小模型训练基准（不下载模型、不需要GPU）
 """
 
 import os
@@ -113,6 +114,11 @@ class QuickTrainer:
         
         self.run_command(cmd, "LoRA微调训练")
     
+    def benchmark(self):
+        """CPU小模型训练基准（src/training/benchmark.py）"""
+        self.check_dependencies()
+        self.run_command([sys.executable, 'src/training/benchmark.py'], "CPU小模型训练基准")
+    
     def run(self):
         """执行完整训练流程"""
         logger.info("="*70)
@@ -158,9 +164,15 @@ def main():
                        help='测试模式（小数据集，快速验证）')
     parser.add_argument('--full', action='store_true',
                        help='完整训练模式')
+    parser.add_argument('--benchmark', action='store_true',
+                       help='CPU小模型训练基准（随机初始化的小模型，结果写到benchmarks/）')
     
     args = parser.parse_args()
     
+    if args.benchmark:
+        QuickTrainer().benchmark()
+        return
+    
     # 默认使用测试模式
     test_mode = not args.full
     
@@ -1,129 +1,144 @@
 """
-将层次化训练数据分割为训练集和验证集
+将层次化训练数据分割为训练集、验证集（和可选的测试集）
+
+按file_id的稳定哈希划分（src/training/hash_split.py）：同一个文件的所有步骤都在同一个集合，
+新增数据不会让已有文件换集合。输入逐条流式读取（JSON数组按块解析，JSONL逐行，或列式分片），
+输出JSONL或列式分片（--format parquet/arrow）。
 
 用法:
     python scripts/split_training_data.py
+    python scripts/split_training_data.py --input data/processed/shards/*.jsonl --test-ratio 0.05
+    python scripts/split_training_data.py --stratify test_app is_high_quality
 """
 
+import argparse
 import json
-import random
+import sys
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from training.columnar import ColumnarShardWriter, iter_samples
+from training.hash_split import DEFAULT_SEED, SPLITS, HashSplitter
 
 # 配置
-INPUT_FILE = Path("data/processed/hierarchical_training_data.json")
+# 去重后的数据（scripts/dedup_training_data.py）比原始层次化数据新时使用去重后的数据
+DEDUP_FILE = Path("data/processed/hierarchical_training_data_dedup.json")
+REGULAR_FILE = Path("data/processed/hierarchical_training_data.json")
 OUTPUT_DIR = Path("data/training")
-TRAIN_FILE = OUTPUT_DIR / "training_data_train.json"
-VAL_FILE = OUTPUT_DIR / "training_data_val.json"
+OUTPUT_PREFIX = "training_data"
+ASSIGNMENTS_FILE = OUTPUT_DIR / "split_assignments.jsonl"
 VAL_RATIO = 0.1  # 10%验证集
-RANDOM_SEED = 42
 
-def split_by_file_id(data: List[Dict], val_ratio: float = 0.1) -> tuple:
+
+def split_stream(input_files, output_dir: Path, splitter: HashSplitter, prefix: str = OUTPUT_PREFIX,
+                 fmt: str = 'jsonl', shard_size: int = 50000):
     """
-    按file_id分割数据，确保同一个文件的所有步骤都在同一个集合中
-    
-    Args:
-        data: 训练数据列表
-        val_ratio: 验证集比例
-    
+    单遍流式划分：每个样本读入后立即写到对应集合的JSONL（或列式分片）
+
     Returns:
-        (train_data, val_data) 元组
+        (每个集合的样本数, 每个集合的输出路径)
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    active = [s for s in SPLITS if splitter.ratios[s] > 0]
+    sample_counts = Counter()
+    if fmt == 'jsonl':
+        paths = {s: output_dir / f"{prefix}_{s}.jsonl" for s in active}
+        handles = {s: open(paths[s], 'w', encoding='utf-8') for s in active}
+        write = lambda split, sample: handles[split].write(json.dumps(sample, ensure_ascii=False) + '\n')
+    else:
+        paths = {s: output_dir / f"{prefix}_{s}-*.{fmt}" for s in active}
+        handles = {s: ColumnarShardWriter(output_dir / f"{prefix}_{s}", shard_size, fmt) for s in active}
+        write = lambda split, sample: handles[split].write(sample)
+    try:
+        for path in input_files:
+            for sample in iter_samples(str(path)):
+                split = splitter.assign_sample(sample)
+                write(split, sample)
+                sample_counts[split] += 1
+    finally:
+        for handle in handles.values():
+            handle.close()
+    splitter.save()
+    return sample_counts, paths
+
+
+def default_input_file() -> Path:
+    """
+    未指定 --input 时的输入：去重文件比层次化数据新时用去重文件，否则用层次化数据
+
+    层次化数据重新生成后没有重新去重时，去重文件已过期，不能静默使用
     """
-    # 按file_id分组
-    file_groups = {}
-    for sample in data:
-        file_id = sample["metadata"]["file_id"]
-        if file_id not in file_groups:
-            file_groups[file_id] = []
-        file_groups[file_id].append(sample)
-    
-    # 获取所有file_id并打乱
-    file_ids = list(file_groups.keys())
-    random.seed(RANDOM_SEED)
-    random.shuffle(file_ids)
-    
-    # 计算验证集大小
-    num_val_files = max(1, int(len(file_ids) * val_ratio))
-    val_file_ids = set(file_ids[:num_val_files])
-    
-    # 分割数据
-    train_data = []
-    val_data = []
-    
-    for file_id, samples in file_groups.items():
-        if file_id in val_file_ids:
-            val_data.extend(samples)
-        else:
-            train_data.extend(samples)
-    
-    return train_data, val_data
+    if not DEDUP_FILE.exists():
+        return REGULAR_FILE
+    if REGULAR_FILE.exists() and DEDUP_FILE.stat().st_mtime < REGULAR_FILE.stat().st_mtime:
+        print(f"⚠️  {DEDUP_FILE} 比 {REGULAR_FILE} 旧（层次化数据重新生成后未去重），使用 {REGULAR_FILE}")
+        print("   重新运行 scripts/dedup_training_data.py，或用 --input 指定输入")
+        return REGULAR_FILE
+    print(f"📂 使用去重后的数据 {DEDUP_FILE}（可用 --input 指定）")
+    return DEDUP_FILE
 
 
 def main():
+    parser = argparse.ArgumentParser(description="按file_id哈希划分训练/验证/测试集")
+    parser.add_argument('--input', nargs='+',
+                        help='输入文件（JSON数组或JSONL，可传多个分片；默认为层次化数据，'
+                             '去重后的文件更新时用去重文件）')
+    parser.add_argument('--output-dir', type=str, default=str(OUTPUT_DIR), help='输出目录')
+    parser.add_argument('--prefix', type=str, default=OUTPUT_PREFIX,
+                        help='输出文件前缀（{prefix}_train.jsonl 等）')
+    parser.add_argument('--val-ratio', type=float, default=VAL_RATIO, help='验证集文件比例')
+    parser.add_argument('--test-ratio', type=float, default=0.0, help='测试集文件比例（默认不划分测试集）')
+    parser.add_argument('--format', choices=['jsonl', 'parquet', 'arrow'], default='jsonl',
+                        help='输出格式：jsonl，或列式分片parquet/arrow')
+    parser.add_argument('--shard-size', type=int, default=50000, help='列式分片的样本数')
+    parser.add_argument('--seed', type=str, default=DEFAULT_SEED, help='哈希种子')
+    parser.add_argument('--stratify', nargs='*', default=[],
+                        help='分层字段，如 test_app is_high_quality')
+    parser.add_argument('--assignments', type=str, default=str(ASSIGNMENTS_FILE),
+                        help='file_id → 集合 的分配记录（分层时保证已有文件不移动）')
+    args = parser.parse_args()
+
     print("=" * 60)
-    print("分割层次化训练数据")
+    print("分割层次化训练数据（file_id哈希）")
     print("=" * 60)
-    
-    # 检查输入文件
-    if not INPUT_FILE.exists():
-        print(f"❌ 输入文件不存在: {INPUT_FILE}")
+
+    input_files = [Path(p) for p in args.input] if args.input else [default_input_file()]
+    missing = [p for p in input_files if not p.exists()]
+    if missing:
+        print(f"❌ 输入文件不存在: {', '.join(str(p) for p in missing)}")
         return
-    
-    # 创建输出目录
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    
-    # 读取数据
-    print(f"\n📖 读取数据: {INPUT_FILE}")
-    with INPUT_FILE.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    
-    print(f"✅ 总样本数: {len(data)}")
-    
-    # 统计file数量
-    file_ids = set(sample["metadata"]["file_id"] for sample in data)
-    print(f"✅ 总文件数: {len(file_ids)}")
-    
-    # 分割数据
-    print(f"\n🔀 分割数据 (验证集比例: {VAL_RATIO*100:.1f}%)")
-    train_data, val_data = split_by_file_id(data, val_ratio=VAL_RATIO)
-    
-    print(f"✅ 训练集: {len(train_data)} 样本")
-    print(f"✅ 验证集: {len(val_data)} 样本")
-    
-    # 验证集文件统计
-    train_files = set(s["metadata"]["file_id"] for s in train_data)
-    val_files = set(s["metadata"]["file_id"] for s in val_data)
-    print(f"✅ 训练集文件: {len(train_files)}")
-    print(f"✅ 验证集文件: {len(val_files)}")
-    
-    # 确保没有重叠
-    overlap = train_files & val_files
-    if overlap:
-        print(f"⚠️  警告: {len(overlap)} 个文件同时出现在训练集和验证集")
-    else:
-        print("✅ 训练集和验证集无重叠")
-    
-    # 保存数据
-    print(f"\n💾 保存训练集: {TRAIN_FILE}")
-    with TRAIN_FILE.open("w", encoding="utf-8") as f:
-        json.dump(train_data, f, ensure_ascii=False, indent=2)
-    
-    print(f"💾 保存验证集: {VAL_FILE}")
-    with VAL_FILE.open("w", encoding="utf-8") as f:
-        json.dump(val_data, f, ensure_ascii=False, indent=2)
-    
-    # 显示示例
-    print("\n" + "=" * 60)
-    print("训练集示例:")
-    print("=" * 60)
-    print(json.dumps(train_data[0], ensure_ascii=False, indent=2)[:500] + "...")
-    
+
+    splitter = HashSplitter(
+        val_ratio=args.val_ratio,
+        test_ratio=args.test_ratio,
+        seed=args.seed,
+        stratify_by=args.stratify,
+        assignments_file=args.assignments if args.stratify else None
+    )
+
+    print(f"\n📖 读取数据: {', '.join(str(p) for p in input_files)}")
+    print(f"🔀 分割数据 (验证集 {args.val_ratio*100:.1f}%, 测试集 {args.test_ratio*100:.1f}%"
+          f"{', 分层: ' + '/'.join(args.stratify) if args.stratify else ''})")
+    sample_counts, paths = split_stream(input_files, Path(args.output_dir), splitter, args.prefix,
+                                       args.format, args.shard_size)
+
+    file_counts = splitter.file_counts()
+    print(f"✅ 总样本数: {sum(sample_counts.values())}")
+    print(f"✅ 总文件数: {sum(file_counts.values())}")
+
+    if args.stratify:
+        print("\n📊 各层文件分布 (train / val / test):")
+        for stratum, counts in sorted(splitter.stratum_counts.items()):
+            print(f"   {'/'.join(stratum):40s} {counts['train']:6d} / {counts['val']:5d} / {counts['test']:5d}")
+
     print("\n" + "=" * 60)
     print("✅ 分割完成！")
     print("=" * 60)
-    print(f"训练集: {TRAIN_FILE} ({len(train_data)} 样本, {len(train_files)} 文件)")
-    print(f"验证集: {VAL_FILE} ({len(val_data)} 样本, {len(val_files)} 文件)")
-    
+    for split, path in paths.items():
+        print(f"{split:5s}: {path} ({sample_counts[split]} 样本, {file_counts[split]} 文件)")
+
 
 if __name__ == "__main__":
     main()
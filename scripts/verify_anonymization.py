@@ -1,24 +1,344 @@
-"""验证脱敏数据"""
+"""
+验证脱敏数据：扫描所有产物中残留的原始文件夹名/文件名
+
+file_id_mapping.json 中的每个原始标识（完整file_id、文件夹名、文件名）被编译成
+扫描器，对处理后和训练用的JSONL/JSON产物按块并行流式扫描，报告每处泄漏的
+文件:行:列、命中的原始标识以及所在的JSON字段路径。发现泄漏时以非零状态退出，
+可直接作为每次导出的检查关卡。
+
+两种匹配模式：
+- 默认（按词匹配）：标识必须作为完整的词出现（[A-Za-z0-9_]连续串）。
+  每个块先用正则切词再与标识集合求交集，绝大多数无泄漏的块只走一次C级别的扫描。
+- --substring：Aho–Corasick自动机做任意子串匹配（更严格，也更慢）。
+"""
+
+import argparse
 import json
+import os
+import re
+import sys
+from collections import deque
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+DATA_DIR = Path("data/processed")
+MAPPING_PATH = DATA_DIR / "file_id_mapping.json"
+
+# 默认扫描目标：脱敏后的处理产物 + 训练数据
+DEFAULT_TARGETS = [
+    "data/processed/*anonymized*.jsonl",
+    "data/processed/*normalized*.jsonl",
+    "data/training/**/*.json",
+    "data/training/**/*.jsonl",
+]
+
+TOKEN_RE = re.compile(r"[A-Za-z0-9_]+")
+CHUNK_BYTES = 32 * 1024 * 1024
+
+# 一处泄漏：(文件, 行号, 列号, 原始标识, JSON字段路径)
+Leak = Tuple[str, int, int, str, Optional[str]]
+
+
+def load_identifiers(mapping_path: Path, min_length: int = 4) -> Dict[str, str]:
+    """原始标识 → 类型（file_id / folder / file），过短的标识会被忽略"""
+    with open(mapping_path, 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+
+    identifiers: Dict[str, str] = {}
+    for original in mapping:
+        parts = original.split('/')
+        candidates = [(original, 'file_id'), (parts[-1], 'file')]
+        candidates += [(folder, 'folder') for folder in parts[:-1]]
+        for identifier, kind in candidates:
+            if len(identifier) >= min_length:
+                identifiers.setdefault(identifier, kind)
+    return identifiers
+
+
+class AhoCorasick:
+    """字符级Aho–Corasick自动机：一次扫描找出所有模式串的所有出现位置"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+        for pattern in patterns:
+            self._insert(pattern)
+        self._build_failure_links()
+
+    def _insert(self, pattern: str) -> None:
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        self.output[node].append(pattern)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """产出 (起始位置, 模式串)"""
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern in output[node]:
+                yield i - len(pattern) + 1, pattern
+
+
+class LeakScanner:
+    """在文本块中查找原始标识"""
+
+    def __init__(self, identifiers: Iterable[str], substring: bool = False):
+        self.substring = substring
+        identifiers = set(identifiers)
+        # 能作为完整词匹配的标识走集合交集；含其它字符的（以及--substring）走自动机
+        if substring:
+            self.token_set: Set[str] = set()
+            automaton_patterns = identifiers
+        else:
+            self.token_set = {i for i in identifiers if TOKEN_RE.fullmatch(i)}
+            # 含完整词的标识（如 "folder/file" 中的file）已由该词覆盖
+            automaton_patterns = {
+                i for i in identifiers - self.token_set
+                if self.token_set.isdisjoint(TOKEN_RE.findall(i))
+            }
+        self.automaton = AhoCorasick(automaton_patterns) if automaton_patterns else None
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """产出 (位置, 原始标识)，按位置排序"""
+        matches: List[Tuple[int, str]] = []
+        if self.token_set and not self.token_set.isdisjoint(TOKEN_RE.findall(text)):
+            matches.extend((m.start(), m.group()) for m in TOKEN_RE.finditer(text)
+                           if m.group() in self.token_set)
+        if self.automaton is not None:
+            matches.extend(self.automaton.iter_matches(text))
+        return iter(sorted(matches))
+
+    def has_match(self, text: str) -> bool:
+        return next(self.iter_matches(text), None) is not None
+
+
+def find_field_path(value, identifier: str, path: str = "") -> Optional[str]:
+    """在解析后的JSON中找到包含标识的第一个字段路径，如 steps[3].test_data.file_path"""
+    if isinstance(value, str):
+        return path or "$" if identifier in value else None
+    if isinstance(value, dict):
+        for key, child in value.items():
+            child_path = f"{path}.{key}" if path else str(key)
+            if identifier in str(key):
+                return child_path + " (key)"
+            found = find_field_path(child, identifier, child_path)
+            if found:
+                return found
+    elif isinstance(value, list):
+        for i, child in enumerate(value):
+            found = find_field_path(child, identifier, f"{path}[{i}]")
+            if found:
+                return found
+    return None
+
+
+def iter_chunk_ranges(path: Path, chunk_bytes: int = CHUNK_BYTES) -> Iterator[Tuple[int, int]]:
+    """把文件切成以换行对齐的字节区间"""
+    size = path.stat().st_size
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            yield start, end
+            start = end
+
+
+_scanner: Optional[LeakScanner] = None
+
+
+def _init_worker(identifiers: List[str], substring: bool) -> None:
+    global _scanner
+    _scanner = LeakScanner(identifiers, substring=substring)
+
+
+def _scan_chunk(task: Tuple[str, int, int, int]) -> Tuple[str, int, int, List[Tuple[int, int, str, Optional[str]]]]:
+    """
+    扫描一个块
+
+    Returns:
+        (文件, 块序号, 块内行数, [(块内行号, 列号, 标识, 字段路径)])
+    """
+    path, index, start, end = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8', errors='replace')
+    line_count = text.count('\n') + (0 if text.endswith('\n') or not text else 1)
+
+    leaks = []
+    if _scanner.has_match(text):
+        for line_no, line in enumerate(text.split('\n'), 1):
+            matches = list(_scanner.iter_matches(line))
+            if not matches:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None  # 缩进格式的JSON：只报告行列
+            for col, identifier in matches:
+                field_path = find_field_path(record, identifier) if record is not None else None
+                leaks.append((line_no, col + 1, identifier, field_path))
+    return path, index, line_count, leaks
+
+
+def resolve_targets(targets: Iterable[str], exclude: Iterable[Path]) -> List[Path]:
+    excluded = {Path(p).resolve() for p in exclude}
+    paths: Dict[Path, None] = {}
+    for target in targets:
+        if Path(target).exists():
+            matched = [Path(target)]
+        else:
+            matched = sorted(Path('.').glob(target))
+        for path in matched:
+            if path.is_file() and path.resolve() not in excluded:
+                paths.setdefault(path)
+    return list(paths)
+
+
+def scan_paths(paths: List[Path], identifiers: Iterable[str], workers: int = 4,
+               substring: bool = False, chunk_bytes: int = CHUNK_BYTES) -> List[Leak]:
+    """并行扫描所有文件，返回按文件和行号排序的泄漏列表"""
+    tasks = []
+    for path in paths:
+        for index, (start, end) in enumerate(iter_chunk_ranges(path, chunk_bytes)):
+            tasks.append((str(path), index, start, end))
+
+    # 每个块只知道块内行号，汇总后按块顺序换算成全局行号
+    results: Dict[str, Dict[int, Tuple[int, list]]] = {}
+    with Pool(max(1, workers), initializer=_init_worker,
+              initargs=(list(identifiers), substring)) as pool:
+        for path, index, line_count, leaks in pool.imap_unordered(_scan_chunk, tasks):
+            results.setdefault(path, {})[index] = (line_count, leaks)
+
+    all_leaks: List[Leak] = []
+    for path in paths:
+        offset = 0
+        chunks = results.get(str(path), {})
+        for index in sorted(chunks):
+            line_count, leaks = chunks[index]
+            for line_no, col, identifier, field_path in leaks:
+                all_leaks.append((str(path), offset + line_no, col, identifier, field_path))
+            offset += line_count
+    return all_leaks
+
+
+def print_samples():
+    """打印脱敏数据样例和映射统计"""
+    print('Sample from parsed_workflows_anonymized.jsonl:')
+    with open('data/processed/parsed_workflows_anonymized.jsonl', 'r', encoding='utf-8') as f:
+        for i in range(3):
+            line = f.readline()
+            data = json.loads(line)
+            print(f'  {i+1}. file_id: {data["file_id"]}, steps: {data["total_steps"]}')
+
+    print('\nSample from file_level_instructions_anonymized.jsonl:')
+    with open('data/processed/file_level_instructions_anonymized.jsonl', 'r', encoding='utf-8') as f:
+        for i in range(3):
+            line = f.readline()
+            data = json.loads(line)
+            print(f'  {i+1}. file_id: {data["file_id"]}, step_idx: {data.get("step_idx", "N/A")}')
+
+    print('\nMapping statistics:')
+    with open(MAPPING_PATH, 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+        print(f'  Total mappings: {len(mapping)}')
+        print(f'  First 5 mappings:')
+        for i, (orig, anon) in enumerate(list(mapping.items())[:5]):
+            print(f'    {orig:50s} -> {anon}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="扫描脱敏产物中残留的原始文件夹名/文件名")
+    parser.add_argument('paths', nargs='*',
+                        help='要扫描的文件或glob（默认: 脱敏后的处理产物和训练数据）')
+    parser.add_argument('--mapping', type=Path, default=MAPPING_PATH,
+                        help='file_id映射表')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4,
+                        help='并行扫描的进程数')
+    parser.add_argument('--min-length', type=int, default=4,
+                        help='短于此长度的原始标识不参与匹配')
+    parser.add_argument('--ignore', nargs='+', default=[],
+                        help='不视为泄漏的原始标识（如通用的文件夹名）')
+    parser.add_argument('--substring', action='store_true',
+                        help='用Aho–Corasick做任意子串匹配（默认按完整词匹配）')
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES // (1024 * 1024),
+                        help='每个扫描块的大小(MB)')
+    parser.add_argument('--max-report', type=int, default=50,
+                        help='最多打印的泄漏条数')
+    parser.add_argument('--samples', action='store_true',
+                        help='只打印脱敏样例和映射统计')
+    args = parser.parse_args()
+
+    if args.samples:
+        print_samples()
+        return
+
+    if not args.mapping.exists():
+        print(f"ERROR: {args.mapping} not found!")
+        sys.exit(2)
+
+    identifiers = load_identifiers(args.mapping, args.min_length)
+    for identifier in args.ignore:
+        identifiers.pop(identifier, None)
+    store_path = args.mapping.with_suffix('.sqlite')
+    paths = resolve_targets(args.paths or DEFAULT_TARGETS, exclude=[args.mapping, store_path])
+    if not paths:
+        print("没有找到需要扫描的文件")
+        return
+
+    total_bytes = sum(p.stat().st_size for p in paths)
+    mode = 'substring' if args.substring else 'token'
+    print(f"扫描 {len(paths)} 个文件 ({total_bytes / 1024 / 1024:.1f} MB)，"
+          f"{len(identifiers)} 个原始标识，模式: {mode}，workers={args.workers}")
+
+    leaks = scan_paths(paths, identifiers, workers=args.workers,
+                       substring=args.substring, chunk_bytes=args.chunk_mb * 1024 * 1024)
+
+    if not leaks:
+        print("✓ 未发现原始标识泄漏")
+        return
+
+    print(f"\n✗ 发现 {len(leaks)} 处泄漏:")
+    for path, line_no, col, identifier, field_path in leaks[:args.max_report]:
+        location = f" [{field_path}]" if field_path else ""
+        print(f"  {path}:{line_no}:{col}: {identifier} ({identifiers[identifier]}){location}")
+    if len(leaks) > args.max_report:
+        print(f"  ... 还有 {len(leaks) - args.max_report} 处")
+
+    per_file: Dict[str, int] = {}
+    for leak in leaks:
+        per_file[leak[0]] = per_file.get(leak[0], 0) + 1
+    print("\n按文件统计:")
+    for path, count in per_file.items():
+        print(f"  {path}: {count}")
+    sys.exit(1)
+
 
-print('Sample from parsed_workflows_anonymized.jsonl:')
-with open('data/processed/parsed_workflows_anonymized.jsonl', 'r', encoding='utf-8') as f:
-    for i in range(3):
-        line = f.readline()
-        data = json.loads(line)
-        print(f'  {i+1}. file_id: {data["file_id"]}, steps: {data["total_steps"]}')
-
-print('\nSample from file_level_instructions_anonymized.jsonl:')
-with open('data/processed/file_level_instructions_anonymized.jsonl', 'r', encoding='utf-8') as f:
-    for i in range(3):
-        line = f.readline()
-        data = json.loads(line)
-        print(f'  {i+1}. file_id: {data["file_id"]}, step_idx: {data.get("step_idx", "N/A")}')
-
-print('\nMapping statistics:')
-with open('data/processed/file_id_mapping.json', 'r', encoding='utf-8') as f:
-    mapping = json.load(f)
-    print(f'  Total mappings: {len(mapping)}')
-    print(f'  First 5 mappings:')
-    for i, (orig, anon) in enumerate(list(mapping.items())[:5]):
-        print(f'    {orig:50s} -> {anon}')
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,15 @@ Analyze the relationship between empty steps and modules.
 """
 
 import json
+import sys
 from collections import defaultdict
+from pathlib import Path
 import logging
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from data_processing.step_classification import step_has_data
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -34,10 +40,7 @@ def analyze_empty_steps_by_module(workflows_path: str):
             combined = f"{module} -> {method}"
             
             # Check if empty
-            has_create = bool(step['test_data']['create'])
-            has_update = bool(step['test_data']['update'])
-            has_editor = bool(step['test_data']['editor'])
-            is_empty = not (has_create or has_update or has_editor)
+            is_empty = not step_has_data(step)
             
             # Update module stats
             module_stats[module]["total"] += 1
@@ -5,6 +5,7 @@ Includes module-based classification and context-aware instruction generation.
 
 import json
 import os
+import sys
 from pathlib import Path
 from typing import Dict, List, Any, Literal, Optional
 import logging
@@ -12,36 +13,19 @@ from openai import OpenAI
 import dashscope
 from http import HTTPStatus
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Module classification based on data analysis
-NAVIGATION_MODULES = {
-    "Tabs": {"methods": ["Select Tab"], "type": "navigation"},
-    "Buttons": {"methods": ["Click Oneshot Button"], "type": "navigation"},
-    "Datamodel Consistency Check": {"methods": ["Datamodel Check"], "type": "validation"}
-}
+sys.path.insert(0, str(Path(__file__).parent.parent))
 
-DATA_RICH_MODULES = {
-    "Editor(s)": {
-        "methods": ["Open Object", "Open Object with ID", "Verify Field", "Switch Spatial Context"],
-        "type": "editor"
-    },
-    "Hierarchy Viewer": {
-        "methods": ["Select first HV object", "Select second HV object"],
-        "type": "hierarchy"
-    },
-    "Datamodel CRUD": {
-        "methods": ["Create", "Update"],
-        "type": "crud"
-    }
-}
-
-# Special cases
-SPECIAL_CASES = {
-    ("Datamodel CRUD", "Delete"): "empty"
-}
+from data_processing.step_classification import (
+    NAVIGATION_MODULES,
+    DATA_RICH_MODULES,
+    SPECIAL_CASES,
+    NAVIGATION_TYPES,
+    classify_step,
+    classify_steps,
+)
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 class InstructionGenerator:
     """Generate instructions using LLMs (OpenAI GPT-4 and Tongyi Qianwen)."""
@@ -130,27 +114,7 @@ Instruction:"""
     
     def _classify_step(self, step: Dict[str, Any]) -> str:
         """Classify step as navigation, validation, or data-rich."""
-        module = step['module']
-        method = step['method']
-        
-        # Check special cases first
-        if (module, method) in SPECIAL_CASES:
-            return SPECIAL_CASES[(module, method)]
-        
-        # Check navigation modules
-        if module in NAVIGATION_MODULES:
-            return NAVIGATION_MODULES[module]["type"]
-        
-        # Check data-rich modules
-        if module in DATA_RICH_MODULES:
-            if method in DATA_RICH_MODULES[module]["methods"]:
-                return DATA_RICH_MODULES[module]["type"]
-        
-        # Default: check if has data
-        has_data = bool(step['test_data']['create'] or 
-                       step['test_data']['update'] or 
-                       step['test_data']['editor'])
-        return "data_rich" if has_data else "empty"
+        return classify_step(step)
     
     def _get_context_steps(self, workflow: Dict[str, Any], current_step_index: int, context_window: int = 3) -> List[Dict[str, Any]]:
         """Get previous N steps as context."""
@@ -168,7 +132,7 @@ Instruction:"""
         
         return "Previous steps:\n" + "\n".join(context_lines)
     
-    def generate_step_level_instruction(self, workflow: Dict[str, Any], step: Dict[str, Any], include_context: bool = True) -> Optional[str]:
+    def generate_step_level_instruction(self, workflow: Dict[str, Any], step: Dict[str, Any], include_context: bool = True, step_type: Optional[str] = None) -> Optional[str]:
         """
         Generate a step-level instruction for a single step with context awareness.
         
@@ -176,15 +140,17 @@ Instruction:"""
             workflow: Parent workflow dict
             step: Single step dict
             include_context: Whether to include previous steps as context
+            step_type: Precomputed step type (classified here if None)
             
         Returns:
             Generated instruction in English, or None if step should be skipped
         """
         # Classify step
-        step_type = self._classify_step(step)
+        if step_type is None:
+            step_type = self._classify_step(step)
         
         # Skip pure navigation steps (optional)
-        if step_type in ["navigation", "validation", "empty"]:
+        if step_type in NAVIGATION_TYPES:
             # Generate simple template instruction for navigation
             if step['method'] == "Select Tab":
                 return f"Select the {step['object']} tab."
@@ -297,17 +263,17 @@ Instruction:"""
                 logger.info(f"✓ [{i+1}/{len(workflows)}] File-level: {workflow['file_id']}")
                 
                 # Step-level instructions
-                for step in workflow['steps']:
+                step_types = classify_steps(workflow['steps'])
+                for step, step_type in zip(workflow['steps'], step_types):
                     total_steps += 1
-                    step_type = self._classify_step(step)
                     
                     # Skip navigation steps if requested
-                    if skip_navigation and step_type in ["navigation", "validation", "empty"]:
+                    if skip_navigation and step_type in NAVIGATION_TYPES:
                         skipped_steps += 1
                         continue
                     
                     step_instruction = self.generate_step_level_instruction(
-                        workflow, step, include_context=include_context
+                        workflow, step, include_context=include_context, step_type=step_type
                     )
                     
                     if step_instruction:  # Only save if instruction was generated
@@ -0,0 +1,122 @@
+"""
+Shared step classification: (module, method) -> step type lookup table.
+
+The type of most steps is fully determined by module and method. Only steps
+outside the known modules fall back to the has-data bit, which WorkflowParser
+computes once at parse time and stores on the step as ``has_data``.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Module classification based on data analysis
+NAVIGATION_MODULES = {
+    "Tabs": {"methods": ["Select Tab"], "type": "navigation"},
+    "Buttons": {"methods": ["Click Oneshot Button"], "type": "navigation"},
+    "Datamodel Consistency Check": {"methods": ["Datamodel Check"], "type": "validation"}
+}
+
+DATA_RICH_MODULES = {
+    "Editor(s)": {
+        "methods": ["Open Object", "Open Object with ID", "Verify Field", "Switch Spatial Context"],
+        "type": "editor"
+    },
+    "Hierarchy Viewer": {
+        "methods": ["Select first HV object", "Select second HV object"],
+        "type": "hierarchy"
+    },
+    "Datamodel CRUD": {
+        "methods": ["Create", "Update"],
+        "type": "crud"
+    }
+}
+
+# Special cases
+SPECIAL_CASES = {
+    ("Datamodel CRUD", "Delete"): "empty"
+}
+
+# Navigation modules are typed regardless of method
+MODULE_TYPE_TABLE: Dict[str, str] = {
+    module: spec["type"] for module, spec in NAVIGATION_MODULES.items()
+}
+
+# (module, method) -> type; special cases take precedence over data-rich methods
+STEP_TYPE_TABLE: Dict[Tuple[str, str], str] = {
+    (module, method): spec["type"]
+    for module, spec in DATA_RICH_MODULES.items()
+    for method in spec["methods"]
+    if module not in MODULE_TYPE_TABLE
+}
+STEP_TYPE_TABLE.update(SPECIAL_CASES)
+
+NAVIGATION_TYPES = {"navigation", "validation", "empty"}
+
+# Fields WorkflowParser derives from the step; they are not part of the flat test
+# format and must not appear in training targets
+DERIVED_STEP_FIELDS = ("has_data",)
+
+
+def compute_has_data(test_data: Dict[str, Any]) -> bool:
+    """Whether any of the create/update/editor sections carries data."""
+    return bool(test_data.get('create') or
+                test_data.get('update') or
+                test_data.get('editor'))
+
+
+def step_has_data(step: Dict[str, Any]) -> bool:
+    """Has-data bit of a parsed step (computed on the fly for older parsed files)."""
+    has_data = step.get('has_data')
+    if has_data is None:
+        has_data = compute_has_data(step['test_data'])
+    return has_data
+
+
+def target_step(step: Dict[str, Any]) -> Dict[str, Any]:
+    """Step as emitted in training targets (parse-time derived fields removed)."""
+    if not any(field in step for field in DERIVED_STEP_FIELDS):
+        return step
+    return {key: value for key, value in step.items() if key not in DERIVED_STEP_FIELDS}
+
+
+def lookup_step_type(module: str, method: str) -> Optional[str]:
+    """Static type for (module, method), or None if it depends on the step's data."""
+    step_type = STEP_TYPE_TABLE.get((module, method))
+    if step_type is None:
+        step_type = MODULE_TYPE_TABLE.get(module)
+    return step_type
+
+
+def classify_step(step: Dict[str, Any]) -> str:
+    """Classify step as navigation, validation, editor/hierarchy/crud, data_rich or empty."""
+    step_type = lookup_step_type(step['module'], step['method'])
+    if step_type is None:
+        step_type = "data_rich" if step_has_data(step) else "empty"
+    return step_type
+
+
+def classify_steps(steps: Iterable[Dict[str, Any]]) -> List[str]:
+    """Classify a batch of steps.
+
+    Each distinct (module, method) pair is resolved against the table once;
+    every step is then a single dict lookup plus, for unknown pairs, the
+    stored has-data bit.
+    """
+    steps = list(steps)
+    pairs = [(step['module'], step['method']) for step in steps]
+    resolved = {pair: lookup_step_type(*pair) for pair in set(pairs)}
+    return [
+        resolved[pair] or ("data_rich" if step_has_data(step) else "empty")
+        for pair, step in zip(pairs, steps)
+    ]
+
+
+def classify_workflows(workflows: Iterable[Dict[str, Any]]) -> List[List[str]]:
+    """Classify every step of a corpus in one batch; returns one type list per workflow."""
+    workflows = list(workflows)
+    flat_types = classify_steps(step for wf in workflows for step in wf['steps'])
+    result, offset = [], 0
+    for wf in workflows:
+        count = len(wf['steps'])
+        result.append(flat_types[offset:offset + count])
+        offset += count
+    return result
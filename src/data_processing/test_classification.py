@@ -7,6 +7,7 @@ import sys
 sys.path.insert(0, 'src')
 
 from data_processing.instruction_generator import InstructionGenerator, NAVIGATION_MODULES, DATA_RICH_MODULES
+from data_processing.step_classification import NAVIGATION_TYPES, classify_steps
 
 
 def test_step_classification():
@@ -31,9 +32,7 @@ def test_step_classification():
     data_rich_count = 0
     empty_count = 0
     
-    for step in workflow['steps']:
-        step_type = generator._classify_step(step)
-        
+    for step, step_type in zip(workflow['steps'], classify_steps(workflow['steps'])):
         if step_type in ["navigation", "validation"]:
             navigation_count += 1
             icon = "🔵"
@@ -103,9 +102,8 @@ def test_step_classification():
     nav_count = 0
     data_count = 0
     
-    for step in regular_workflow['steps']:
-        step_type = generator._classify_step(step)
-        if step_type in ["navigation", "validation", "empty"]:
+    for step_type in classify_steps(regular_workflow['steps']):
+        if step_type in NAVIGATION_TYPES:
             nav_count += 1
         else:
             data_count += 1
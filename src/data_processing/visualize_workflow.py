@@ -4,6 +4,11 @@ Display a workflow with empty steps visualization.
 
 import json
 import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from data_processing.step_classification import step_has_data
 
 def visualize_workflow(workflow_file: str, workflow_index: int = 12):
     """Display a workflow showing which steps have data and which are empty."""
@@ -32,11 +37,7 @@ def visualize_workflow(workflow_file: str, workflow_index: int = 12):
         obj = step['object']
         
         # Check if step has any data
-        has_create = bool(step['test_data']['create'])
-        has_update = bool(step['test_data']['update'])
-        has_editor = bool(step['test_data']['editor'])
-        
-        has_any_data = has_create or has_update or has_editor
+        has_any_data = step_has_data(step)
         
         if has_any_data:
             has_data_count += 1
@@ -53,17 +54,11 @@ def visualize_workflow(workflow_file: str, workflow_index: int = 12):
         print(f"  对象: {obj}")
         
         if has_any_data:
-            data_types = []
-            if has_create:
-                data_types.append("create")
-            if has_update:
-                data_types.append("update")
-            if has_editor:
-                data_types.append("editor")
+            data_types = [section for section in ("create", "update", "editor") if step['test_data'][section]]
             print(f"  📦 包含数据: {', '.join(data_types)}")
             
             # Show sample of editor data if present
-            if has_editor:
+            if step['test_data']['editor']:
                 editor_data = step['test_data']['editor']
                 if 'FLD_CSTM0_' + str(step_num) in editor_data:
                     custom_data = editor_data['FLD_CSTM0_' + str(step_num)]
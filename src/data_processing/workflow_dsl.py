@@ -0,0 +1,317 @@
+"""
+Compact, round-trippable serialization of parsed workflow steps.
+
+Training targets used to be ``json.dumps(step, indent=2)``, which spends most of
+its tokens on indentation, key names and empty ``create``/``update``/``editor``
+sections. The DSL writes one line per step:
+
+    CODE {compact JSON of the non-empty fields}
+
+- CODE abbreviates the (module, method) pair, e.g. ``TAB.SEL`` for
+  Tabs / Select Tab or ``CRUD.C`` for Datamodel CRUD / Create. Unknown methods
+  of a known module keep the module code and store the method as ``f``; unknown
+  modules use ``_`` with ``m`` and ``f``.
+- Field keys are shortened (``obj``, ``id``, ``db``, ``cmd``, ``cr``, ``upd``,
+  ``ed``). Fields equal to the parser default (``""`` or ``{}``) are omitted.
+- ``has_data`` is recomputed on decode. It is only written (``hd``) when the
+  stored value differs from the computed one, or is missing (``null``).
+- ``step_index`` (``i``) is omitted when it equals the step's position. Standard
+  fields the step lacks (including ``step_index``) are listed under ``x["-"]``.
+
+A workflow is a header line ``@ {metadata}`` followed by its step lines.
+Encoding is deterministic, and ``decode(encode(x)) == x`` for every parsed
+step and workflow.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from data_processing.step_classification import compute_has_data
+
+MODULE_CODES = {
+    "Tabs": "TAB",
+    "Buttons": "BTN",
+    "Datamodel Consistency Check": "DMC",
+    "Editor(s)": "ED",
+    "Hierarchy Viewer": "HV",
+    "Datamodel CRUD": "CRUD",
+}
+
+METHOD_CODES = {
+    ("Tabs", "Select Tab"): "SEL",
+    ("Buttons", "Click Oneshot Button"): "CLICK",
+    ("Datamodel Consistency Check", "Datamodel Check"): "CHECK",
+    ("Editor(s)", "Open Object"): "OPEN",
+    ("Editor(s)", "Open Object with ID"): "OPENID",
+    ("Editor(s)", "Verify Field"): "VERIFY",
+    ("Editor(s)", "Switch Spatial Context"): "CTX",
+    ("Hierarchy Viewer", "Select first HV object"): "HV1",
+    ("Hierarchy Viewer", "Select second HV object"): "HV2",
+    ("Datamodel CRUD", "Create"): "C",
+    ("Datamodel CRUD", "Update"): "U",
+    ("Datamodel CRUD", "Delete"): "D",
+}
+
+UNKNOWN_MODULE = "_"
+
+# Step field -> short key, in the parser's field order
+STEP_FIELDS = [
+    ("database", "db"),
+    ("object", "obj"),
+    ("object_id", "id"),
+    ("command", "cmd"),
+]
+TEST_DATA_SECTIONS = [("create", "cr"), ("update", "upd"), ("editor", "ed")]
+
+WORKFLOW_FIELDS = [("test_app", "app"), ("database", "db")]
+
+_MODULES_BY_CODE = {code: module for module, code in MODULE_CODES.items()}
+_METHODS_BY_CODE = {(MODULE_CODES[module], code): (module, method)
+                    for (module, method), code in METHOD_CODES.items()}
+# Fields the parser always writes; absent ones are listed under x["-"] so they stay absent on decode
+_OPTIONAL_KEYS = ("database", "object", "object_id", "module", "method", "command", "test_data")
+_STANDARD_KEYS = {"step_index", "has_data"} | set(_OPTIONAL_KEYS)
+
+
+def _compact(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_step(step: Dict[str, Any], position: Optional[int] = None) -> str:
+    """
+    Encode a parsed step as one DSL line.
+
+    Args:
+        step: Step in WorkflowParser's schema
+        position: Index of the step in its workflow; step_index is omitted when equal
+    """
+    module, method = step.get("module", ""), step.get("method", "")
+    fields: Dict[str, Any] = {}
+
+    module_code = MODULE_CODES.get(module) if isinstance(module, str) else None
+    method_code = METHOD_CODES.get((module, method)) if module_code else None
+    if method_code:
+        code = f"{module_code}.{method_code}"
+    elif module_code:
+        code = module_code
+        fields["f"] = method
+    else:
+        code = UNKNOWN_MODULE
+        fields["m"] = module
+        fields["f"] = method
+
+    if "step_index" in step and step["step_index"] != position:
+        fields["i"] = step["step_index"]
+
+    for name, key in STEP_FIELDS:
+        if step.get(name, "") != "":
+            fields[key] = step[name]
+
+    test_data = step.get("test_data")
+    if "test_data" not in step:
+        pass
+    elif isinstance(test_data, dict) and list(test_data) == [name for name, _ in TEST_DATA_SECTIONS]:
+        for name, key in TEST_DATA_SECTIONS:
+            if test_data[name] != {}:
+                fields[key] = test_data[name]
+    else:
+        # Non-standard test_data (missing or extra sections) is kept verbatim
+        fields["td"] = test_data
+
+    if "has_data" not in step:
+        fields["hd"] = None
+    elif isinstance(test_data, dict) and step["has_data"] == compute_has_data(test_data):
+        pass
+    else:
+        fields["hd"] = step["has_data"]
+
+    # Fields the parser does not produce, and standard fields that are absent
+    extra = {k: v for k, v in step.items() if k not in _STANDARD_KEYS}
+    missing = [name for name in ("step_index",) + _OPTIONAL_KEYS if name not in step]
+    if missing:
+        extra["-"] = missing
+    if extra:
+        fields["x"] = extra
+
+    return code if not fields else f"{code} {_compact(fields)}"
+
+
+def decode_step(line: str, position: Optional[int] = None) -> Dict[str, Any]:
+    """Decode one DSL line back into a parsed step."""
+    code, _, payload = line.strip().partition(" ")
+    fields = json.loads(payload) if payload else {}
+
+    if code == UNKNOWN_MODULE:
+        module, method = fields["m"], fields["f"]
+    elif "." in code:
+        module_code, method_code = code.split(".", 1)
+        module, method = _METHODS_BY_CODE[(module_code, method_code)]
+    else:
+        module, method = _MODULES_BY_CODE[code], fields["f"]
+
+    extra = dict(fields.get("x", {}))
+    missing = set(extra.pop("-", []))
+
+    step: Dict[str, Any] = {}
+    if "step_index" not in missing:
+        step["step_index"] = fields.get("i", position)
+
+    values = {name: fields.get(key, "") for name, key in STEP_FIELDS}
+    values["module"] = module
+    values["method"] = method
+    if "td" in fields:
+        values["test_data"] = fields["td"]
+    else:
+        values["test_data"] = {name: fields.get(key, {}) for name, key in TEST_DATA_SECTIONS}
+    for name in _OPTIONAL_KEYS:
+        if name not in missing:
+            step[name] = values[name]
+    test_data = values["test_data"]
+
+    if "hd" not in fields:
+        step["has_data"] = compute_has_data(test_data)
+    elif fields["hd"] is not None:
+        step["has_data"] = fields["hd"]
+
+    step.update(extra)
+    return step
+
+
+def encode_workflow(steps: List[Dict[str, Any]], metadata: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Encode a workflow (file-level target) as a header line plus one line per step.
+
+    Args:
+        steps: Parsed steps
+        metadata: test_app / database / total_steps, as in the file-level target
+    """
+    header: Dict[str, Any] = {}
+    metadata = metadata or {}
+    for name, key in WORKFLOW_FIELDS:
+        if metadata.get(name, "") != "":
+            header[key] = metadata[name]
+    if metadata.get("total_steps", len(steps)) != len(steps):
+        header["n"] = metadata["total_steps"]
+    extra = {k: v for k, v in metadata.items() if k not in {"test_app", "database", "total_steps"}}
+    if extra:
+        header["x"] = extra
+
+    lines = ["@" if not header else f"@ {_compact(header)}"]
+    lines.extend(encode_step(step, position) for position, step in enumerate(steps))
+    return "\n".join(lines)
+
+
+def decode_workflow(text: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Decode a DSL workflow into (metadata, steps)."""
+    lines = text.strip("\n").split("\n")
+    header_line, step_lines = lines[0], lines[1:]
+    if not header_line.startswith("@"):
+        raise ValueError(f"Missing workflow header: {header_line[:40]!r}")
+    _, _, payload = header_line.partition(" ")
+    header = json.loads(payload) if payload else {}
+
+    steps = [decode_step(line, position) for position, line in enumerate(step_lines)]
+    metadata = {name: header.get(key, "") for name, key in WORKFLOW_FIELDS}
+    metadata["total_steps"] = header.get("n", len(steps))
+    metadata.update(header.get("x", {}))
+    return metadata, steps
+
+
+def workflow_metadata(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """Metadata block of the file-level training target."""
+    return {
+        "test_app": workflow.get("test_app", ""),
+        "database": workflow.get("database", ""),
+        "total_steps": len(workflow.get("steps", [])),
+    }
+
+
+def token_report(workflows_file: str, tokenizer_name: str, max_workflows: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Compare target lengths (tokens and characters) of the indented JSON targets and the DSL,
+    and verify that every step and workflow round-trips.
+    """
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, trust_remote_code=True)
+
+    def count(text: str) -> int:
+        return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    totals = {"workflows": 0, "steps": 0, "roundtrip_failures": 0,
+              "step_json_tokens": 0, "step_dsl_tokens": 0, "step_json_chars": 0, "step_dsl_chars": 0,
+              "file_json_tokens": 0, "file_dsl_tokens": 0}
+    with open(workflows_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            workflow = json.loads(line)
+            steps = workflow.get("steps", [])
+            for step in steps:
+                step_json = json.dumps(step, indent=2, ensure_ascii=False)
+                step_dsl = encode_step(step)
+                if decode_step(step_dsl) != step:
+                    totals["roundtrip_failures"] += 1
+                totals["step_json_tokens"] += count(step_json)
+                totals["step_dsl_tokens"] += count(step_dsl)
+                totals["step_json_chars"] += len(step_json)
+                totals["step_dsl_chars"] += len(step_dsl)
+
+            if steps:
+                metadata = workflow_metadata(workflow)
+                file_json = json.dumps({"workflow": {"metadata": metadata, "steps": steps}},
+                                       indent=2, ensure_ascii=False)
+                file_dsl = encode_workflow(steps, metadata)
+                if decode_workflow(file_dsl) != (metadata, steps):
+                    totals["roundtrip_failures"] += 1
+                totals["file_json_tokens"] += count(file_json)
+                totals["file_dsl_tokens"] += count(file_dsl)
+
+            totals["workflows"] += 1
+            totals["steps"] += len(steps)
+            if max_workflows and totals["workflows"] >= max_workflows:
+                break
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact workflow DSL: token-count report and round-trip check")
+    parser.add_argument("--workflows", default="data/processed/parsed_workflows.jsonl",
+                        help="Parsed workflows (JSONL)")
+    parser.add_argument("--tokenizer", default="Qwen/Qwen2.5-Coder-7B-Instruct",
+                        help="Training tokenizer")
+    parser.add_argument("--max-workflows", type=int, help="Only look at the first N workflows")
+    parser.add_argument("--show", type=int, default=0, help="Print the first N encoded workflows")
+    args = parser.parse_args()
+
+    if args.show:
+        with open(args.workflows, "r", encoding="utf-8") as f:
+            for _, line in zip(range(args.show), f):
+                workflow = json.loads(line)
+                print(f"# {workflow.get('file_id', '')}")
+                print(encode_workflow(workflow.get("steps", []), workflow_metadata(workflow)))
+                print()
+
+    totals = token_report(args.workflows, args.tokenizer, args.max_workflows)
+
+    def ratio(dsl: int, js: int) -> str:
+        return f"{dsl / js:.1%}" if js else "n/a"
+
+    print(f"Workflows: {totals['workflows']}, steps: {totals['steps']}")
+    print(f"Step targets:  {totals['step_json_tokens']:,} -> {totals['step_dsl_tokens']:,} tokens "
+          f"({ratio(totals['step_dsl_tokens'], totals['step_json_tokens'])}), "
+          f"{totals['step_json_chars']:,} -> {totals['step_dsl_chars']:,} chars")
+    print(f"File targets:  {totals['file_json_tokens']:,} -> {totals['file_dsl_tokens']:,} tokens "
+          f"({ratio(totals['file_dsl_tokens'], totals['file_json_tokens'])})")
+    print(f"Round-trip failures: {totals['roundtrip_failures']}")
+    if totals["roundtrip_failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
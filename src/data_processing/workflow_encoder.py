@@ -0,0 +1,201 @@
+"""
+Encode structured workflows back into the flat GIS test JSON format.
+
+Inverse of WorkflowParser: a structured workflow (or a compact DSL workflow,
+see workflow_dsl.py) becomes the flat ``testdbs0_N`` / ``testobjs0_N`` /
+``testdata_cr0_N`` layout the GIS test runner reads. WorkflowParser derives
+file_id and is_high_quality from the file location, so a workflow is written to
+``<output_dir>/<file_id>.json``. Parsing the written file gives back the original
+workflow, except for file_path.
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Union
+import logging
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from data_processing.workflow_dsl import decode_workflow
+from data_processing.workflow_parser import WorkflowParser
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Step field -> flat key prefix (the flat key is prefix + "0_{step_index}")
+STEP_KEYS = [
+    ("database", "testdbs"),
+    ("object", "testobjs"),
+    ("object_id", "testobj_ids"),
+    ("module", "testmodules"),
+    ("method", "testmethodes"),
+    ("command", "testcommands"),
+]
+TEST_DATA_KEYS = [
+    ("create", "testdata_cr"),
+    ("update", "testdata_upd"),
+    ("editor", "testdata_editor"),
+]
+
+
+def encode_flat(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert a structured workflow into the flat test JSON layout.
+
+    Steps are numbered by position (step_index is not trusted, since generated
+    workflows may skip or repeat indices). has_data is not written because
+    the parser recomputes it.
+    """
+    steps = workflow.get("steps", [])
+    data: Dict[str, Any] = {}
+    test_env = workflow.get("test_env", "Unknown")
+    if test_env != "Unknown":
+        data["testenvs0"] = [test_env]
+    data["testapps0"] = [workflow.get("test_app", "")]
+    data["teststeps0"] = [len(steps)]
+    data["testcases"] = workflow.get("test_cases", [])
+
+    for step_idx, step in enumerate(steps):
+        suffix = f"0_{step_idx}"
+        for field, prefix in STEP_KEYS:
+            data[prefix + suffix] = step.get(field, "")
+        test_data = step.get("test_data") or {}
+        for section, prefix in TEST_DATA_KEYS:
+            data[prefix + suffix] = test_data.get(section, {})
+    return data
+
+
+def workflow_from_dsl(text: str, file_id: str = "", test_env: str = "Unknown",
+                      is_high_quality: bool = False) -> Dict[str, Any]:
+    """Build a structured workflow from a compact DSL workflow (e.g. model output)."""
+    metadata, steps = decode_workflow(text)
+    return {
+        "file_id": file_id,
+        "file_path": "",
+        "is_high_quality": is_high_quality,
+        "test_env": test_env,
+        "test_app": metadata.get("test_app", ""),
+        "total_steps": len(steps),
+        "test_cases": [],
+        "steps": steps,
+    }
+
+
+class RawWorkflowWriter:
+    """Write batches of workflows as flat test JSON files."""
+
+    def __init__(self, output_dir: str, indent: Optional[int] = None):
+        """
+        Args:
+            output_dir: Directory the test runner reads from
+            indent: JSON indentation (None writes compact JSON, which is faster)
+        """
+        self.output_dir = Path(output_dir)
+        self.indent = indent
+        self.written = 0
+
+    def path_for(self, workflow: Dict[str, Any]) -> Path:
+        file_id = workflow.get("file_id") or f"workflow_{self.written:05d}"
+        return self.output_dir / f"{file_id}.json"
+
+    def write_batch(self, workflows: Iterable[Union[Dict[str, Any], str]]) -> List[Path]:
+        """
+        Encode and write one batch of workflows.
+
+        Args:
+            workflows: Structured workflows or compact DSL strings
+
+        Returns:
+            Paths of the written files, in input order
+        """
+        paths = []
+        created_dirs = set()
+        for workflow in workflows:
+            if isinstance(workflow, str):
+                workflow = workflow_from_dsl(workflow)
+            path = self.path_for(workflow)
+            if path.parent not in created_dirs:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                created_dirs.add(path.parent)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(encode_flat(workflow), ensure_ascii=False, indent=self.indent))
+            paths.append(path)
+            self.written += 1
+        return paths
+
+
+def _without_path(workflow: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in workflow.items() if k != "file_path"}
+
+
+def verify_roundtrip(workflows_file: str, batch_size: int = 1000) -> Dict[str, Any]:
+    """
+    Property check over a corpus: parse(encode(x)) == x for every workflow (ignoring file_path).
+
+    Workflows are written to a temporary directory batch by batch and parsed back with WorkflowParser.
+    """
+    checked, failures = 0, []
+    with tempfile.TemporaryDirectory(prefix="gis_raw_") as tmp_dir:
+        parser = WorkflowParser(tmp_dir)
+        with open(workflows_file, "r", encoding="utf-8") as f:
+            batch = []
+            for line in f:
+                if line.strip():
+                    batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    checked += _verify_batch(batch, parser, failures)
+                    batch = []
+            if batch:
+                checked += _verify_batch(batch, parser, failures)
+    return {"checked": checked, "failures": failures}
+
+
+def _verify_batch(batch: List[Dict[str, Any]], parser: WorkflowParser, failures: List[str]) -> int:
+    writer = RawWorkflowWriter(str(parser.raw_data_dir))
+    for workflow, path in zip(batch, writer.write_batch(batch)):
+        parsed = parser.parse_file(path)
+        if _without_path(parsed) != _without_path(workflow):
+            failures.append(workflow.get("file_id", str(path)))
+        path.unlink()
+    return len(batch)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Encode structured workflows into flat GIS test JSON")
+    arg_parser.add_argument("--input", default="data/processed/parsed_workflows.jsonl",
+                            help="Structured workflows (JSONL), or DSL workflows with --dsl")
+    arg_parser.add_argument("--output-dir", default="data/generated/raw", help="Output directory")
+    arg_parser.add_argument("--dsl", action="store_true",
+                            help="Input is JSONL with a DSL workflow in 'output' (and optional 'file_id')")
+    arg_parser.add_argument("--indent", type=int, help="Indent the written JSON")
+    arg_parser.add_argument("--verify", action="store_true",
+                            help="Check parse(encode(x)) == x over the whole input instead of writing")
+    args = arg_parser.parse_args()
+
+    if args.verify:
+        result = verify_roundtrip(args.input)
+        logger.info(f"Round-trip checked {result['checked']} workflows, {len(result['failures'])} failures")
+        for file_id in result["failures"][:20]:
+            logger.error(f"✗ {file_id}")
+        sys.exit(1 if result["failures"] else 0)
+
+    workflows = []
+    with open(args.input, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if args.dsl:
+                item = workflow_from_dsl(item["output"], file_id=item.get("file_id", ""))
+            workflows.append(item)
+
+    writer = RawWorkflowWriter(args.output_dir, indent=args.indent)
+    paths = writer.write_batch(workflows)
+    logger.info(f"Wrote {len(paths)} workflows to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
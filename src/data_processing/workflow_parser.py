@@ -4,10 +4,15 @@ Parse flat GIS test JSON files into structured workflow format.
 
 import json
 import os
+import sys
 from pathlib import Path
 from typing import Dict, List, Any
 import logging
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from data_processing.step_classification import compute_has_data
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -84,6 +89,12 @@ class WorkflowParser:
         """Parse a single step from flat structure."""
         suffix = f"0_{step_idx}"
         
+        test_data = {
+            "create": data.get(f"testdata_cr{suffix}", {}),
+            "update": data.get(f"testdata_upd{suffix}", {}),
+            "editor": data.get(f"testdata_editor{suffix}", {})
+        }
+        
         step = {
             "step_index": step_idx,
             "database": data.get(f"testdbs{suffix}", ""),
@@ -92,11 +103,9 @@ class WorkflowParser:
             "module": data.get(f"testmodules{suffix}", ""),
             "method": data.get(f"testmethodes{suffix}", ""),
             "command": data.get(f"testcommands{suffix}", ""),
-            "test_data": {
-                "create": data.get(f"testdata_cr{suffix}", {}),
-                "update": data.get(f"testdata_upd{suffix}", {}),
-                "editor": data.get(f"testdata_editor{suffix}", {})
-            }
+            "test_data": test_data,
+            # Computed once here so classifiers don't re-inspect test_data
+            "has_data": compute_has_data(test_data)
         }
         
         return step
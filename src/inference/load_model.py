@@ -3,12 +3,17 @@
 """
 
 import os
+import sys
 import torch
 from pathlib import Path
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModel
 from typing import Dict, Optional, Tuple
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from training.prompts import format_inference_prompt
+
 
 class GISCodeGenerator:
     """GIS代码生成器 - 使用CodeLlama + LoRA微调模型"""
@@ -113,21 +118,7 @@ class GISCodeGenerator:
         """
         
         # 构建Prompt
-        if context:
-            prompt = f"""You are a GIS workflow code generator. Generate complete JSON workflow code based on the instruction.
-
-Instruction: {instruction}
-Context: {context}
-
-JSON Code:
-"""
-        else:
-            prompt = f"""You are a GIS workflow code generator. Generate complete JSON workflow code based on the instruction.
-
-Instruction: {instruction}
-
-JSON Code:
-"""
+        prompt = format_inference_prompt(instruction, context)
         
         # Tokenize
         inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
@@ -7,4 +7,4 @@
 - 模型评估
 """
 
-__all__ = ['prepare_training_data', 'train_lora', 'evaluate_model']
+__all__ = ['prepare_training_data', 'train_lora', 'token_cache', 'packing', 'length_sampler', 'multi_turn', 'weighted_loss', 'step_sampler', 'hash_split', 'columnar', 'fast_json', 'build_training_sets', 'prompts', 'throughput', 'async_checkpoint', 'benchmark', 'evaluate_model']
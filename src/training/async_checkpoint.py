@@ -0,0 +1,230 @@
+"""
+后台异步保存LoRA adapter checkpoint（TrainerCallback）
+
+HF默认每 save_steps 在训练循环里同步保存完整checkpoint（adapter、优化器状态、
+调度器、RNG、tokenizer），保存期间训练停住；Colab上写到Drive时停顿更长。
+
+这里接管中间checkpoint的保存：
+- 训练线程只做快照：把adapter权重拷贝到CPU（LoRA参数量小，通常远小于1秒）
+- 后台线程写 adapter_model.safetensors + adapter_config.json 到临时目录，
+  fsync后 os.replace 为 checkpoint-{step}，中途中断不会留下半个checkpoint
+- 按 save_total_limit 轮转旧checkpoint（保留当前最优）
+- 每个checkpoint记录训练停顿时间（快照 + 等待上一次写入）和后台写入时间
+- 后台写入失败时，在下一次保存、wait() 或训练结束时于训练线程抛出 RuntimeError
+
+只保存adapter权重，不含优化器状态，不能用于 resume_from_checkpoint。
+load_best_model_at_end 时，训练结束后从最优checkpoint加载adapter权重。
+"""
+
+import copy
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+from peft import get_peft_model_state_dict, set_peft_model_state_dict
+from safetensors.torch import load_file, save_file
+from transformers import TrainerCallback
+
+logger = logging.getLogger(__name__)
+
+ADAPTER_WEIGHTS_NAME = "adapter_model.safetensors"
+CHECKPOINT_PATTERN = re.compile(r"^checkpoint-(\d+)$")
+
+
+def snapshot_adapter(model) -> Dict[str, torch.Tensor]:
+    """adapter权重拷贝到CPU（与训练中的参数不共享存储）"""
+    model = getattr(model, 'module', model)
+    adapter_name = getattr(model, 'active_adapter', 'default')
+    state_dict = get_peft_model_state_dict(model, adapter_name=adapter_name)
+    return {name: tensor.detach().to('cpu', copy=True).contiguous() for name, tensor in state_dict.items()}
+
+
+def _fsync(path: Path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_adapter_checkpoint(state_dict: Dict[str, torch.Tensor], peft_config, checkpoint_dir: Path):
+    """写到 .{name}.tmp 再原子重命名为 checkpoint_dir"""
+    checkpoint_dir = Path(checkpoint_dir)
+    tmp_dir = checkpoint_dir.with_name(f".{checkpoint_dir.name}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    weights_file = tmp_dir / ADAPTER_WEIGHTS_NAME
+    save_file(state_dict, str(weights_file), metadata={'format': 'pt'})
+    peft_config.save_pretrained(str(tmp_dir))
+    for path in (weights_file, tmp_dir / "adapter_config.json", tmp_dir):
+        _fsync(path)
+
+    if checkpoint_dir.exists():
+        shutil.rmtree(checkpoint_dir)
+    os.replace(tmp_dir, checkpoint_dir)
+    _fsync(checkpoint_dir.parent)
+
+
+class AsyncCheckpointCallback(TrainerCallback):
+    """
+    替代HF的同步checkpoint保存（需放在DefaultFlowCallback之后，on_step_end里清除 should_save）
+
+    Args:
+        max_pending: 最多排队等待写入的快照数，超过时训练线程等待（限制CPU内存占用）
+        throughput: ThroughputCallback，停顿时间计入其 save_s
+    """
+
+    def __init__(self, max_pending: int = 1, throughput=None):
+        self.throughput = throughput
+        self.records: List[Dict] = []
+        self.best_step: Optional[int] = None
+        self.best_metric: Optional[float] = None
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._worker: Optional[threading.Thread] = None
+        self._output_dir: Optional[Path] = None
+        self._save_total_limit: Optional[int] = None
+        self._error: Optional[BaseException] = None
+
+    def _start_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            # daemon：训练异常退出时不会卡在这里；未完成的写入只留下 .tmp 目录
+            self._worker = threading.Thread(target=self._run, name='async-checkpoint', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                state_dict, peft_config, checkpoint_dir, record = job
+                start = time.perf_counter()
+                write_adapter_checkpoint(state_dict, peft_config, checkpoint_dir)
+                record['write_s'] = time.perf_counter() - start
+                record['size_mb'] = (checkpoint_dir / ADAPTER_WEIGHTS_NAME).stat().st_size / 2**20
+                logger.info(f"💾 {checkpoint_dir.name}: 后台写入完成 {record['write_s']:.2f}s "
+                            f"({record['size_mb']:.1f} MB)")
+                self._rotate()
+            except Exception as e:
+                # 记录下来，由训练线程在下一次 save() / wait() 时抛出
+                logger.error(f"❌ 后台保存checkpoint失败: {e}")
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _checkpoints(self) -> List[Path]:
+        checkpoints = [path for path in self._output_dir.iterdir()
+                       if path.is_dir() and CHECKPOINT_PATTERN.match(path.name)]
+        return sorted(checkpoints, key=lambda path: int(CHECKPOINT_PATTERN.match(path.name).group(1)))
+
+    def _rotate(self):
+        if not self._save_total_limit:
+            return
+        checkpoints = self._checkpoints()
+        best = f"checkpoint-{self.best_step}"
+        removable = [path for path in checkpoints[:-1] if path.name != best]
+        excess = len(checkpoints) - self._save_total_limit
+        for path in removable[:max(excess, 0)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _raise_error(self):
+        """后台写入失败时在训练线程抛出（不再继续训练而没有可用的checkpoint）"""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"后台保存checkpoint失败: {error}") from error
+
+    def save(self, model, step: int) -> Dict:
+        """训练线程：快照后放入写入队列，返回本次的停顿记录"""
+        self._raise_error()
+        self._start_worker()
+        start = time.perf_counter()
+        state_dict = snapshot_adapter(model)
+        snapshot_s = time.perf_counter() - start
+        peft_model = getattr(model, 'module', model)
+        peft_config = copy.deepcopy(peft_model.peft_config[getattr(peft_model, 'active_adapter', 'default')])
+        peft_config.inference_mode = True
+
+        record = {'step': step, 'snapshot_s': snapshot_s, 'write_s': None, 'size_mb': None}
+        # 队列满（上一次还没写完）时在这里等待，也算停顿
+        self._queue.put((state_dict, peft_config, self._output_dir / f"checkpoint-{step}", record))
+        record['stall_s'] = time.perf_counter() - start
+        self.records.append(record)
+        logger.info(f"💾 checkpoint-{step}: 训练停顿 {record['stall_s']:.3f}s（快照 {snapshot_s:.3f}s），后台写入中")
+        if self.throughput is not None:
+            self.throughput.record_save(record['stall_s'])
+        return record
+
+    def wait(self):
+        """等待所有排队的checkpoint写完；有写入失败时抛出 RuntimeError"""
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.join()
+        self._raise_error()
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self._output_dir = Path(args.output_dir)
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        self._save_total_limit = args.save_total_limit
+
+    def on_step_end(self, args, state, control, model=None, **kwargs):
+        if not control.should_save:
+            return control
+        if state.is_world_process_zero and model is not None:
+            self.save(model, state.global_step)
+        control.should_save = False
+        return control
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        if not metrics or not args.metric_for_best_model:
+            return
+        name = args.metric_for_best_model
+        value = metrics.get(name if name.startswith('eval_') else f'eval_{name}')
+        if value is None:
+            return
+        if self.best_metric is None or (value > self.best_metric if args.greater_is_better
+                                        else value < self.best_metric):
+            self.best_metric = value
+            self.best_step = state.global_step
+
+    def on_train_end(self, args, state, control, model=None, **kwargs):
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join()
+        self._raise_error()
+        if args.load_best_model_at_end and self.best_step is not None and model is not None:
+            best_dir = self._output_dir / f"checkpoint-{self.best_step}"
+            if (best_dir / ADAPTER_WEIGHTS_NAME).exists():
+                peft_model = getattr(model, 'module', model)
+                set_peft_model_state_dict(peft_model, load_file(str(best_dir / ADAPTER_WEIGHTS_NAME)),
+                                          adapter_name=getattr(peft_model, 'active_adapter', 'default'))
+                state.best_model_checkpoint = str(best_dir)
+                state.best_metric = self.best_metric
+                logger.info(f"🏆 加载最优adapter: {best_dir} ({args.metric_for_best_model}={self.best_metric:.4f})")
+        if state.is_world_process_zero and self.records:
+            summary = self.summary()
+            with open(self._output_dir / 'async_checkpoint_stats.json', 'w', encoding='utf-8') as f:
+                json.dump({'summary': summary, 'checkpoints': self.records}, f, ensure_ascii=False, indent=2)
+            logger.info(f"💾 异步checkpoint: {summary['checkpoints']} 次，训练停顿 共 {summary['stall_s']:.2f}s "
+                        f"(平均 {summary['stall_mean_s']:.3f}s, 最长 {summary['stall_max_s']:.3f}s)，"
+                        f"后台写入 共 {summary['write_s']:.2f}s")
+
+    def summary(self) -> Dict:
+        stalls = [r['stall_s'] for r in self.records]
+        writes = [r['write_s'] for r in self.records if r['write_s'] is not None]
+        return {
+            'checkpoints': len(self.records),
+            'stall_s': sum(stalls),
+            'stall_mean_s': sum(stalls) / len(stalls) if stalls else 0.0,
+            'stall_max_s': max(stalls) if stalls else 0.0,
+            'write_s': sum(writes),
+            'write_mean_s': sum(writes) / len(writes) if writes else 0.0,
+        }
@@ -0,0 +1,349 @@
+"""
+CPU小模型训练基准
+
+quick_train.py --test 仍然下载Qwen2.5-Coder-7B，并假设有GPU（4-bit bitsandbytes、fp16、
+paged_adamw_8bit），普通Linux机器上无法做基准或回归测试。这里在本地构建：
+
+- 固定语料切片：默认为 build_training_sets 的合成数据（与数据流水线字段一致、固定种子），
+  也可以用 --train-file 取已有训练数据的前N条
+- 在语料上训练的小BPE tokenizer（byte-level，不需要下载）
+- 随机初始化的小Qwen2 / Llama结构模型（与基座模型相同的模块名，LoRA目标模块不变）
+
+然后用与正式训练相同的 GISTrainer 流程（加载 → LoRA → 数据准备/tokenize → 训练N步），
+CPU + fp32 + 标准AdamW，分阶段计时，并通过 ThroughputCallback 记录逐step吞吐。
+结果写成JSON（含commit），--compare 与另一个commit的结果对比。
+
+用法:
+    python src/training/benchmark.py
+    python src/training/benchmark.py --steps 50 --packing --output benchmarks/packing.json
+    python src/training/benchmark.py --compare benchmarks/train_cpu_benchmark_main.json
+    python src/training/train_lora.py --benchmark --max-steps 20
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+from transformers import AutoModelForCausalLM, LlamaConfig, PreTrainedTokenizerFast, Qwen2Config, TrainingArguments
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from training.build_training_sets import MultiGranularityBuilder, write_synthetic_data
+from training.columnar import iter_samples
+from training.prompts import format_prompt
+from training.train_lora import DataArguments, GISTrainer, LoraArguments, ModelArguments
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = "benchmarks/train_cpu_benchmark.json"
+ARCHITECTURES = {'qwen2': Qwen2Config, 'llama': LlamaConfig}
+EOS_TOKEN = "<|endoftext|>"
+PAD_TOKEN = "<|pad|>"
+
+# 对比时关注的指标（越大越好为True）
+COMPARE_METRICS = {
+    'phases.data_prep_s': False,
+    'phases.tokenize_s': False,
+    'phases.train_s': False,
+    'throughput.tokens_per_s': True,
+    'throughput.samples_per_s': True,
+    'throughput.step_time_p50_s': False,
+    'throughput.data_wait_fraction': False,
+    'throughput.peak_memory_mb': False,
+    'throughput.save_s': False,
+}
+
+
+def prepare_corpus(directory: Path, train_file: Optional[str] = None, num_samples: int = 512,
+                   seed: int = 0) -> Dict[str, str]:
+    """
+    固定的语料切片
+
+    train_file为空时生成合成工作流并用 MultiGranularityBuilder 构建step级训练数据
+    （计入数据准备时间）；否则取 train_file 的前 num_samples 条作为训练集、随后10%作为验证集
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    if train_file is None:
+        steps_per_file = 16
+        num_files = max(-(-num_samples * 10 // 9) // steps_per_file, 2)
+        paths = write_synthetic_data(directory, num_files, steps_per_file, seed)
+        MultiGranularityBuilder().build(paths)
+        output = Path(paths['step_output'])
+        return {'train': str(output.with_name(f"{output.stem}_train.json")),
+                'val': str(output.with_name(f"{output.stem}_val.json"))}
+
+    num_val = max(num_samples // 10, 1)
+    samples: List[Dict] = []
+    for sample in iter_samples(train_file):
+        samples.append(sample)
+        if len(samples) >= num_samples + num_val:
+            break
+    files = {'train': str(directory / 'train.jsonl'), 'val': str(directory / 'val.jsonl')}
+    for split, chunk in (('train', samples[:num_samples]), ('val', samples[num_samples:])):
+        with open(files[split], 'w', encoding='utf-8') as f:
+            for sample in chunk:
+                f.write(json.dumps(sample, ensure_ascii=False) + '\n')
+    return files
+
+
+def build_tiny_tokenizer(train_file: str, output_dir: Path, vocab_size: int = 2048) -> PreTrainedTokenizerFast:
+    """在训练语料上训练byte-level BPE（确定性，不需要下载）"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+    texts = [format_prompt(sample)['text'] for sample in iter_samples(train_file)]
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=[EOS_TOKEN, PAD_TOKEN],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+        show_progress=False,
+    )
+    tokenizer.train_from_iterator(texts, trainer=trainer)
+
+    fast_tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token=EOS_TOKEN, pad_token=PAD_TOKEN)
+    fast_tokenizer.save_pretrained(output_dir)
+    return fast_tokenizer
+
+
+def build_tiny_model(tokenizer: PreTrainedTokenizerFast, output_dir: Path, arch: str = 'qwen2',
+                     hidden_size: int = 64, num_layers: int = 2, max_length: int = 2048, seed: int = 0):
+    """随机初始化的小模型（q/k/v/o/gate/up/down_proj与基座模型相同）"""
+    config = ARCHITECTURES[arch](
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 4,
+        num_hidden_layers=num_layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=max_length,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        tie_word_embeddings=True,
+    )
+    torch.manual_seed(seed)
+    model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    return sum(p.numel() for p in model.parameters())
+
+
+def git_commit() -> Dict[str, Optional[str]]:
+    root = Path(__file__).parent.parent.parent
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit, 'dirty': dirty}
+
+
+def environment() -> Dict:
+    import transformers
+    import peft
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'torch': torch.__version__,
+        'transformers': transformers.__version__,
+        'peft': peft.__version__,
+    }
+
+
+def run_benchmark(steps: int = 20, batch_size: int = 4, max_length: int = 512, num_samples: int = 512,
+                  arch: str = 'qwen2', hidden_size: int = 64, num_layers: int = 2, vocab_size: int = 2048,
+                  lora_r: int = 8, packing: bool = False, max_tokens_per_batch: Optional[int] = None,
+                  train_file: Optional[str] = None, seed: int = 0, work_dir: Optional[str] = None,
+                  save_steps: Optional[int] = None, async_checkpoint: bool = False) -> Dict:
+    """构建小模型和语料，跑完整的GISTrainer流程，返回分阶段耗时和吞吐"""
+    directory = Path(work_dir) if work_dir else Path(tempfile.mkdtemp(prefix='gis_train_bench_'))
+    config = {
+        'steps': steps, 'batch_size': batch_size, 'max_length': max_length, 'num_samples': num_samples,
+        'arch': arch, 'hidden_size': hidden_size, 'num_layers': num_layers, 'vocab_size': vocab_size,
+        'lora_r': lora_r, 'packing': packing, 'max_tokens_per_batch': max_tokens_per_batch,
+        'corpus': train_file or 'synthetic', 'seed': seed,
+        'save_steps': save_steps, 'async_checkpoint': async_checkpoint,
+    }
+    phases = {}
+    try:
+        start = time.perf_counter()
+        data_files = prepare_corpus(directory / 'data', train_file, num_samples, seed)
+        phases['data_prep_s'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model_dir = directory / 'tiny_model'
+        tokenizer = build_tiny_tokenizer(data_files['train'], model_dir, vocab_size)
+        num_parameters = build_tiny_model(tokenizer, model_dir, arch, hidden_size, num_layers, max_length, seed)
+        phases['model_build_s'] = time.perf_counter() - start
+
+        model_args = ModelArguments(model_name_or_path=str(model_dir), use_4bit=False, use_8bit=False,
+                                    torch_dtype="float32")
+        data_args = DataArguments(
+            train_file=data_files['train'],
+            val_file=data_files['val'],
+            max_length=max_length,
+            token_cache_dir=None,
+            packing=packing,
+            max_tokens_per_batch=max_tokens_per_batch,
+        )
+        lora_args = LoraArguments(lora_r=lora_r, lora_alpha=lora_r * 2, lora_dropout=0.0)
+        training_args = TrainingArguments(
+            output_dir=str(directory / 'output'),
+            max_steps=steps,
+            per_device_train_batch_size=batch_size,
+            per_device_eval_batch_size=batch_size,
+            gradient_accumulation_steps=1,
+            learning_rate=2e-4,
+            warmup_steps=0,
+            logging_steps=max(steps // 4, 1),
+            save_strategy="steps" if save_steps else "no",
+            save_steps=save_steps or 500,
+            fp16=False,
+            optim="adamw_torch",
+            use_cpu=True,
+            dataloader_num_workers=0,
+            seed=seed,
+            report_to="none",
+        )
+        trainer = GISTrainer(model_args, data_args, lora_args, training_args,
+                             throughput_log=str(directory / 'throughput.jsonl'),
+                             async_checkpoint=async_checkpoint)
+
+        start = time.perf_counter()
+        trainer.load_tokenizer()
+        trainer.load_model()
+        phases['load_s'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        trainer.prepare_datasets()
+        phases['tokenize_s'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        hf_trainer = trainer.train()
+        phases['train_s'] = time.perf_counter() - start
+        phases['total_s'] = sum(phases.values())
+
+        train_loss = [log['train_loss'] for log in hf_trainer.state.log_history if 'train_loss' in log]
+        return {
+            **git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': config,
+            'environment': environment(),
+            'model_parameters': num_parameters,
+            'samples': {'train': len(trainer.train_dataset), 'val': len(trainer.eval_dataset)},
+            'phases': phases,
+            'throughput': hf_trainer.throughput.summary(),
+            'train_loss': train_loss[-1] if train_loss else None,
+        }
+    finally:
+        if not work_dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _metric(result: Dict, path: str):
+    value = result
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(result: Dict, baseline: Dict) -> Dict[str, Dict]:
+    """与基线结果逐项对比（相对变化，正数表示变好）"""
+    changes = {}
+    for path, higher_is_better in COMPARE_METRICS.items():
+        new, old = _metric(result, path), _metric(baseline, path)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        changes[path] = {'baseline': old, 'current': new,
+                         'improvement': change if higher_is_better else -change}
+    return changes
+
+
+def print_result(result: Dict, changes: Optional[Dict] = None):
+    throughput = result['throughput']
+    logger.info("=" * 70)
+    logger.info(f"🧪 CPU小模型训练基准 ({result['config']['arch']}, {result['model_parameters']:,} 参数, "
+                f"commit {str(result['commit'])[:10]}{' (dirty)' if result['dirty'] else ''})")
+    for name, seconds in result['phases'].items():
+        logger.info(f"  {name:16s} {seconds:8.2f}s")
+    logger.info(f"  Tokens/s: {throughput.get('tokens_per_s', 0):,.0f}, Samples/s: "
+                f"{throughput.get('samples_per_s', 0):.2f}, step p50 {throughput.get('step_time_p50_s', 0):.3f}s")
+    if changes:
+        logger.info("  对比基线:")
+        for path, change in changes.items():
+            marker = '✅' if change['improvement'] >= 0 else '⚠️ '
+            logger.info(f"  {marker} {path:32s} {change['baseline']:.4g} -> {change['current']:.4g} "
+                        f"({change['improvement']:+.1%})")
+    logger.info("=" * 70)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="CPU小模型训练基准（随机初始化模型，不需要下载和GPU）")
+    parser.add_argument('--steps', type=int, default=20, help='训练步数')
+    parser.add_argument('--batch-size', type=int, default=4, help='batch size')
+    parser.add_argument('--max-length', type=int, default=512, help='最大序列长度')
+    parser.add_argument('--num-samples', type=int, default=512, help='语料切片的训练样本数')
+    parser.add_argument('--train-file', type=str, help='从已有训练数据取切片（默认使用合成语料）')
+    parser.add_argument('--arch', choices=sorted(ARCHITECTURES), default='qwen2', help='小模型结构')
+    parser.add_argument('--hidden-size', type=int, default=64, help='隐藏层维度')
+    parser.add_argument('--num-layers', type=int, default=2, help='层数')
+    parser.add_argument('--vocab-size', type=int, default=2048, help='BPE词表大小')
+    parser.add_argument('--lora-r', type=int, default=8, help='LoRA秩')
+    parser.add_argument('--packing', action='store_true', help='测量打包模式')
+    parser.add_argument('--max-tokens-per-batch', type=int, help='测量token预算batch')
+    parser.add_argument('--save-steps', type=int, help='每N步保存checkpoint，测量保存停顿（默认不保存）')
+    parser.add_argument('--async-checkpoint', action='store_true', help='使用后台异步adapter checkpoint')
+    parser.add_argument('--threads', type=int, help='torch线程数（默认由torch决定）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--work-dir', type=str, help='保留中间文件的目录（默认使用临时目录并删除）')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT, help='结果JSON路径')
+    parser.add_argument('--compare', type=str, help='对比的基线结果JSON')
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    result = run_benchmark(
+        steps=args.steps, batch_size=args.batch_size, max_length=args.max_length,
+        num_samples=args.num_samples, arch=args.arch, hidden_size=args.hidden_size,
+        num_layers=args.num_layers, vocab_size=args.vocab_size, lora_r=args.lora_r,
+        packing=args.packing, max_tokens_per_batch=args.max_tokens_per_batch,
+        train_file=args.train_file, seed=args.seed, work_dir=args.work_dir,
+        save_steps=args.save_steps, async_checkpoint=args.async_checkpoint,
+    )
+
+    changes = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            changes = compare(result, json.load(f))
+        result['comparison'] = {'baseline': args.compare, 'changes': changes}
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print_result(result, changes)
+    logger.info(f"💾 结果已保存: {output}")
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,185 @@
+"""
+列式分片训练数据（Parquet / Arrow IPC）
+
+训练样本按固定样本数写成多个列式分片：{prefix}-00000.parquet, {prefix}-00001.parquet, ...
+列为 instruction / input / output / metadata。metadata 的结构在不同数据集之间不一致
+（如 keywords 是 [关键词, 权重] 混合类型的列表），因此以JSON字符串存放，读取时再解析。
+
+datasets.load_dataset('parquet' / 'arrow') 可以多进程并行准备多个分片并内存映射，
+也可以 streaming=True 按分片惰性读取（IterableDataset），不需要把整个数据集读进内存。
+
+不经过datasets的逐条读取（数据准备、划分、分析脚本）统一用 iter_samples，JSON/JSONL/列式分片都支持。
+"""
+
+import glob
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('instruction', 'input', 'output', 'metadata')
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+DATA_EXTENSIONS = ('.parquet', '.arrow', '.jsonl', '.json')
+# JSON数组元素之间的空白和逗号
+_ARRAY_SEPARATOR = re.compile(r'[\s,]*')
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("列式分片需要 pyarrow: pip install pyarrow") from e
+    return pa, pq
+
+
+class ColumnarShardWriter:
+    """按固定样本数切分的列式分片写入器（接口与 ShardedJsonlWriter 一致）"""
+
+    def __init__(self, prefix: Path, shard_size: int = 50000, fmt: str = 'parquet',
+                 compression: str = 'zstd'):
+        if fmt not in FORMATS:
+            raise ValueError(f"未知的分片格式: {fmt}（可选 {', '.join(FORMATS)}）")
+        self.prefix = Path(prefix)
+        self.shard_size = shard_size
+        self.fmt = fmt
+        self.compression = compression
+        self.count = 0
+        self.files: List[Path] = []
+        self._rows: Dict[str, List[str]] = {name: [] for name in COLUMNS}
+        self.prefix.parent.mkdir(parents=True, exist_ok=True)
+
+    def write(self, sample: Dict):
+        for name in COLUMNS[:-1]:
+            self._rows[name].append(sample.get(name) or '')
+        metadata = sample.get('metadata')
+        self._rows['metadata'].append(json.dumps(metadata, ensure_ascii=False) if metadata is not None else '')
+        self.count += 1
+        if len(self._rows['output']) >= self.shard_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows['output']:
+            return
+        pa, pq = _pyarrow()
+        table = pa.table({name: pa.array(self._rows[name], type=pa.string()) for name in COLUMNS})
+        path = Path(f"{self.prefix}-{len(self.files):05d}{FORMATS[self.fmt]}")
+        if self.fmt == 'parquet':
+            pq.write_table(table, path, compression=self.compression)
+        else:
+            with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        self.files.append(path)
+        self._rows = {name: [] for name in COLUMNS}
+
+    def close(self) -> List[Path]:
+        self._flush()
+        return self.files
+
+
+def write_shards(samples, prefix: Path, shard_size: int = 50000, fmt: str = 'parquet') -> List[Path]:
+    writer = ColumnarShardWriter(prefix, shard_size, fmt)
+    for sample in samples:
+        writer.write(sample)
+    return writer.close()
+
+
+def resolve_data_files(path: str) -> List[str]:
+    """
+    数据路径 → 文件列表：单个文件、glob（data/training/train-*.parquet）
+    或目录（目录下所有数据文件，按文件名排序）
+    """
+    if os.path.isdir(path):
+        return sorted(str(p) for p in Path(path).iterdir() if p.suffix in DATA_EXTENSIONS)
+    if glob.has_magic(path):
+        return sorted(glob.glob(path))
+    return [path] if os.path.exists(path) else []
+
+
+def data_format(path: str) -> str:
+    """load_dataset使用的builder名"""
+    suffix = Path(path).suffix
+    if suffix == '.parquet':
+        return 'parquet'
+    if suffix == '.arrow':
+        return 'arrow'
+    return 'json'
+
+
+def iter_columnar(path: str, batch_size: int = 4096) -> Iterator[Dict]:
+    """逐行读取列式分片（按record batch读取，metadata解析回dict）"""
+    pa, pq = _pyarrow()
+    if data_format(path) == 'parquet':
+        batches = pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+    else:
+        batches = pa.ipc.open_stream(pa.memory_map(path, 'r'))
+    for batch in batches:
+        for row in batch.to_pylist():
+            if row.get('metadata'):
+                row['metadata'] = json.loads(row['metadata'])
+            elif 'metadata' in row:
+                del row['metadata']
+            yield row
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20) -> Iterator[Dict]:
+    """逐个解析JSON数组文件的元素（按块读取，不把整个数组读进内存）"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{path}: 不是JSON数组")
+        pos = 1
+        while True:
+            pos = _ARRAY_SEPARATOR.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # 元素跨越了块边界：读下一块再解析（文件结束时才是真正的格式错误）
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield item
+            pos = end
+
+
+def iter_samples(path: str) -> Iterator[Dict]:
+    """读取训练样本（JSON数组、JSONL或列式分片；path可以是glob或目录）"""
+    for file in resolve_data_files(path):
+        if data_format(file) != 'json':
+            yield from iter_columnar(file)
+        elif file.endswith('.jsonl'):
+            with open(file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            yield from iter_json_array(file)
+
+
+def load_raw_dataset(path: str, num_proc: Optional[int] = None, streaming: bool = False):
+    """
+    用datasets加载训练数据（JSON/JSONL或列式分片）
+
+    Args:
+        num_proc: 多个分片时并行准备的进程数
+        streaming: True时返回惰性读取的IterableDataset
+    """
+    from datasets import load_dataset
+
+    files = resolve_data_files(path)
+    if not files:
+        raise FileNotFoundError(f"没有找到数据文件: {path}")
+    builder = data_format(files[0])
+    if streaming:
+        return load_dataset(builder, data_files=files, split='train', streaming=True)
+    num_proc = min(num_proc, len(files)) if num_proc and len(files) > 1 else None
+    return load_dataset(builder, data_files=files, split='train', num_proc=num_proc)
@@ -0,0 +1,67 @@
+"""
+缩进JSON的快速编码
+
+json.dump(obj, f, indent=2, ensure_ascii=False) 在有indent时不走C编码器，而是逐个yield小片段的
+纯Python生成器，训练数据准备脚本的大部分时间都花在这里。这里用递归拼接字符串（叶子节点仍用C实现的
+encode_basestring），输出与标准库逐字节一致。
+"""
+
+import json
+from json.encoder import encode_basestring
+from typing import Any, List
+
+INDENT = '  '
+
+
+def _fallback(obj: Any, indent: str) -> str:
+    # 少见类型（str/int子类、非字符串键等）交给标准库，再补上当前层级的缩进
+    # （JSON字符串中不会出现原始换行，直接替换是安全的）
+    return json.dumps(obj, indent=2, ensure_ascii=False).replace('\n', '\n' + indent)
+
+
+def _encode(obj: Any, indent: str) -> str:
+    t = type(obj)
+    if t is str:
+        return encode_basestring(obj)
+    if t is dict:
+        if not obj:
+            return '{}'
+        inner = indent + INDENT
+        parts = []
+        for key, value in obj.items():
+            if type(key) is not str:
+                return _fallback(obj, indent)
+            parts.append(inner + encode_basestring(key) + ': ' + _encode(value, inner))
+        return '{\n' + ',\n'.join(parts) + '\n' + indent + '}'
+    if t is list or t is tuple:
+        if not obj:
+            return '[]'
+        inner = indent + INDENT
+        return '[\n' + ',\n'.join([inner + _encode(value, inner) for value in obj]) + '\n' + indent + ']'
+    if obj is None:
+        return 'null'
+    if obj is True:
+        return 'true'
+    if obj is False:
+        return 'false'
+    if t is int:
+        return int.__repr__(obj)
+    return _fallback(obj, indent)
+
+
+def dumps_indented(obj: Any, indent: str = '') -> str:
+    """等价于 json.dumps(obj, indent=2, ensure_ascii=False)；indent为外层已有的缩进"""
+    return _encode(obj, indent)
+
+
+def dump_indented(obj: Any, fp) -> None:
+    """等价于 json.dump(obj, fp, indent=2, ensure_ascii=False)"""
+    fp.write(_encode(obj, ''))
+
+
+def join_indented_list(items: List[str], indent: str = '') -> str:
+    """把已编码的元素（按 indent + INDENT 层级编码）拼成缩进的JSON数组"""
+    if not items:
+        return '[]'
+    inner = indent + INDENT
+    return '[\n' + inner + (',\n' + inner).join(items) + '\n' + indent + ']'
@@ -0,0 +1,132 @@
+"""
+按file_id哈希的训练/验证/测试集划分
+
+每个文件的去向由 blake2b(seed + file_id) 映射到 [0, 1) 的值决定：
+    u < test_ratio                    → test
+    u < test_ratio + val_ratio        → val
+    其余                              → train
+同一个文件的所有样本总在同一个集合；新增数据不会让已有文件换集合，也不依赖读取顺序，
+因此可以逐行流式划分任意大小（或分片）的JSONL。
+
+分层（stratify_by，如 test_app / is_high_quality）：每个层内按缺额把新文件分给离目标比例
+最远的集合，使小的层也能按比例出现在验证集中。这依赖已见过的文件，所以分层时把
+file_id → 集合 的分配记录在 assignments 文件（JSONL）里，之后的运行先读取已有分配，
+已有文件永远不会移动，新文件在其基础上继续补齐各层比例。
+"""
+
+import hashlib
+import json
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SPLITS = ('train', 'val', 'test')
+DEFAULT_SEED = 'gis-code-ai'
+
+
+def hash_fraction(file_id: str, seed: str = DEFAULT_SEED) -> float:
+    """file_id的稳定哈希，映射到 [0, 1)"""
+    digest = hashlib.blake2b(f'{seed}:{file_id}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+
+def sample_field(sample: Dict, name: str):
+    """样本字段（顶层或metadata中）"""
+    if name in sample:
+        return sample[name]
+    return (sample.get('metadata') or {}).get(name)
+
+
+class HashSplitter:
+    """
+    Args:
+        val_ratio: 验证集文件比例
+        test_ratio: 测试集文件比例（0表示只划分train/val）
+        seed: 哈希种子（改变种子会得到另一套划分）
+        stratify_by: 分层字段，如 ('test_app', 'is_high_quality')
+        assignments_file: 已有分配的JSONL记录（分层时用于保证稳定）
+    """
+
+    def __init__(self, val_ratio: float = 0.1, test_ratio: float = 0.0, seed: str = DEFAULT_SEED,
+                 stratify_by: Sequence[str] = (), assignments_file: Optional[str] = None):
+        if val_ratio < 0 or test_ratio < 0 or val_ratio + test_ratio >= 1:
+            raise ValueError(f"无效的划分比例: val={val_ratio}, test={test_ratio}")
+        self.ratios = {'train': 1 - val_ratio - test_ratio, 'val': val_ratio, 'test': test_ratio}
+        self.seed = seed
+        self.stratify_by = tuple(stratify_by)
+        self.assignments_file = Path(assignments_file) if assignments_file else None
+
+        self.assignments: Dict[str, str] = {}
+        self.new_assignments: Dict[str, Tuple[str, Tuple]] = {}
+        # 每层各集合的文件数
+        self.stratum_counts: Dict[Tuple, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(SPLITS, 0))
+
+        if self.assignments_file and self.assignments_file.exists():
+            with open(self.assignments_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._record(record['file_id'], record['split'], tuple(record.get('stratum', ())))
+            logger.info(f"📋 Loaded {len(self.assignments)} existing split assignments")
+
+    def _record(self, file_id: str, split: str, stratum: Tuple):
+        self.assignments[file_id] = split
+        self.stratum_counts[stratum][split] += 1
+
+    def _hash_split(self, file_id: str) -> str:
+        u = hash_fraction(file_id, self.seed)
+        if u < self.ratios['test']:
+            return 'test'
+        if u < self.ratios['test'] + self.ratios['val']:
+            return 'val'
+        return 'train'
+
+    def stratum(self, sample: Dict) -> Tuple:
+        return tuple(str(sample_field(sample, name)) for name in self.stratify_by)
+
+    def assign(self, file_id: str, stratum: Tuple = ()) -> str:
+        """文件的集合（已分配的文件直接返回原集合）"""
+        split = self.assignments.get(file_id)
+        if split is not None:
+            return split
+
+        if not self.stratify_by:
+            split = self._hash_split(file_id)
+        else:
+            # 把新文件分给该层内缺额最大的集合；缺额相同时用哈希决定
+            counts = self.stratum_counts[stratum]
+            n = sum(counts.values()) + 1
+            deficits = {s: self.ratios[s] * n - counts[s] for s in SPLITS if self.ratios[s] > 0}
+            best = max(deficits.values())
+            candidates = [s for s in SPLITS if deficits.get(s) == best]
+            hashed = self._hash_split(file_id)
+            split = hashed if hashed in candidates else candidates[0]
+
+        self._record(file_id, split, stratum)
+        self.new_assignments[file_id] = (split, stratum)
+        return split
+
+    def assign_sample(self, sample: Dict) -> str:
+        return self.assign(str(sample_field(sample, 'file_id')), self.stratum(sample))
+
+    def save(self):
+        """把本次新分配的文件追加到assignments文件"""
+        if not self.assignments_file or not self.new_assignments:
+            return
+        self.assignments_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.assignments_file, 'a', encoding='utf-8') as f:
+            for file_id, (split, stratum) in self.new_assignments.items():
+                f.write(json.dumps({'file_id': file_id, 'split': split, 'stratum': list(stratum)},
+                                   ensure_ascii=False) + '\n')
+        logger.info(f"📋 Recorded {len(self.new_assignments)} new split assignments: {self.assignments_file}")
+        self.new_assignments = {}
+
+    def file_counts(self) -> Dict[str, int]:
+        totals = dict.fromkeys(SPLITS, 0)
+        for counts in self.stratum_counts.values():
+            for split, count in counts.items():
+                totals[split] += count
+        return totals
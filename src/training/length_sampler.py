@@ -0,0 +1,121 @@
+"""
+按token预算分组的batch采样器
+
+样本长度相差10倍以上（导航步骤 vs 数据丰富的文件级工作流），固定样本数的batch
+对短样本太小、对长样本容易OOM。这里按token预算组batch：
+
+1. 每个epoch先整体打乱，再切成若干个桶（bucket_size个样本）
+2. 桶内按长度排序，贪心组batch，使 batch大小 × batch内最长样本 ≤ max_tokens
+3. 打乱batch顺序
+
+桶内排序让同一batch里的样本长度接近（pad少），桶和batch两级打乱保留随机性。
+"""
+
+import logging
+import random
+from typing import Dict, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBudgetBatchSampler:
+    """
+    Args:
+        lengths: 每个样本的token数
+        max_tokens: 每个batch的token预算（按pad后的 batch大小 × 最长样本 计）
+        bucket_size: 每个排序桶的样本数
+        max_batch_size: batch样本数上限（None表示不限）
+        shuffle: 是否打乱（验证集可关闭）
+        seed: 随机种子，第k个epoch使用 seed + k
+    """
+
+    def __init__(self, lengths: Sequence[int], max_tokens: int, bucket_size: int = 1024,
+                 max_batch_size: Optional[int] = None, shuffle: bool = True,
+                 seed: int = 42):
+        self.lengths = [int(n) for n in lengths]
+        self.max_tokens = max_tokens
+        self.bucket_size = bucket_size
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._cached_epoch: Optional[int] = None
+        self._batches: List[List[int]] = []
+        self._stats: Optional[Dict[str, float]] = None
+        self._stats_epoch: Optional[int] = None
+        self._iterating_epoch: Optional[int] = None
+
+        too_long = sum(1 for n in self.lengths if n > max_tokens)
+        if too_long:
+            logger.warning(f"⚠️  {too_long} 个样本超过token预算 {max_tokens}，将单独成batch")
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _build_batches(self) -> List[List[int]]:
+        if self._cached_epoch == self.epoch:
+            return self._batches
+
+        rng = random.Random(self.seed + self.epoch)
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            rng.shuffle(indices)
+
+        batches: List[List[int]] = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(indices[start:start + self.bucket_size], key=self.lengths.__getitem__)
+            batch: List[int] = []
+            longest = 0
+            for idx in bucket:
+                new_longest = max(longest, self.lengths[idx])
+                full = (len(batch) + 1) * new_longest > self.max_tokens
+                if self.max_batch_size and len(batch) >= self.max_batch_size:
+                    full = True
+                if batch and full:
+                    batches.append(batch)
+                    batch, new_longest = [], self.lengths[idx]
+                batch.append(idx)
+                longest = new_longest
+            if batch:
+                batches.append(batch)
+
+        if self.shuffle:
+            rng.shuffle(batches)
+
+        self._batches = batches
+        self._cached_epoch = self.epoch
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._build_batches()
+        self._iterating_epoch = self.epoch
+        # 未显式调用set_epoch时，下一次迭代自动换一种打乱
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self) -> int:
+        return len(self._build_batches())
+
+    def stats(self) -> Dict[str, float]:
+        """正在迭代（或即将迭代）的epoch的padding比例和每个batch的token数"""
+        epoch = self._iterating_epoch if self._iterating_epoch is not None else self.epoch
+        if self._stats is not None and self._stats_epoch == epoch:
+            return self._stats
+        saved_epoch, self.epoch = self.epoch, epoch
+        batches = self._build_batches()
+        self.epoch = saved_epoch
+        real = padded = 0
+        for batch in batches:
+            batch_lengths = [self.lengths[i] for i in batch]
+            real += sum(batch_lengths)
+            padded += len(batch) * max(batch_lengths)
+        num_batches = max(len(batches), 1)
+        self._stats_epoch = epoch
+        self._stats = {
+            'num_batches': len(batches),
+            'padding_ratio': 1 - real / padded if padded else 0.0,
+            'real_tokens_per_batch': real / num_batches,
+            'padded_tokens_per_batch': padded / num_batches,
+            'samples_per_batch': len(self.lengths) / num_batches,
+        }
+        return self._stats
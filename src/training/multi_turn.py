@@ -0,0 +1,146 @@
+"""
+工作流级多轮训练序列（共享前缀）
+
+层次化样本中每个step都重复一遍 "File Task: …"、进度和前序步骤，文件级前缀
+被编码了"步数"次。这里把同一工作流的所有step放进一条多轮序列：
+
+    [说明 + File Task]  ← 只编码一次，不计算loss
+    ### Step 1/N: 指令   ### Response: 输出<eos>   ← 只在输出上计算loss
+    ### Step 2/N: 指令   ### Response: 输出<eos>
+    ...
+
+超过max_length时按窗口切分，每个窗口重新带上File Task；窗口的第一个step补上
+前序步骤摘要（前一窗口的内容在本窗口中不可见）。监督信号与逐step样本相同。
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from training.columnar import iter_samples
+from training.prompts import format_prompt
+
+logger = logging.getLogger(__name__)
+
+IGNORE_INDEX = -100
+
+MULTI_TURN_HEADER = """Below is a workflow task followed by its steps. For each step, write the JSON that completes it.
+
+### File Task:
+{file_task}
+"""
+
+MULTI_TURN_STEP = """
+### Step {current}/{total}:
+{instruction}{context}
+
+### Response:
+"""
+
+CURRENT_STEP_MARKER = "\nCurrent Step: "
+
+
+def group_by_workflow(samples: Iterable[Dict]) -> List[Tuple[str, List[Dict]]]:
+    """按metadata.file_id分组（保持文件首次出现顺序），组内按step_index排序"""
+    groups: "OrderedDict[str, List[Dict]]" = OrderedDict()
+    for sample in samples:
+        groups.setdefault(sample['metadata']['file_id'], []).append(sample)
+    return [(file_id, sorted(steps, key=lambda s: s['metadata']['step_index']))
+            for file_id, steps in groups.items()]
+
+
+def step_instruction(sample: Dict) -> str:
+    """层次化样本的instruction中只取 "Current Step:" 之后的部分"""
+    instruction = sample['instruction']
+    if CURRENT_STEP_MARKER in instruction:
+        return instruction.split(CURRENT_STEP_MARKER, 1)[1]
+    return instruction
+
+
+def format_step_turn(sample: Dict, include_previous: bool) -> str:
+    context = sample['metadata'].get('context', {})
+    progress = context.get('progress', {})
+    extra = []
+    if include_previous and context.get('previous_steps'):
+        extra.append("Previous: " + "; ".join(ps['instruction'] for ps in context['previous_steps']))
+    if context.get('remaining_objects'):
+        extra.append("Remaining: " + ", ".join(context['remaining_objects'][:3]))
+    return MULTI_TURN_STEP.format(
+        current=progress.get('current_step', sample['metadata']['step_index'] + 1),
+        total=progress.get('total_steps', '?'),
+        instruction=step_instruction(sample),
+        context="".join("\n" + e for e in extra)
+    )
+
+
+def encode_workflow(tokenizer, steps: List[Dict], max_length: int) -> Tuple[List[Dict[str, List[int]]], int]:
+    """
+    把一个工作流编码为若干窗口
+
+    Returns:
+        ([{input_ids, labels}, ...], 逐step训练（format_prompt + eos，截断到max_length）的token数，用于统计)
+    """
+    def encode(text: str) -> List[int]:
+        return tokenizer(text, add_special_tokens=False)['input_ids']
+
+    file_task = steps[0]['metadata'].get('context', {}).get('file_task', '')
+    header = encode(MULTI_TURN_HEADER.format(file_task=file_task))
+    eos = [tokenizer.eos_token_id] if tokenizer.eos_token_id is not None else []
+
+    windows: List[Dict[str, List[int]]] = []
+    input_ids: List[int] = list(header)
+    labels: List[int] = [IGNORE_INDEX] * len(header)
+    turns_in_window = 0
+    per_step_tokens = 0
+
+    for i, sample in enumerate(steps):
+        prompt = encode(format_step_turn(sample, include_previous=False))
+        response = encode(sample['output']) + eos
+        # 对比基准：逐step训练实际使用的样本（_tokenize_function 的tokenize方式）
+        single = len(tokenizer(format_prompt(sample)['text'])['input_ids']) + len(eos)
+        per_step_tokens += min(single, max_length)
+
+        if turns_in_window and len(input_ids) + len(prompt) + len(response) > max_length:
+            windows.append({'input_ids': input_ids, 'labels': labels})
+            input_ids, labels, turns_in_window = list(header), [IGNORE_INDEX] * len(header), 0
+        if turns_in_window == 0 and i > 0:
+            prompt = encode(format_step_turn(sample, include_previous=True))
+
+        budget = max_length - len(input_ids) - len(prompt)
+        if budget <= 0:
+            logger.warning(f"⚠️  {sample['metadata']['file_id']} step {i}: 前缀超过max_length，跳过")
+            continue
+        response = response[:budget]
+
+        input_ids.extend(prompt)
+        labels.extend([IGNORE_INDEX] * len(prompt))
+        input_ids.extend(response)
+        labels.extend(response)
+        turns_in_window += 1
+
+    if turns_in_window:
+        windows.append({'input_ids': input_ids, 'labels': labels})
+    return windows, per_step_tokens
+
+
+def build_multi_turn_sequences(tokenizer, data_file: str, max_length: int,
+                               stats: Dict[str, int] = None) -> Iterator[Dict[str, List[int]]]:
+    """
+    从层次化训练数据生成多轮序列（每个工作流一条或多条窗口）
+
+    Args:
+        stats: 传入dict时累计 workflows / steps / windows / tokens / per_step_tokens
+    """
+    stats = stats if stats is not None else {}
+    for key in ('workflows', 'steps', 'windows', 'tokens', 'per_step_tokens'):
+        stats.setdefault(key, 0)
+
+    for _, steps in group_by_workflow(iter_samples(data_file)):
+        windows, per_step_tokens = encode_workflow(tokenizer, steps, max_length)
+        stats['workflows'] += 1
+        stats['steps'] += len(steps)
+        stats['windows'] += len(windows)
+        stats['per_step_tokens'] += per_step_tokens
+        for window in windows:
+            stats['tokens'] += len(window['input_ids'])
+            yield window
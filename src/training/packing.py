@@ -0,0 +1,158 @@
+"""
+序列打包（Sequence Packing）
+
+把多个较短的tokenized样本拼成长度不超过max_length的一行，减少pad token：
+- position_ids 在每个样本处从0重新开始
+- 每个样本第一个token的label设为-100，避免上一个样本的最后一个token去预测它
+- 注意力只在样本内部可见：flash_attention_2 通过position_ids识别样本边界；
+  其它注意力实现使用块对角的4D因果mask
+"""
+
+import bisect
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+IGNORE_INDEX = -100
+
+
+def pack_lengths(lengths: Sequence[int], max_length: int) -> List[List[int]]:
+    """
+    最佳适应递减（Best-Fit Decreasing）装箱：按长度从长到短，放进剩余空间最小且够用的行
+
+    Returns:
+        每行包含的样本下标列表
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    bins: List[List[int]] = []
+    # 按剩余空间升序排列的 (剩余空间, 行号)
+    free: List[tuple] = []
+    for idx in order:
+        length = min(int(lengths[idx]), max_length)
+        if length == 0:
+            continue
+        pos = bisect.bisect_left(free, (length, -1))
+        if pos < len(free):
+            remaining, bin_id = free.pop(pos)
+        else:
+            remaining, bin_id = max_length, len(bins)
+            bins.append([])
+        bins[bin_id].append(idx)
+        remaining -= length
+        if remaining > 0:
+            bisect.insort(free, (remaining, bin_id))
+    return bins
+
+
+class PackedDataset(torch.utils.data.Dataset):
+    """把tokenized数据集打包成定长行（每行返回拼接后的input_ids / labels / position_ids）"""
+
+    def __init__(self, dataset, max_length: int, lengths: Optional[Sequence[int]] = None):
+        self.dataset = dataset
+        self.max_length = max_length
+        if lengths is None:
+            lengths = getattr(dataset, 'lengths', None)
+        if lengths is None:
+            column = dataset['input_ids'] if hasattr(dataset, 'column_names') else \
+                [item['input_ids'] for item in dataset]
+            lengths = [len(ids) for ids in column]
+        self.lengths = np.minimum(np.asarray(lengths, dtype=np.int64), max_length)
+        self.bins = pack_lengths(self.lengths, max_length)
+
+    def __len__(self) -> int:
+        return len(self.bins)
+
+    @property
+    def num_tokens(self) -> int:
+        return int(self.lengths.sum())
+
+    @property
+    def efficiency(self) -> float:
+        """打包效率 = 真实token数 ÷ (行数 × max_length)"""
+        total = len(self.bins) * self.max_length
+        return self.num_tokens / total if total else 0.0
+
+    def __getitem__(self, idx: int) -> Dict[str, List[int]]:
+        input_ids: List[int] = []
+        labels: List[int] = []
+        position_ids: List[int] = []
+        loss_weights: List[float] = []
+        for sample_idx in self.bins[idx]:
+            sample = self.dataset[sample_idx]
+            ids = list(sample['input_ids'][:self.max_length])
+            sample_labels = list(sample.get('labels', ids)[:self.max_length])
+            sample_labels[0] = IGNORE_INDEX  # 样本边界不计算loss
+            input_ids.extend(ids)
+            labels.extend(sample_labels)
+            position_ids.extend(range(len(ids)))
+            if 'loss_weights' in sample:
+                loss_weights.extend(sample['loss_weights'][:self.max_length])
+        row = {'input_ids': input_ids, 'labels': labels, 'position_ids': position_ids}
+        if loss_weights:
+            row['loss_weights'] = loss_weights
+        return row
+
+
+class PackedDataCollator:
+    """
+    打包行的collator
+
+    Args:
+        pad_token_id: pad token
+        block_diagonal_mask: True时生成块对角4D因果mask（eager/sdpa注意力），
+            False时只提供position_ids（flash_attention_2按position_ids切分样本）
+        mask_dtype: 4D mask的数据类型（与模型计算精度一致）
+    """
+
+    def __init__(self, pad_token_id: int, block_diagonal_mask: bool = True,
+                 mask_dtype: torch.dtype = torch.float16, pad_to: Optional[int] = None):
+        self.pad_token_id = pad_token_id
+        self.block_diagonal_mask = block_diagonal_mask
+        self.mask_dtype = mask_dtype
+        self.pad_to = pad_to
+
+    def __call__(self, features: List[Dict[str, List[int]]]) -> Dict[str, torch.Tensor]:
+        length = max(len(f['input_ids']) for f in features)
+        if self.pad_to:
+            length = max(length, self.pad_to)
+        batch_size = len(features)
+
+        input_ids = torch.full((batch_size, length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, length), IGNORE_INDEX, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, length), dtype=torch.long)
+        for row, f in enumerate(features):
+            n = len(f['input_ids'])
+            input_ids[row, :n] = torch.tensor(f['input_ids'], dtype=torch.long)
+            labels[row, :n] = torch.tensor(f['labels'], dtype=torch.long)
+            position_ids[row, :n] = torch.tensor(f['position_ids'], dtype=torch.long)
+
+        batch = {'input_ids': input_ids, 'labels': labels, 'position_ids': position_ids}
+        if 'loss_weights' in features[0]:
+            loss_weights = torch.zeros((batch_size, length), dtype=torch.float32)
+            for row, f in enumerate(features):
+                loss_weights[row, :len(f['loss_weights'])] = torch.tensor(f['loss_weights'], dtype=torch.float32)
+            batch['loss_weights'] = loss_weights
+        if self.block_diagonal_mask:
+            batch['attention_mask'] = self._block_diagonal_causal_mask(features, length)
+        return batch
+
+    def _block_diagonal_causal_mask(self, features, length: int) -> torch.Tensor:
+        """[batch, 1, L, L]：0表示可见，dtype最小值表示屏蔽"""
+        min_value = torch.finfo(self.mask_dtype).min
+        mask = torch.full((len(features), 1, length, length), min_value, dtype=self.mask_dtype)
+        causal = torch.ones((length, length), dtype=torch.bool).tril()
+        for row, f in enumerate(features):
+            # 样本起点：position_id为0的位置
+            starts = [i for i, p in enumerate(f['position_ids']) if p == 0]
+            ends = starts[1:] + [len(f['position_ids'])]
+            for start, end in zip(starts, ends):
+                block = causal[:end - start, :end - start]
+                mask[row, 0, start:end, start:end].masked_fill_(block, 0)
+            # pad位置只看自己，避免整行被屏蔽产生NaN
+            for i in range(ends[-1] if ends else 0, length):
+                mask[row, 0, i, i] = 0
+        return mask
@@ -11,24 +11,38 @@
 """
 
 import json
+import sys
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import logging
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from training.columnar import write_shards
+from training.fast_json import INDENT, dump_indented, dumps_indented, join_indented_list
+from training.hash_split import HashSplitter
+from data_processing.workflow_dsl import encode_workflow, workflow_metadata
+from data_processing.step_classification import target_step
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 工作流JSON中steps数组的占位符（编码后替换为逐步骤编码拼成的数组）
+STEPS_PLACEHOLDER = '\x00steps\x00'
+STEPS_PLACEHOLDER_JSON = json.dumps(STEPS_PLACEHOLDER)
+
 
 class FileeLevelTrainingDataPreparer:
     """文件级训练数据准备器"""
     
-    def __init__(self, remove_weight_markers: bool = True):
+    def __init__(self, remove_weight_markers: bool = True, target_format: str = 'json'):
         """
         Args:
             remove_weight_markers: 是否移除权重标记（**关键** -> 关键）
+            target_format: 输出目标格式，json=缩进JSON，dsl=紧凑DSL（data_processing/workflow_dsl.py）
         """
         self.remove_weight_markers = remove_weight_markers
+        self.target_format = target_format
     
     def clean_instruction(self, instruction: str) -> str:
         """清理指令文本"""
@@ -41,13 +55,15 @@ class FileeLevelTrainingDataPreparer:
         
         return instruction.strip()
     
-    def convert_file_to_training_sample(self, file_instr: Dict, workflow: Dict) -> Dict:
+    def convert_file_to_training_sample(self, file_instr: Dict, workflow: Dict,
+                                        step_codes: Optional[List[str]] = None) -> Dict:
         """
         将文件级指令转换为训练样本
         
         Args:
             file_instr: 文件级指令（包含instruction）
             workflow: 原始工作流数据（包含所有steps）
+            step_codes: 各步骤已编码的JSON（可选，与step级样本共用）
         
         Returns:
             训练样本 {instruction, input, output}
@@ -59,7 +75,7 @@ class FileeLevelTrainingDataPreparer:
         input_context = self._build_context(file_instr, workflow)
         
         # 获取输出：完整的工作流JSON（包含所有steps）
-        output_code = self._extract_workflow_json(workflow)
+        output_code = self._extract_workflow_json(workflow, step_codes)
         
         return {
             "instruction": instruction,
@@ -101,17 +117,21 @@ class FileeLevelTrainingDataPreparer:
         
         return " | ".join(context_parts) if context_parts else ""
     
-    def _extract_workflow_json(self, workflow: Dict) -> str:
+    def _extract_workflow_json(self, workflow: Dict, step_codes: Optional[List[str]] = None) -> str:
         """
         提取完整的工作流JSON
         
-        包含所有steps，这是模型需要学习生成的完整结构
+        包含所有steps，这是模型需要学习生成的完整结构。
+        steps数组由各步骤单独编码的JSON加上缩进拼成（与整体编码结果一致）
         """
         steps = workflow.get('steps', [])
         
         if not steps:
             return "{}"
         
+        if self.target_format == 'dsl':
+            return encode_workflow(steps, workflow_metadata(workflow))
+        
         # 创建工作流结构
         workflow_output = {
             "workflow": {
@@ -120,15 +140,22 @@ class FileeLevelTrainingDataPreparer:
                     "database": workflow.get('database', ''),
                     "total_steps": len(steps)
                 },
-                "steps": steps
+                "steps": STEPS_PLACEHOLDER
             }
         }
         
-        return json.dumps(workflow_output, indent=2, ensure_ascii=False)
+        # steps位于第3层（workflow → steps → 数组元素）
+        steps_indent = INDENT * 2
+        if step_codes is None:
+            step_codes = [dumps_indented(target_step(step)) for step in steps]
+        element_indent = '\n' + steps_indent + INDENT
+        steps_json = join_indented_list([code.replace('\n', element_indent) for code in step_codes], steps_indent)
+        return dumps_indented(workflow_output).replace(STEPS_PLACEHOLDER_JSON, steps_json, 1)
     
     def prepare_dataset(self, instructions_file: str, workflows_file: str,
                        output_file: str, max_samples: int = None,
-                       split_ratio: float = 0.9):
+                       split_ratio: float = 0.9, output_format: str = 'json',
+                       shard_size: int = 50000):
         """
         准备完整的文件级训练数据集
         
@@ -138,6 +165,8 @@ class FileeLevelTrainingDataPreparer:
             output_file: 输出文件路径
             max_samples: 最大样本数（用于测试）
             split_ratio: 训练集比例（0.9 = 90%训练，10%验证）
+            output_format: 'json'（单个JSON数组），或列式分片 'parquet' / 'arrow'
+            shard_size: 列式分片的样本数
         """
         logger.info(f"📖 Loading file-level instructions...")
         
@@ -162,8 +191,11 @@ class FileeLevelTrainingDataPreparer:
         
         logger.info(f"✅ Loaded {len(workflows)} workflows")
         
-        # 转换为训练样本
+        # 转换为训练样本（按file_id哈希划分训练集和验证集）
         training_samples = []
+        train_data = []
+        val_data = []
+        splitter = HashSplitter(val_ratio=1 - split_ratio)
         
         logger.info("🔄 Converting to training format (file-level)...")
         
@@ -180,6 +212,10 @@ class FileeLevelTrainingDataPreparer:
             # 质量过滤
             if self._is_valid_sample(sample):
                 training_samples.append(sample)
+                if splitter.assign(file_id) == 'train':
+                    train_data.append(sample)
+                else:
+                    val_data.append(sample)
             
             processed_count += 1
             
@@ -189,48 +225,70 @@ class FileeLevelTrainingDataPreparer:
         
         logger.info(f"✅ Created {len(training_samples)} training samples")
         
-        # 划分训练集和验证集
-        split_idx = int(len(training_samples) * split_ratio)
-        train_data = training_samples[:split_idx]
-        val_data = training_samples[split_idx:]
-        
         logger.info(f"📊 Split: {len(train_data)} train, {len(val_data)} validation")
         
+        stats = self.save_dataset(training_samples, train_data, val_data, output_file, split_ratio,
+                                  instructions_file, workflows_file, output_format, shard_size)
+        
+        return train_data, val_data, stats
+    
+    def save_dataset(self, training_samples: List[Dict], train_data: List[Dict], val_data: List[Dict],
+                     output_file: str, split_ratio: float, instructions_file: str, workflows_file: str,
+                     output_format: str = 'json', shard_size: int = 50000) -> Dict:
+        """保存训练集/验证集和统计信息"""
         # 保存数据
         output_path = Path(output_file)
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # 训练集
-        train_file = output_path.parent / f"{output_path.stem}_train.json"
-        with open(train_file, 'w', encoding='utf-8') as f:
-            json.dump(train_data, f, indent=2, ensure_ascii=False)
-        logger.info(f"💾 Train data saved: {train_file}")
-        
-        # 验证集
-        val_file = output_path.parent / f"{output_path.stem}_val.json"
-        with open(val_file, 'w', encoding='utf-8') as f:
-            json.dump(val_data, f, indent=2, ensure_ascii=False)
-        logger.info(f"💾 Validation data saved: {val_file}")
+        if output_format != 'json':
+            for split, data in (('train', train_data), ('val', val_data)):
+                files = write_shards(data, output_path.parent / f"{output_path.stem}_{split}",
+                                     shard_size, output_format)
+                logger.info(f"💾 {split} data saved: {len(files)} {output_format} shard(s) "
+                            f"{output_path.parent / f'{output_path.stem}_{split}-*'}")
+        else:
+            # 训练集
+            train_file = output_path.parent / f"{output_path.stem}_train.json"
+            with open(train_file, 'w', encoding='utf-8') as f:
+                dump_indented(train_data, f)
+            logger.info(f"💾 Train data saved: {train_file}")
+            
+            # 验证集
+            val_file = output_path.parent / f"{output_path.stem}_val.json"
+            with open(val_file, 'w', encoding='utf-8') as f:
+                dump_indented(val_data, f)
+            logger.info(f"💾 Validation data saved: {val_file}")
         
         # 保存统计信息
-        stats = {
-            "total_samples": len(training_samples),
-            "train_samples": len(train_data),
-            "val_samples": len(val_data),
+        stats = self.dataset_stats(
+            len(training_samples), len(train_data), len(val_data), split_ratio, instructions_file, workflows_file,
+            sum(len(s['instruction'].split()) for s in training_samples),
+            sum(len(s['output']) for s in training_samples)
+        )
+        self.save_stats(stats, output_path)
+        return stats
+    
+    def dataset_stats(self, total_samples: int, train_samples: int, val_samples: int, split_ratio: float,
+                      instructions_file: str, workflows_file: str, instruction_words: int,
+                      output_chars: int) -> Dict:
+        """统计信息（instruction_words / output_chars 为全部样本的指令词数和输出字符数之和）"""
+        return {
+            "total_samples": total_samples,
+            "train_samples": train_samples,
+            "val_samples": val_samples,
             "split_ratio": split_ratio,
             "source_instructions": instructions_file,
             "source_workflows": workflows_file,
             "data_level": "file-level",
-            "avg_instruction_length": sum(len(s['instruction'].split()) for s in training_samples) / len(training_samples) if training_samples else 0,
-            "avg_output_length": sum(len(s['output']) for s in training_samples) / len(training_samples) if training_samples else 0,
+            "avg_instruction_length": instruction_words / total_samples if total_samples else 0,
+            "avg_output_length": output_chars / total_samples if total_samples else 0,
         }
-        
+    
+    def save_stats(self, stats: Dict, output_path: Path):
         stats_file = output_path.parent / f"{output_path.stem}_stats.json"
         with open(stats_file, 'w', encoding='utf-8') as f:
             json.dump(stats, f, indent=2, ensure_ascii=False)
         logger.info(f"📈 Statistics saved: {stats_file}")
-        
-        return train_data, val_data, stats
     
     def _is_valid_sample(self, sample: Dict) -> bool:
         """验证样本质量"""
@@ -247,8 +305,11 @@ class FileeLevelTrainingDataPreparer:
         if sample['output'] == '{}':
             return False
         
-        # 检查输出包含"workflow"关键词
-        if '"workflow"' not in sample['output']:
+        # 检查输出包含"workflow"关键词（DSL目标以"@"头行开始）
+        if self.target_format == 'dsl':
+            if not sample['output'].startswith('@'):
+                return False
+        elif '"workflow"' not in sample['output']:
             return False
         
         return True
@@ -273,6 +334,12 @@ def main():
                        help='训练集比例（默认0.9）')
     parser.add_argument('--keep-markers', action='store_true',
                        help='保留权重标记（**关键**）')
+    parser.add_argument('--format', choices=['json', 'parquet', 'arrow'], default='json',
+                       help='输出格式：json，或列式分片parquet/arrow')
+    parser.add_argument('--shard-size', type=int, default=50000,
+                       help='列式分片的样本数')
+    parser.add_argument('--target-format', choices=['json', 'dsl'], default='json',
+                       help='输出目标格式：json=缩进JSON，dsl=紧凑DSL（token更少）')
     
     args = parser.parse_args()
     
@@ -286,14 +353,17 @@ def main():
         return
     
     # 准备数据
-    preparer = FileeLevelTrainingDataPreparer(remove_weight_markers=not args.keep_markers)
+    preparer = FileeLevelTrainingDataPreparer(remove_weight_markers=not args.keep_markers,
+                                             target_format=args.target_format)
     
     train_data, val_data, stats = preparer.prepare_dataset(
         instructions_file=args.instructions,
         workflows_file=args.workflows,
         output_file=args.output,
         max_samples=args.max_samples,
-        split_ratio=args.split_ratio
+        split_ratio=args.split_ratio,
+        output_format=args.format,
+        shard_size=args.shard_size
     )
     
     # 输出摘要
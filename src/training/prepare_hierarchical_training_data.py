@@ -12,13 +12,29 @@
 - 了解进度（previous_steps）
 - 知道还需处理什么（remaining_objects）
 """
+import argparse
 import json
+import random
+import re
+import sys
+import time
 from pathlib import Path
 from typing import List, Dict, Any
 import logging
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from training.fast_json import dump_indented
+from data_processing.step_classification import target_step
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+STEP_INSTRUCTIONS_FILE = 'data/processed/step_level_instructions_weighted.jsonl'
+FILE_INSTRUCTIONS_FILE = 'data/processed/file_level_instructions_aggregated.jsonl'
+WORKFLOWS_FILE = 'data/processed/parsed_workflows.jsonl'
+OUTPUT_FILE = 'data/processed/hierarchical_training_data.json'
+
+OBJECT_SUFFIX_RE = re.compile(r'\s+object$', flags=re.IGNORECASE)
+
 
 def extract_objects_from_step(step: Dict) -> List[str]:
     """从step中提取操作的对象"""
@@ -29,8 +45,7 @@ def extract_objects_from_step(step: Dict) -> List[str]:
         obj = step['structure']['object']
         if obj and obj not in ['object', 'objects']:
             # 清理对象名
-            import re
-            obj_clean = re.sub(r'\s+object$', '', obj, flags=re.IGNORECASE)
+            obj_clean = OBJECT_SUFFIX_RE.sub('', obj)
             objects.append(obj_clean)
     
     return objects
@@ -99,10 +114,96 @@ def build_context_for_step(
     }
 
 
+def build_contexts_for_workflow(
+    steps: List[Dict],
+    file_instruction: str
+) -> List[Dict[str, Any]]:
+    """
+    一遍扫描为工作流的所有step构建上下文（O(n)，结果与逐个调用build_context_for_step相同）
+
+    去重对象按首次出现的step排序，因此"当前步骤之前已处理的对象"恰好是
+    去重对象列表的一个前缀：只需记录前缀长度，剩余对象就是其后的切片。
+    """
+    step_objects = [extract_objects_from_step(s) for s in steps]
+
+    unique_objects = []
+    seen = set()
+    # processed_counts[i]: 前i个step中出现过的不同对象数（即已处理前缀的长度）
+    processed_counts = [0]
+    for objs in step_objects:
+        for obj in objs:
+            if obj not in seen:
+                unique_objects.append(obj)
+                seen.add(obj)
+        processed_counts.append(len(unique_objects))
+
+    summaries = [
+        {
+            'step_index': s['step_index'],
+            'instruction': s['instruction'],
+            'action': s['structure'].get('action', '') if 'structure' in s else ''
+        }
+        for s in steps
+    ]
+
+    total_steps = len(steps)
+    total_objects = len(unique_objects)
+    contexts = []
+    for i in range(total_steps):
+        processed = processed_counts[i]
+        contexts.append({
+            'file_task': file_instruction,
+            'previous_steps': [dict(p) for p in summaries[max(0, i - 3):i]],
+            'remaining_objects': unique_objects[processed:processed + 5],  # 最多显示5个
+            'current_objects': list(step_objects[i]),
+            'progress': {
+                'current_step': i + 1,
+                'total_steps': total_steps,
+                'processed_objects': processed,
+                'remaining_objects': total_objects - processed
+            }
+        })
+    return contexts
+
+
+def benchmark(num_files: int = 20, steps_per_file: int = 500, num_objects: int = 40) -> None:
+    """对比逐step构建和一遍构建的耗时（合成的长工作流），并校验结果一致"""
+    rng = random.Random(0)
+    actions = ['create', 'update', 'delete', 'open', 'select']
+    workflows = []
+    for f in range(num_files):
+        steps = []
+        for i in range(steps_per_file):
+            obj = rng.choice([f'E MS Object{rng.randrange(num_objects)} object', 'objects', ''])
+            steps.append({
+                'file_id': f'file_id_{f:05d}',
+                'step_index': i,
+                'instruction': f'{rng.choice(actions)} step {i}',
+                'structure': {'action': rng.choice(actions), 'object': obj}
+            })
+        workflows.append(steps)
+
+    start = time.perf_counter()
+    legacy = [[build_context_for_step(step, 'task', steps, i) for i, step in enumerate(steps)]
+              for steps in workflows]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    linear = [build_contexts_for_workflow(steps, 'task') for steps in workflows]
+    linear_time = time.perf_counter() - start
+
+    total = num_files * steps_per_file
+    logging.info(f"{num_files} 个工作流 × {steps_per_file} 步 = {total} 个上下文")
+    logging.info(f"  逐step构建: {legacy_time:.3f}s ({total / legacy_time:,.0f} steps/s)")
+    logging.info(f"  一遍构建:   {linear_time:.3f}s ({total / linear_time:,.0f} steps/s)")
+    logging.info(f"  加速: {legacy_time / linear_time:.1f}x，结果一致: {legacy == linear}")
+
+
 def build_hierarchical_training_sample(
     step: Dict,
     context: Dict,
-    output_json: Dict
+    output_json: Dict,
+    test_app: str = ''
 ) -> Dict[str, Any]:
     """构建单个训练样本（带层次化上下文）"""
     
@@ -149,6 +250,7 @@ def build_hierarchical_training_sample(
             'step_index': step['step_index'],
             'step_type': step['step_type'],
             'is_high_quality': step.get('is_high_quality', False),
+            'test_app': test_app,
             'provider': 'hierarchical_context_window',
             'keywords': step.get('keywords', []),
             'context': context
@@ -156,25 +258,66 @@ def build_hierarchical_training_sample(
     }
 
 
-def main():
-    """主函数"""
-    logging.info("="*70)
-    logging.info("🏗️  构建层次化训练数据（Context Window策略）")
-    logging.info("="*70)
+def group_steps_by_file(step_insts: List[Dict]) -> Dict[str, List[Dict]]:
+    """按file_id分组step（保持文件首次出现顺序），组内按step_index排序"""
+    steps_by_file = {}
+    for step in step_insts:
+        file_id = step['file_id']
+        if file_id not in steps_by_file:
+            steps_by_file[file_id] = []
+        steps_by_file[file_id].append(step)
     
+    # 确保每个文件的步骤按step_index排序
+    for file_id in steps_by_file:
+        steps_by_file[file_id].sort(key=lambda s: s['step_index'])
+    return steps_by_file
+
+
+def build_workflow_samples(file_id: str, steps: List[Dict], file_inst: Dict, workflow: Dict) -> List[Dict]:
+    """一个工作流的全部层次化训练样本（缺少file指令或工作流时为空）"""
+    if not file_inst or not workflow:
+        logging.warning(f"   ⚠️  跳过 {file_id}: 缺少file指令或工作流")
+        return []
+    
+    file_instruction = file_inst['instruction']
+    contexts = build_contexts_for_workflow(steps, file_instruction)
+    
+    # 为每个step构建上下文和训练样本
+    samples = []
+    for i, step in enumerate(steps):
+        # 获取step的输出JSON（从原始工作流）
+        if i < len(workflow['steps']):
+            output_json = target_step(workflow['steps'][i])
+        else:
+            logging.warning(f"   ⚠️  {file_id} step {i}: 无法找到对应的原始step")
+            continue
+        
+        # 构建训练样本
+        samples.append(build_hierarchical_training_sample(step, contexts[i], output_json,
+                                                          workflow.get('test_app', '')))
+    return samples
+
+
+def build_hierarchical_dataset(step_file: str, file_file: str, workflows_file: str):
+    """
+    加载指令和工作流，构建全部层次化训练样本
+
+    Returns:
+        (训练样本, 按file_id分组的step)
+    """
     # 1. 加载数据
     logging.info("\n📖 加载数据...")
     
     # 加载step级指令
     step_insts = []
-    with open('data/processed/step_level_instructions_weighted.jsonl', 'r', encoding='utf-8') as f:
+    with open(step_file, 'r', encoding='utf-8') as f:
         for line in f:
             step_insts.append(json.loads(line))
     logging.info(f"   ✓ Step指令: {len(step_insts)}")
     
     # 加载file级指令
     file_insts = {}
-    with open('data/processed/file_level_instructions_aggregated.jsonl', 'r', encoding='utf-8') as f:
+    with open(file_file, 'r', encoding='utf-8') as f:
         for line in f:
             data = json.loads(line)
             file_insts[data['file_id']] = data
@@ -182,7 +325,7 @@ def main():
     
     # 加载原始工作流（获取完整的step输出JSON）
     workflows = {}
-    with open('data/processed/parsed_workflows.jsonl', 'r', encoding='utf-8') as f:
+    with open(workflows_file, 'r', encoding='utf-8') as f:
         for line in f:
             data = json.loads(line)
             workflows[data['file_id']] = data
@@ -190,57 +333,49 @@ def main():
     
     # 2. 按file_id分组step
     logging.info("\n📊 按文件分组步骤...")
-    steps_by_file = {}
-    for step in step_insts:
-        file_id = step['file_id']
-        if file_id not in steps_by_file:
-            steps_by_file[file_id] = []
-        steps_by_file[file_id].append(step)
-    
-    # 确保每个文件的步骤按step_index排序
-    for file_id in steps_by_file:
-        steps_by_file[file_id].sort(key=lambda s: s['step_index'])
-    
+    steps_by_file = group_steps_by_file(step_insts)
     logging.info(f"   ✓ 文件数: {len(steps_by_file)}")
     
     # 3. 构建层次化训练样本
     logging.info("\n🏗️  构建训练样本...")
     training_samples = []
-    
     for file_id, steps in steps_by_file.items():
-        file_inst = file_insts.get(file_id)
-        workflow = workflows.get(file_id)
-        
-        if not file_inst or not workflow:
-            logging.warning(f"   ⚠️  跳过 {file_id}: 缺少file指令或工作流")
-            continue
-        
-        file_instruction = file_inst['instruction']
-        
-        # 为每个step构建上下文和训练样本
-        for i, step in enumerate(steps):
-            # 获取step的输出JSON（从原始工作流）
-            if i < len(workflow['steps']):
-                output_json = workflow['steps'][i]
-            else:
-                logging.warning(f"   ⚠️  {file_id} step {i}: 无法找到对应的原始step")
-                continue
-            
-            # 构建上下文
-            context = build_context_for_step(step, file_instruction, steps, i)
-            
-            # 构建训练样本
-            sample = build_hierarchical_training_sample(step, context, output_json)
-            training_samples.append(sample)
+        training_samples.extend(
+            build_workflow_samples(file_id, steps, file_insts.get(file_id), workflows.get(file_id))
+        )
+    return training_samples, steps_by_file
+
+
+def save_hierarchical_training_data(training_samples: List[Dict], output_path: Path):
+    with open(output_path, 'w', encoding='utf-8') as f:
+        dump_indented(training_samples, f)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="构建层次化训练数据")
+    parser.add_argument('--benchmark', action='store_true',
+                        help='只运行上下文构建的性能对比（合成的500步工作流）')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    logging.info("="*70)
+    logging.info("🏗️  构建层次化训练数据（Context Window策略）")
+    logging.info("="*70)
+    
+    training_samples, steps_by_file = build_hierarchical_dataset(
+        STEP_INSTRUCTIONS_FILE, FILE_INSTRUCTIONS_FILE, WORKFLOWS_FILE
+    )
     
     logging.info(f"   ✓ 生成样本数: {len(training_samples)}")
     
     # 4. 保存结果
-    output_path = Path('data/processed/hierarchical_training_data.json')
+    output_path = Path(OUTPUT_FILE)
     logging.info(f"\n💾 保存到: {output_path}")
-    
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(training_samples, f, ensure_ascii=False, indent=2)
+    save_hierarchical_training_data(training_samples, output_path)
     
     # 5. 统计信息
     logging.info("\n" + "="*70)
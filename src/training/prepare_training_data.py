@@ -3,6 +3,8 @@
 
 输入：step_level_instructions_weighted_variants_marked.jsonl
 输出：training_data.json (Alpaca格式)
+      --streaming 模式下输出 training_data_train-00000.jsonl 等JSONL分片
+      （--shard-format parquet/arrow 时输出列式分片）
 
 格式：
 {
@@ -13,25 +15,138 @@
 """
 
 import json
+import sys
 import argparse
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterator, Optional, Tuple
 import logging
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from training.columnar import ColumnarShardWriter, iter_samples
+from training.fast_json import dump_indented, dumps_indented
+from training.hash_split import HashSplitter
+from data_processing.workflow_dsl import encode_step
+from data_processing.step_classification import target_step
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+class ShardedJsonlWriter:
+    """按固定样本数切分的JSONL分片写入器：{prefix}-00000.jsonl, {prefix}-00001.jsonl, ..."""
+
+    def __init__(self, prefix: Path, shard_size: int = 50000):
+        self.prefix = Path(prefix)
+        self.shard_size = shard_size
+        self.files: List[Path] = []
+        self.count = 0
+        self._fh = None
+
+    def write(self, sample: Dict):
+        if self._fh is None or self.count % self.shard_size == 0:
+            self._open_next_shard()
+        self._fh.write(json.dumps(sample, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def _open_next_shard(self):
+        if self._fh is not None:
+            self._fh.close()
+        path = self.prefix.parent / f"{self.prefix.name}-{len(self.files):05d}.jsonl"
+        self.files.append(path)
+        self._fh = open(path, 'w', encoding='utf-8')
+
+    def close(self) -> List[Path]:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        return self.files
+
+
+class WorkflowIndex:
+    """
+    磁盘上的file_id索引：只在内存中保留 file_id → 字节偏移，按需seek读取工作流
+
+    指令按file_id分组，连续的查询命中同一个工作流时直接复用上一次的解析结果。
+    """
+
+    def __init__(self, workflows_file: str):
+        self.path = workflows_file
+        self.offsets: Dict[str, int] = {}
+        with open(workflows_file, 'rb') as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    file_id = json.loads(line).get('file_id', '')
+                    self.offsets[file_id] = offset  # 与dict加载一致：重复file_id以最后一条为准
+                offset += len(line)
+        self._fh = open(workflows_file, 'rb')
+        self._last_id: Optional[str] = None
+        self._last_wf: Dict = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, file_id: str) -> Dict:
+        if file_id != self._last_id:
+            offset = self.offsets.get(file_id)
+            if offset is None:
+                self._last_wf = {}
+            else:
+                self._fh.seek(offset)
+                self._last_wf = json.loads(self._fh.readline())
+            self._last_id = file_id
+        return self._last_wf
+
+    def close(self):
+        self._fh.close()
+
+
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def merge_join(instructions: Iterator[Dict], workflows: Iterator[Dict]) -> Iterator[Tuple[Dict, Dict]]:
+    """
+    归并连接两个按file_id升序排列的流（如脱敏后的file_id_00001, file_id_00002, ...）
+
+    Yields:
+        (指令, 工作流)；找不到工作流的指令得到空dict
+    """
+    workflow: Dict = {}
+    wf_id = None
+    last_instr_id = None
+    for instr in instructions:
+        file_id = instr.get('file_id', '')
+        if last_instr_id is not None and file_id < last_instr_id:
+            raise ValueError(f"指令文件未按file_id排序: {file_id!r} 出现在 {last_instr_id!r} 之后，请使用 --join index")
+        last_instr_id = file_id
+        while wf_id is None or wf_id < file_id:
+            next_wf = next(workflows, None)
+            if next_wf is None:
+                workflow, wf_id = {}, '\U0010ffff'  # 工作流已读完
+                break
+            next_id = next_wf.get('file_id', '')
+            if wf_id is not None and next_id < wf_id:
+                raise ValueError(f"工作流文件未按file_id排序: {next_id!r} 出现在 {wf_id!r} 之后，请使用 --join index")
+            workflow, wf_id = next_wf, next_id
+        yield instr, (workflow if wf_id == file_id else {})
+
+
 class TrainingDataPreparer:
     """训练数据准备器"""
     
-    def __init__(self, remove_weight_markers: bool = True):
+    def __init__(self, remove_weight_markers: bool = True, target_format: str = 'json'):
         """
         Args:
             remove_weight_markers: 是否移除权重标记（**关键** -> 关键）
+            target_format: 输出目标格式，json=缩进JSON，dsl=紧凑DSL（data_processing/workflow_dsl.py）
         """
         self.remove_weight_markers = remove_weight_markers
+        self.target_format = target_format
     
     def clean_instruction(self, instruction: str) -> str:
         """清理指令文本"""
@@ -44,13 +159,15 @@ class TrainingDataPreparer:
         
         return instruction.strip()
     
-    def convert_step_to_training_sample(self, step: Dict, workflow: Dict) -> Dict:
+    def convert_step_to_training_sample(self, step: Dict, workflow: Dict,
+                                        step_codes: Optional[List[str]] = None) -> Dict:
         """
         将步骤转换为训练样本
         
         Args:
             step: 步骤数据（包含instruction）
             workflow: 原始工作流数据（包含JSON代码）
+            step_codes: 工作流各步骤已编码的JSON（可选，多个样本共用时避免重复编码）
         
         Returns:
             训练样本 {instruction, input, output}
@@ -62,7 +179,7 @@ class TrainingDataPreparer:
         input_context = self._build_context(step, workflow)
         
         # 获取输出JSON代码
-        output_code = self._extract_step_code(step, workflow)
+        output_code = self._extract_step_code(step, workflow, step_codes)
         
         return {
             "instruction": instruction,
@@ -99,7 +216,7 @@ class TrainingDataPreparer:
         
         return " | ".join(context_parts) if context_parts else ""
     
-    def _extract_step_code(self, step: Dict, workflow: Dict) -> str:
+    def _extract_step_code(self, step: Dict, workflow: Dict, step_codes: Optional[List[str]] = None) -> str:
         """
         提取步骤对应的JSON代码
         
@@ -109,9 +226,13 @@ class TrainingDataPreparer:
         steps = workflow.get('steps', [])
         
         if 0 <= step_index < len(steps):
-            step_data = steps[step_index]
+            if self.target_format == 'dsl':
+                return encode_step(steps[step_index])
+            if step_codes is not None:
+                return step_codes[step_index]
+            step_data = target_step(steps[step_index])
             # 格式化JSON输出
-            return json.dumps(step_data, indent=2, ensure_ascii=False)
+            return dumps_indented(step_data)
         
         return "{}"
     
@@ -149,8 +270,11 @@ class TrainingDataPreparer:
         
         logger.info(f"✅ Loaded {len(workflows)} workflows")
         
-        # 转换为训练样本
+        # 转换为训练样本（按file_id哈希划分，同一文件的步骤不会同时出现在训练集和验证集）
         training_samples = []
+        train_data = []
+        val_data = []
+        splitter = HashSplitter(val_ratio=1 - split_ratio)
         
         logger.info("🔄 Converting to training format...")
         for instr in tqdm(instructions, desc="Processing"):
@@ -166,6 +290,10 @@ class TrainingDataPreparer:
             # 质量过滤
             if self._is_valid_sample(sample):
                 training_samples.append(sample)
+                if splitter.assign(file_id) == 'train':
+                    train_data.append(sample)
+                else:
+                    val_data.append(sample)
             
             # 限制数量
             if max_samples and len(training_samples) >= max_samples:
@@ -173,13 +301,16 @@ class TrainingDataPreparer:
         
         logger.info(f"✅ Created {len(training_samples)} training samples")
         
-        # 划分训练集和验证集
-        split_idx = int(len(training_samples) * split_ratio)
-        train_data = training_samples[:split_idx]
-        val_data = training_samples[split_idx:]
-        
         logger.info(f"📊 Split: {len(train_data)} train, {len(val_data)} validation")
         
+        stats = self.save_dataset(training_samples, train_data, val_data, output_file, split_ratio,
+                                  instructions_file, workflows_file)
+        
+        return train_data, val_data, stats
+    
+    def save_dataset(self, training_samples: List[Dict], train_data: List[Dict], val_data: List[Dict],
+                     output_file: str, split_ratio: float, instructions_file: str, workflows_file: str) -> Dict:
+        """保存训练集/验证集和统计信息"""
         # 保存数据
         output_path = Path(output_file)
         output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -187,34 +318,137 @@ class TrainingDataPreparer:
         # 训练集
         train_file = output_path.parent / f"{output_path.stem}_train.json"
         with open(train_file, 'w', encoding='utf-8') as f:
-            json.dump(train_data, f, indent=2, ensure_ascii=False)
+            dump_indented(train_data, f)
         logger.info(f"💾 Train data saved: {train_file}")
         
         # 验证集
         val_file = output_path.parent / f"{output_path.stem}_val.json"
         with open(val_file, 'w', encoding='utf-8') as f:
-            json.dump(val_data, f, indent=2, ensure_ascii=False)
+            dump_indented(val_data, f)
         logger.info(f"💾 Validation data saved: {val_file}")
         
         # 保存统计信息
-        stats = {
-            "total_samples": len(training_samples),
-            "train_samples": len(train_data),
-            "val_samples": len(val_data),
+        stats = self.dataset_stats(
+            len(training_samples), len(train_data), len(val_data), split_ratio, instructions_file, workflows_file,
+            sum(len(s['instruction'].split()) for s in training_samples),
+            sum(len(s['output']) for s in training_samples)
+        )
+        self.save_stats(stats, output_path)
+        return stats
+    
+    def dataset_stats(self, total_samples: int, train_samples: int, val_samples: int, split_ratio: float,
+                      instructions_file: str, workflows_file: str, instruction_words: int,
+                      output_chars: int) -> Dict:
+        """统计信息（instruction_words / output_chars 为全部样本的指令词数和输出字符数之和）"""
+        return {
+            "total_samples": total_samples,
+            "train_samples": train_samples,
+            "val_samples": val_samples,
             "split_ratio": split_ratio,
             "source_instructions": instructions_file,
             "source_workflows": workflows_file,
-            "avg_instruction_length": sum(len(s['instruction'].split()) for s in training_samples) / len(training_samples),
-            "avg_output_length": sum(len(s['output']) for s in training_samples) / len(training_samples),
+            "avg_instruction_length": instruction_words / total_samples,
+            "avg_output_length": output_chars / total_samples,
         }
-        
+    
+    def save_stats(self, stats: Dict, output_path: Path):
         stats_file = output_path.parent / f"{output_path.stem}_stats.json"
         with open(stats_file, 'w', encoding='utf-8') as f:
             json.dump(stats, f, indent=2, ensure_ascii=False)
         logger.info(f"📈 Statistics saved: {stats_file}")
-        
-        return train_data, val_data, stats
     
+    def prepare_dataset_streaming(self, instructions_file: str, workflows_file: str,
+                                  output_file: str, max_samples: int = None,
+                                  split_ratio: float = 0.9, join: str = 'index',
+                                  shard_size: int = 50000, shard_format: str = 'jsonl'):
+        """
+        流式准备训练数据集，内存占用与数据量无关
+
+        Args:
+            join: 'index' 为工作流建file_id→偏移的磁盘索引（不要求顺序）；
+                  'merge' 对两个按file_id升序的JSONL做归并连接（不建索引）
+            shard_size: 每个分片的样本数
+            shard_format: 'jsonl'，或列式的 'parquet' / 'arrow'
+
+        训练/验证按file_id哈希划分（每个样本到达时即可决定去向），与非流式模式的划分一致。
+        统计信息由累计值得到。
+        """
+        output_path = Path(output_file)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+        instructions = iter_jsonl(instructions_file)
+        index = None
+        if join == 'merge':
+            logger.info("🔗 Merge-joining file_id-ordered streams...")
+            pairs = merge_join(instructions, iter_jsonl(workflows_file))
+        else:
+            index = WorkflowIndex(workflows_file)
+            logger.info(f"🔗 Indexed {len(index)} workflows")
+            pairs = ((instr, index.get(instr.get('file_id', ''))) for instr in instructions)
+
+        splitter = HashSplitter(val_ratio=1 - split_ratio)
+        if shard_format == 'jsonl':
+            make_writer = lambda prefix: ShardedJsonlWriter(prefix, shard_size)
+        else:
+            make_writer = lambda prefix: ColumnarShardWriter(prefix, shard_size, shard_format)
+        train_writer = make_writer(output_path.parent / f"{output_path.stem}_train")
+        val_writer = make_writer(output_path.parent / f"{output_path.stem}_val")
+
+        # 累计统计
+        total = 0
+        instruction_words = 0
+        output_chars = 0
+
+        logger.info("🔄 Converting to training format (streaming)...")
+        for instr, workflow in tqdm(pairs, desc="Processing"):
+            if not workflow:
+                continue
+
+            sample = self.convert_step_to_training_sample(instr, workflow)
+            if not self._is_valid_sample(sample):
+                continue
+
+            if splitter.assign(instr.get('file_id', '')) == 'train':
+                train_writer.write(sample)
+            else:
+                val_writer.write(sample)
+
+            total += 1
+            instruction_words += len(sample['instruction'].split())
+            output_chars += len(sample['output'])
+
+            if max_samples and total >= max_samples:
+                break
+
+        if index is not None:
+            index.close()
+        train_files = train_writer.close()
+        val_files = val_writer.close()
+
+        logger.info(f"✅ Created {total} training samples")
+        logger.info(f"📊 Split: {train_writer.count} train ({len(train_files)} shards), "
+                    f"{val_writer.count} validation ({len(val_files)} shards)")
+
+        stats = {
+            "total_samples": total,
+            "train_samples": train_writer.count,
+            "val_samples": val_writer.count,
+            "split_ratio": split_ratio,
+            "source_instructions": instructions_file,
+            "source_workflows": workflows_file,
+            "avg_instruction_length": instruction_words / total if total else 0,
+            "avg_output_length": output_chars / total if total else 0,
+            "train_files": [str(p) for p in train_files],
+            "val_files": [str(p) for p in val_files],
+        }
+
+        stats_file = output_path.parent / f"{output_path.stem}_stats.json"
+        with open(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2, ensure_ascii=False)
+        logger.info(f"📈 Statistics saved: {stats_file}")
+
+        return train_files, val_files, stats
+
     def _is_valid_sample(self, sample: Dict) -> bool:
         """验证样本质量"""
         # 检查必要字段
@@ -250,6 +484,16 @@ def main():
                        help='训练集比例（默认0.9）')
     parser.add_argument('--keep-markers', action='store_true',
                        help='保留权重标记（**关键**）')
+    parser.add_argument('--streaming', action='store_true',
+                       help='流式连接并输出JSONL分片（内存占用恒定）')
+    parser.add_argument('--join', choices=['index', 'merge'], default='index',
+                       help='流式模式的连接方式：index=磁盘file_id索引，merge=按file_id排序的归并连接')
+    parser.add_argument('--shard-size', type=int, default=50000,
+                       help='流式模式下每个分片的样本数')
+    parser.add_argument('--shard-format', choices=['jsonl', 'parquet', 'arrow'], default='jsonl',
+                       help='分片格式（parquet/arrow为列式分片，隐含--streaming）')
+    parser.add_argument('--target-format', choices=['json', 'dsl'], default='json',
+                       help='输出目标格式：json=缩进JSON，dsl=紧凑DSL（token更少）')
     
     args = parser.parse_args()
     
@@ -263,15 +507,30 @@ def main():
         return
     
     # 准备数据
-    preparer = TrainingDataPreparer(remove_weight_markers=not args.keep_markers)
+    preparer = TrainingDataPreparer(remove_weight_markers=not args.keep_markers,
+                                    target_format=args.target_format)
     
-    train_data, val_data, stats = preparer.prepare_dataset(
-        instructions_file=args.instructions,
-        workflows_file=args.workflows,
-        output_file=args.output,
-        max_samples=args.max_samples,
-        split_ratio=args.split_ratio
-    )
+    if args.streaming or args.shard_format != 'jsonl':
+        train_files, val_files, stats = preparer.prepare_dataset_streaming(
+            instructions_file=args.instructions,
+            workflows_file=args.workflows,
+            output_file=args.output,
+            max_samples=args.max_samples,
+            split_ratio=args.split_ratio,
+            join=args.join,
+            shard_size=args.shard_size,
+            shard_format=args.shard_format
+        )
+        first = next(iter_samples(str(train_files[0])), None) if train_files else None
+        train_data = [first] if first else []
+    else:
+        train_data, val_data, stats = preparer.prepare_dataset(
+            instructions_file=args.instructions,
+            workflows_file=args.workflows,
+            output_file=args.output,
+            max_samples=args.max_samples,
+            split_ratio=args.split_ratio
+        )
     
     # 输出摘要
     logger.info("\n" + "="*70)
@@ -0,0 +1,66 @@
+"""
+训练和推理使用的Prompt模板
+
+不依赖torch/transformers，token预算分析（scripts/analyze_token_budget.py）等工具
+可以直接导入，保证分析的文本与训练、推理时完全一致。
+"""
+
+from typing import Dict
+
+# Prompt模板（也是token缓存键的一部分，修改后缓存自动失效）
+PROMPT_TEMPLATE_WITH_CONTEXT = """Below is an instruction that describes a task, paired with context information. Write a response that appropriately completes the request.
+
+### Instruction:
+{instruction}
+
+### Context:
+{input}
+
+### Response:
+{output}"""
+
+PROMPT_TEMPLATE = """Below is an instruction that describes a task. Write a response that appropriately completes the request.
+
+### Instruction:
+{instruction}
+
+### Response:
+{output}"""
+
+# 推理Prompt（inference/load_model.py 的 generate()）
+INFERENCE_PROMPT_WITH_CONTEXT = """You are a GIS workflow code generator. Generate complete JSON workflow code based on the instruction.
+
+Instruction: {instruction}
+Context: {context}
+
+JSON Code:
+"""
+
+INFERENCE_PROMPT = """You are a GIS workflow code generator. Generate complete JSON workflow code based on the instruction.
+
+Instruction: {instruction}
+
+JSON Code:
+"""
+
+
+def format_prompt(example: Dict) -> Dict[str, str]:
+    """格式化为Qwen的对话格式"""
+    instruction = example['instruction']
+    input_text = example.get('input', '')
+    output = example['output']
+
+    # 构建prompt
+    if input_text:
+        prompt = PROMPT_TEMPLATE_WITH_CONTEXT.format(instruction=instruction, input=input_text, output=output)
+    else:
+        prompt = PROMPT_TEMPLATE.format(instruction=instruction, output=output)
+
+    return {"text": prompt}
+
+
+def format_inference_prompt(instruction: str, context: str = "") -> str:
+    """推理时的prompt（不含输出）"""
+    if context:
+        return INFERENCE_PROMPT_WITH_CONTEXT.format(instruction=instruction, context=context)
+    return INFERENCE_PROMPT.format(instruction=instruction)
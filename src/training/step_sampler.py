@@ -0,0 +1,164 @@
+"""
+按步骤类型加权的采样器
+
+导航步骤（Select Tab, Click Oneshot Button）占了step样本的大多数，但模型几乎已经会生成。
+这里按 step_type（由输出步骤的module/method经 classify_step 得出：navigation、validation、
+editor、hierarchy、crud、data_rich、empty；文件级样本为workflow）/ module 给每个样本一个采样率，高质量模板样本（is_high_quality）再乘以
+一个提升系数，可选再做温度重平衡（类别概率 ∝ 样本数^(1/T)）。每个epoch按权重有放回地
+采样与数据集等量的样本：优化器步数不变，但更多步数落在数据丰富的样本上。
+"""
+
+import json
+import logging
+import random
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from data_processing.step_classification import classify_step
+from data_processing.workflow_dsl import decode_step
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rates(spec: Optional[str]) -> Dict[str, float]:
+    """'navigation=0.2,validation=0.5' → {'navigation': 0.2, 'validation': 0.5}"""
+    rates: Dict[str, float] = {}
+    for part in (spec or '').split(','):
+        if part.strip():
+            name, value = part.rsplit('=', 1)
+            rates[name.strip()] = float(value)
+    return rates
+
+
+def output_step(sample: Dict) -> Optional[Dict]:
+    """样本输出对应的步骤（JSON或DSL）；文件级样本返回 {'workflow': ...}，无法解析时为None"""
+    output = (sample.get('output') or '').strip()
+    if output.startswith('@'):
+        return {'workflow': output}
+    try:
+        step = json.loads(output) if output.startswith('{') else decode_step(output)
+    except (ValueError, KeyError, TypeError):
+        return None
+    return step if isinstance(step, dict) else None
+
+
+def sample_attributes(sample: Dict) -> Dict:
+    """
+    采样相关的属性：step_type、module、is_high_quality
+
+    step_type 由输出步骤按 classify_step 分类（step级和层次化样本都适用；层次化样本
+    metadata.step_type 里存的是模块名，不使用）。is_high_quality 只有带metadata的样本才有
+    """
+    metadata = sample.get('metadata') or {}
+    step = output_step(sample) or {}
+    if 'workflow' in step:
+        step_type = 'workflow'
+    elif 'module' in step and 'method' in step:
+        step_type = classify_step(step if 'test_data' in step else {**step, 'test_data': {}})
+    else:
+        step_type = 'unknown'
+    return {
+        'step_type': step_type,
+        'module': step.get('module') or metadata.get('module') or 'unknown',
+        'is_high_quality': bool(metadata.get('is_high_quality', sample.get('is_high_quality', False))),
+        'has_quality_flag': 'is_high_quality' in metadata or 'is_high_quality' in sample,
+    }
+
+
+class StepTypeWeightedSampler:
+    """
+    Args:
+        attributes: 每个样本的 {step_type, module, is_high_quality}
+        step_type_rates: 按step_type的采样率（未列出的为1.0）
+        module_rates: 按module的采样率（与step_type采样率相乘）
+        high_quality_boost: 高质量样本的权重倍数
+        temperature: 温度重平衡；None表示不做，T>1时小类别被提升
+        num_samples: 每个epoch采样数（默认与数据集等长）
+    """
+
+    def __init__(self, attributes: Sequence[Dict], step_type_rates: Optional[Dict[str, float]] = None,
+                 module_rates: Optional[Dict[str, float]] = None, high_quality_boost: float = 1.0,
+                 temperature: Optional[float] = None, num_samples: Optional[int] = None,
+                 seed: int = 42):
+        self.attributes = list(attributes)
+        self.step_type_rates = step_type_rates or {}
+        self.module_rates = module_rates or {}
+        self.high_quality_boost = high_quality_boost
+        self.temperature = temperature
+        self.num_samples = num_samples or len(self.attributes)
+        self.seed = seed
+        self.epoch = 0
+        self.weights = self._compute_weights()
+        self._warn_unmatched()
+
+    def _warn_unmatched(self):
+        """采样率的key没有匹配到任何样本时（拼写错误或数据里没有该字段）给出警告"""
+        for field, rates in (('step_type', self.step_type_rates), ('module', self.module_rates)):
+            present = {a[field] for a in self.attributes}
+            for name in sorted(set(rates) - present):
+                logger.warning(f"⚠️  {field}='{name}' 没有匹配到任何样本（现有: {', '.join(sorted(present))}）")
+        if self.high_quality_boost != 1.0 and not any(a.get('has_quality_flag', True) for a in self.attributes):
+            logger.warning("⚠️  样本不带 is_high_quality（step级样本没有metadata），--high-quality-boost 无效")
+
+    def _compute_weights(self) -> List[float]:
+        type_counts = Counter(a['step_type'] for a in self.attributes)
+        total = sum(type_counts.values())
+
+        # 温度重平衡：类别目标占比 ∝ count^(1/T)，再平均分给类内样本
+        rebalance: Dict[str, float] = {t: 1.0 for t in type_counts}
+        if self.temperature:
+            scaled = {t: c ** (1 / self.temperature) for t, c in type_counts.items()}
+            norm = sum(scaled.values())
+            rebalance = {t: (scaled[t] / norm) / (type_counts[t] / total) for t in type_counts}
+
+        weights = []
+        for a in self.attributes:
+            w = rebalance[a['step_type']]
+            w *= self.step_type_rates.get(a['step_type'], 1.0)
+            w *= self.module_rates.get(a['module'], 1.0)
+            if a['is_high_quality']:
+                w *= self.high_quality_boost
+            weights.append(w)
+        return weights
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[int]:
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        return iter(rng.choices(range(len(self.weights)), weights=self.weights, k=self.num_samples))
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def expected_shares(self) -> Dict[str, Dict[str, float]]:
+        """每个step_type在原始数据和加权采样下的占比"""
+        total_weight = sum(self.weights)
+        before: Dict[str, float] = defaultdict(float)
+        after: Dict[str, float] = defaultdict(float)
+        for a, w in zip(self.attributes, self.weights):
+            before[a['step_type']] += 1 / len(self.attributes)
+            after[a['step_type']] += w / total_weight
+        return {t: {'before': before[t], 'after': after[t]} for t in before}
+
+    def expected_tokens_per_epoch(self, lengths: Sequence[int]) -> Dict[str, float]:
+        """均匀采样与加权采样下每个epoch的期望token数"""
+        total_weight = sum(self.weights)
+        n = self.num_samples
+        uniform = sum(lengths) / len(lengths) * n
+        weighted = sum(w * l for w, l in zip(self.weights, lengths)) / total_weight * n
+        return {'uniform': uniform, 'weighted': weighted}
+
+    def report(self, lengths: Optional[Sequence[int]] = None):
+        logger.info("🎯 Step-type weighted sampling (per-epoch share before -> after):")
+        for step_type, share in sorted(self.expected_shares().items(), key=lambda kv: -kv[1]['before']):
+            logger.info(f"   {step_type:12s} {share['before']:6.1%} -> {share['after']:6.1%}")
+        if lengths is not None:
+            tokens = self.expected_tokens_per_epoch(lengths)
+            logger.info(f"   tokens/epoch: uniform {tokens['uniform']:,.0f} -> weighted {tokens['weighted']:,.0f} "
+                        f"({tokens['weighted'] / tokens['uniform'] - 1:+.1%})")
+
+
+def load_attributes(samples: Iterable[Dict]) -> List[Dict]:
+    return [sample_attributes(s) for s in samples]
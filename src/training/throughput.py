@@ -0,0 +1,244 @@
+"""
+训练吞吐监测（TrainerCallback）
+
+HF只在每 logging_steps 输出loss。这里逐个优化器step记录：
+- tokens/s：真实token（attention_mask / 打包行的非pad位置）与padding后的token
+- samples/s（打包行按行内样本数计）
+- 数据等待 vs 计算时间：GISHFTrainer.training_step 在每个micro-batch前后通知本回调，
+  上一个事件结束到micro-batch开始之间的时间记为数据等待（取batch），其余为计算
+  （前向/反向/优化器）。CUDA上在micro-batch结束时同步，异步kernel不会算进下一次等待
+- 峰值内存：CUDA为 max_memory_allocated（每个step重置），CPU为进程峰值RSS
+- 评估和checkpoint保存耗时（step结束后的 evaluate / save 事件）
+
+每个step一行写入JSONL，训练结束时打印吞吐汇总并保存为 *_summary.json，
+CPU + 小模型即可运行，用于CI里跟踪性能回归。
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+from transformers import TrainerCallback
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def batch_token_counts(inputs: Dict, pad_token_id: Optional[int] = None) -> Dict[str, int]:
+    """一个micro-batch的 样本数 / 真实token数 / padding后token数"""
+    input_ids = inputs.get('input_ids')
+    if input_ids is None:
+        return {'samples': 0, 'tokens': 0, 'padded_tokens': 0}
+    padded = input_ids.numel()
+    mask = inputs.get('attention_mask')
+    position_ids = inputs.get('position_ids')
+    if position_ids is not None and pad_token_id is not None:
+        # 打包行：行尾padding的position_id为0且是pad token；每个样本从position_id 0开始
+        padding = (position_ids == 0) & (input_ids == pad_token_id)
+        real = padded - int(padding.sum())
+        samples = int(((position_ids == 0) & ~padding).sum())
+    elif mask is not None and mask.dim() == 2:
+        real = int(mask.sum())
+        samples = input_ids.size(0)
+    else:
+        real = padded
+        samples = input_ids.size(0)
+    return {'samples': samples, 'tokens': real, 'padded_tokens': padded}
+
+
+def peak_memory_mb() -> Dict[str, Optional[float]]:
+    if torch.cuda.is_available():
+        return {'peak_memory_mb': torch.cuda.max_memory_allocated() / 2**20, 'memory_kind': 'cuda'}
+    if resource is not None:
+        # Linux上ru_maxrss单位是KB
+        return {'peak_memory_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'memory_kind': 'rss'}
+    return {'peak_memory_mb': None, 'memory_kind': None}
+
+
+def _percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+
+class ThroughputCallback(TrainerCallback):
+    """
+    Args:
+        log_file: 逐step记录的JSONL路径
+        pad_token_id: 用于识别打包行末尾的padding
+        warmup_steps: 汇总时跳过的前几个step（编译、显存分配等一次性开销）
+        synchronize: CUDA上在micro-batch结束时同步，使计算时间准确
+    """
+
+    def __init__(self, log_file: str, pad_token_id: Optional[int] = None, warmup_steps: int = 1,
+                 synchronize: bool = True):
+        self.log_file = Path(log_file)
+        self.pad_token_id = pad_token_id
+        self.warmup_steps = warmup_steps
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.records: List[Dict] = []
+        self._handle = None
+        self._pending: Optional[Dict] = None
+        self._step: Optional[Dict] = None
+        self._mark = self._step_start = time.perf_counter()
+
+    def _begin_step(self):
+        """上一个step（含其评估/保存）结束后，第一个事件到来时开始计下一个step"""
+        if self._step is not None:
+            return
+        self._flush()
+        self._step_start = self._mark
+        self._step = {'samples': 0, 'tokens': 0, 'padded_tokens': 0, 'data_wait_s': 0.0, 'micro_batches': 0}
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def _flush(self):
+        if self._pending is None:
+            return
+        self.records.append(self._pending)
+        if self._handle is not None:
+            self._handle.write(json.dumps(self._pending, ensure_ascii=False) + '\n')
+            self._handle.flush()
+        self._pending = None
+
+    # GISHFTrainer.training_step 调用
+    def batch_start(self, inputs: Dict):
+        self._begin_step()
+        now = time.perf_counter()
+        self._step['data_wait_s'] += now - self._mark
+        self._mark = now
+        for key, value in batch_token_counts(inputs, self.pad_token_id).items():
+            self._step[key] += value
+        self._step['micro_batches'] += 1
+
+    def batch_end(self):
+        if self.synchronize:
+            torch.cuda.synchronize()
+        self._mark = time.perf_counter()
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        if state.is_world_process_zero:
+            self.log_file.parent.mkdir(parents=True, exist_ok=True)
+            self._handle = open(self.log_file, 'w', encoding='utf-8')
+        self._mark = time.perf_counter()
+        self._step = None
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._begin_step()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self._begin_step()
+        if self.synchronize:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        step = self._step
+        wall = now - self._step_start
+        record = {
+            'step': state.global_step,
+            'epoch': round(state.epoch, 4) if state.epoch is not None else None,
+            'wall_s': wall,
+            'data_wait_s': step['data_wait_s'],
+            'compute_s': wall - step['data_wait_s'],
+            'eval_s': 0.0,
+            'save_s': 0.0,
+            'micro_batches': step['micro_batches'],
+            'samples': step['samples'],
+            'tokens': step['tokens'],
+            'padded_tokens': step['padded_tokens'],
+            'tokens_per_s': step['tokens'] / wall if wall > 0 else 0.0,
+            'padded_tokens_per_s': step['padded_tokens'] / wall if wall > 0 else 0.0,
+            'samples_per_s': step['samples'] / wall if wall > 0 else 0.0,
+            'padding_ratio': 1 - step['tokens'] / step['padded_tokens'] if step['padded_tokens'] else 0.0,
+            'world_size': args.world_size,
+        }
+        record.update(peak_memory_mb())
+        # 评估/保存在step结束之后发生，记在这个step上
+        self._pending = record
+        self._step = None
+        self._mark = now
+
+    def on_log(self, args, state, control, **kwargs):
+        self._mark = time.perf_counter()
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        if self._pending is not None:
+            self._pending['eval_s'] += now - self._mark
+        self._mark = now
+
+    def on_save(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        if self._pending is not None:
+            self._pending['save_s'] += now - self._mark
+        self._mark = now
+
+    def record_save(self, seconds: float):
+        """不经过 on_save 的保存（如异步checkpoint的快照停顿），计入当前step"""
+        if self._pending is not None:
+            self._pending['save_s'] += seconds
+        self._mark = time.perf_counter()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self._flush()
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        summary = self.summary()
+        if state.is_world_process_zero and summary:
+            summary_file = self.log_file.with_name(self.log_file.stem + '_summary.json')
+            with open(summary_file, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            self.log_summary(summary)
+
+    def summary(self) -> Dict:
+        """跳过预热step后的吞吐汇总"""
+        records = self.records[self.warmup_steps:] or self.records
+        if not records:
+            return {}
+        wall = sum(r['wall_s'] for r in records)
+        step_times = [r['wall_s'] for r in records]
+        memory = [r['peak_memory_mb'] for r in self.records if r['peak_memory_mb'] is not None]
+        tokens = sum(r['tokens'] for r in records)
+        padded_tokens = sum(r['padded_tokens'] for r in records)
+        return {
+            'steps': len(self.records),
+            'measured_steps': len(records),
+            'wall_s': wall,
+            'tokens_per_s': tokens / wall if wall else 0.0,
+            'padded_tokens_per_s': padded_tokens / wall if wall else 0.0,
+            'samples_per_s': sum(r['samples'] for r in records) / wall if wall else 0.0,
+            'padding_ratio': 1 - tokens / padded_tokens if padded_tokens else 0.0,
+            'data_wait_fraction': sum(r['data_wait_s'] for r in records) / wall if wall else 0.0,
+            'step_time_p50_s': _percentile(step_times, 50),
+            'step_time_p90_s': _percentile(step_times, 90),
+            'eval_s': sum(r['eval_s'] for r in self.records),
+            'save_s': sum(r['save_s'] for r in self.records),
+            'saves': sum(1 for r in self.records if r['save_s'] > 0),
+            'peak_memory_mb': max(memory) if memory else None,
+            'memory_kind': self.records[-1]['memory_kind'],
+            'world_size': self.records[-1]['world_size'],
+        }
+
+    def log_summary(self, summary: Dict):
+        logger.info("=" * 70)
+        logger.info(f"⏱️  吞吐汇总（{summary['measured_steps']}/{summary['steps']} steps，跳过前 "
+                    f"{self.warmup_steps} 个预热step）")
+        logger.info(f"  Tokens/s: {summary['tokens_per_s']:,.0f} 真实 / {summary['padded_tokens_per_s']:,.0f} "
+                    f"含padding（padding {summary['padding_ratio']:.1%}）")
+        logger.info(f"  Samples/s: {summary['samples_per_s']:.2f}")
+        logger.info(f"  Step时间: p50 {summary['step_time_p50_s']:.3f}s, p90 {summary['step_time_p90_s']:.3f}s, "
+                    f"数据等待 {summary['data_wait_fraction']:.1%}")
+        logger.info(f"  评估 {summary['eval_s']:.1f}s, 保存checkpoint {summary['save_s']:.1f}s "
+                    f"（{summary['saves']} 次）")
+        if summary['peak_memory_mb'] is not None:
+            logger.info(f"  峰值内存: {summary['peak_memory_mb']:,.0f} MB ({summary['memory_kind']})")
+        logger.info(f"  逐step记录: {self.log_file}")
+        logger.info("=" * 70)
@@ -0,0 +1,193 @@
+"""
+Tokenized数据集缓存
+
+把tokenize后的样本存成扁平的int32 token数组 + 偏移索引（.npy），加载时内存映射：
+- input_ids.npy: 所有样本的token首尾相接
+- offsets.npy:   第i个样本是 input_ids[offsets[i]:offsets[i+1]]
+- 其它逐token列（如labels）与input_ids对齐存放
+
+缓存键 = 数据文件内容 + prompt模板 + tokenizer + max_length 的哈希，
+任何一项变化都会重新tokenize；数据和tokenizer不变时第二次训练直接加载。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT_VERSION = 1
+
+# 逐token列的存储类型（未列出的默认int32）
+COLUMN_DTYPES = {
+    'input_ids': np.int32,
+    'labels': np.int32,
+    'loss_weights': np.float16,
+}
+
+
+def hash_files(paths: Sequence[str], chunk_size: int = 8 * 1024 * 1024) -> str:
+    """数据文件内容的哈希（按路径顺序）"""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """tokenizer的指纹：词表、特殊token和规范化/切分规则"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(type(tokenizer).__name__.encode('utf-8'))
+    digest.update(str(getattr(tokenizer, 'name_or_path', '')).encode('utf-8'))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode('utf-8'))
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        digest.update(backend.to_str().encode('utf-8'))
+    else:
+        digest.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class MemmapTokenDataset(torch.utils.data.Dataset):
+    """内存映射的tokenized数据集，每个样本返回 input_ids / attention_mask / labels"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        with open(self.directory / 'meta.json', 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(self.directory / 'offsets.npy', mmap_mode='r')
+        self.columns = {
+            name: np.load(self.directory / f'{name}.npy', mmap_mode='r')
+            for name in self.meta['columns']
+        }
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """每个样本的token数"""
+        return np.diff(self.offsets)
+
+    @property
+    def num_tokens(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getitem__(self, idx: int) -> Dict[str, List]:
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        item = {name: column[start:end].tolist() for name, column in self.columns.items()}
+        item['attention_mask'] = [1] * (end - start)
+        if 'labels' not in item:
+            item['labels'] = list(item['input_ids'])
+        return item
+
+
+class TokenizedDatasetCache:
+    """按内容哈希管理的tokenized数据集缓存目录"""
+
+    def __init__(self, cache_dir: str = 'data/cache/tokenized'):
+        self.cache_dir = Path(cache_dir)
+
+    def key(self, data_files: Sequence[str], tokenizer, max_length: int,
+            prompt_template: str, extra: Optional[Dict] = None) -> str:
+        components = {
+            'version': CACHE_FORMAT_VERSION,
+            'data': hash_files(data_files),
+            'tokenizer': tokenizer_fingerprint(tokenizer),
+            'template': hashlib.blake2b(prompt_template.encode('utf-8'), digest_size=16).hexdigest(),
+            'max_length': max_length,
+            'extra': extra or {},
+        }
+        blob = json.dumps(components, sort_keys=True).encode('utf-8')
+        return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def load(self, key: str) -> Optional[MemmapTokenDataset]:
+        directory = self.path(key)
+        if not (directory / 'meta.json').exists():
+            return None
+        return MemmapTokenDataset(directory)
+
+    def build(self, key: str, samples: Iterable[Dict[str, Sequence[int]]],
+              columns: Sequence[str] = ('input_ids',), info: Optional[Dict] = None) -> MemmapTokenDataset:
+        """
+        流式写入缓存（先写临时目录，完成后原子替换）
+
+        Args:
+            samples: 每个样本是 {列名: token序列}，各列等长
+            columns: 需要保存的逐token列
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        directory = self.path(key)
+        tmp_dir = directory.with_name(directory.name + '.tmp')
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir()
+
+        dtypes = {name: COLUMN_DTYPES.get(name, np.int32) for name in columns}
+        raw_files = {name: open(tmp_dir / f'{name}.bin', 'wb') for name in columns}
+        offsets = [0]
+        try:
+            for sample in samples:
+                length = len(sample[columns[0]])
+                for name in columns:
+                    values = np.asarray(sample[name], dtype=dtypes[name])
+                    if len(values) != length:
+                        raise ValueError(f"列 {name} 长度 {len(values)} 与 {columns[0]} 长度 {length} 不一致")
+                    values.tofile(raw_files[name])
+                offsets.append(offsets[-1] + length)
+        finally:
+            for fh in raw_files.values():
+                fh.close()
+
+        for name in columns:
+            _raw_to_npy(tmp_dir / f'{name}.bin', tmp_dir / f'{name}.npy', dtypes[name])
+        np.save(tmp_dir / 'offsets.npy', np.asarray(offsets, dtype=np.int64))
+
+        meta = {
+            'version': CACHE_FORMAT_VERSION,
+            'columns': list(columns),
+            'num_samples': len(offsets) - 1,
+            'num_tokens': offsets[-1],
+            **(info or {}),
+        }
+        with open(tmp_dir / 'meta.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+
+        if directory.exists():
+            shutil.rmtree(directory)
+        os.replace(tmp_dir, directory)
+        logger.info(f"💾 Token cache written: {directory} "
+                    f"({meta['num_samples']} samples, {meta['num_tokens']} tokens)")
+        return MemmapTokenDataset(directory)
+
+
+def _raw_to_npy(raw_path: Path, npy_path: Path, dtype) -> None:
+    """把原始二进制转成带头的.npy（分块拷贝，不整体读入内存）"""
+    count = raw_path.stat().st_size // np.dtype(dtype).itemsize
+    if count == 0:
+        np.save(npy_path, np.zeros(0, dtype=dtype))
+    else:
+        raw = np.memmap(raw_path, dtype=dtype, mode='r', shape=(count,))
+        out = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=(count,))
+        step = 16 * 1024 * 1024
+        for start in range(0, count, step):
+            out[start:start + step] = raw[start:start + step]
+        out.flush()
+        del out, raw
+    raw_path.unlink()
@@ -12,9 +12,11 @@ LoRA微调脚本 - 训练GIS代码生成模型
 """
 
 import os
+import sys
 import json
 import argparse
 import logging
+import time
 from pathlib import Path
 from typing import Dict, List, Optional
 import torch
@@ -39,12 +41,30 @@ from peft import (
 )
 
 # Dataset
-from datasets import load_dataset, Dataset
+from datasets import Dataset
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from training.async_checkpoint import AsyncCheckpointCallback
+from training.columnar import iter_samples, load_raw_dataset, resolve_data_files
+from training.length_sampler import TokenBudgetBatchSampler
+from training.multi_turn import MULTI_TURN_HEADER, MULTI_TURN_STEP, build_multi_turn_sequences
+from training.packing import PackedDataCollator, PackedDataset
+from training.prompts import PROMPT_TEMPLATE, PROMPT_TEMPLATE_WITH_CONTEXT, format_prompt
+from training.step_sampler import StepTypeWeightedSampler, load_attributes, parse_rates
+from training.throughput import ThroughputCallback
+from training.token_cache import TokenizedDatasetCache
+from training.weighted_loss import (
+    WeightedDataCollator,
+    get_keywords,
+    keyword_char_spans,
+    token_weights,
+    weighted_causal_lm_loss,
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-
 @dataclass
 class ModelArguments:
     """模型参数"""
@@ -60,23 +80,93 @@ class ModelArguments:
         default=False,
         metadata={"help": "使用8-bit量化"}
     )
+    torch_dtype: str = field(
+        default="float16",
+        metadata={"help": "模型权重精度（CPU上用float32）"}
+    )
+
+
+DEFAULT_TRAIN_FILE = "data/training/training_data_train.json"
+DEFAULT_VAL_FILE = "data/training/training_data_val.json"
+
+
+def default_data_file(split: str) -> str:
+    """
+    未指定 --train-file / --val-file 时的数据文件
+
+    prepare_training_data.py 写 training_data_{split}.json，split_training_data.py 写
+    training_data_{split}.jsonl；两者都存在时使用较新的一个，并在日志中写明
+    """
+    candidates = [f for f in (f"data/training/training_data_{split}.json",
+                              f"data/training/training_data_{split}.jsonl") if Path(f).exists()]
+    if not candidates:
+        return f"data/training/training_data_{split}.json"
+    chosen = max(candidates, key=os.path.getmtime)
+    if len(candidates) > 1:
+        other = next(f for f in candidates if f != chosen)
+        logger.info(f"📂 {split}: 使用较新的 {chosen}（忽略 {other}，可用 --{split}-file 指定）")
+    return chosen
 
 
 @dataclass
 class DataArguments:
     """数据参数"""
     train_file: str = field(
-        default="data/training/training_data_train.json",
+        default=DEFAULT_TRAIN_FILE,
         metadata={"help": "训练数据文件"}
     )
     val_file: str = field(
-        default="data/training/training_data_val.json",
+        default=DEFAULT_VAL_FILE,
         metadata={"help": "验证数据文件"}
     )
     max_length: int = field(
         default=2048,
         metadata={"help": "最大序列长度"}
     )
+    token_cache_dir: Optional[str] = field(
+        default="data/cache/tokenized",
+        metadata={"help": "tokenized数据集缓存目录（None表示不缓存）"}
+    )
+    packing: bool = field(
+        default=False,
+        metadata={"help": "把短样本打包成max_length的定长行（减少pad token）"}
+    )
+    keyword_weighted_loss: bool = field(
+        default=False,
+        metadata={"help": "按关键词权重加权逐token损失（权重在tokenize时预计算）"}
+    )
+    multi_turn: bool = field(
+        default=False,
+        metadata={"help": "每个工作流一条多轮序列（共享File Task前缀，只在输出上计算loss）"}
+    )
+    step_type_rates: Optional[str] = field(
+        default=None,
+        metadata={"help": "按step_type（classify_step分类）的采样率，如 'navigation=0.2,validation=0.5'"}
+    )
+    module_rates: Optional[str] = field(
+        default=None,
+        metadata={"help": "按module的采样率，如 'Tabs=0.2,Buttons=0.2'"}
+    )
+    high_quality_boost: float = field(
+        default=1.0,
+        metadata={"help": "is_high_quality样本的采样权重倍数"}
+    )
+    sampling_temperature: Optional[float] = field(
+        default=None,
+        metadata={"help": "按step_type做温度重平衡（T>1提升小类别）"}
+    )
+    num_proc: Optional[int] = field(
+        default=None,
+        metadata={"help": "加载多个数据分片时的并行进程数"}
+    )
+    streaming: bool = field(
+        default=False,
+        metadata={"help": "流式读取数据（IterableDataset，需要设置max_steps）"}
+    )
+    max_tokens_per_batch: Optional[int] = field(
+        default=None,
+        metadata={"help": "按token预算组batch（替代固定的per_device_train_batch_size）"}
+    )
 
 
 @dataclass
@@ -101,6 +191,103 @@ class LoraArguments:
     )
 
 
+def dataset_lengths(dataset) -> List[int]:
+    """每个tokenized样本的token数"""
+    lengths = getattr(dataset, 'lengths', None)
+    if lengths is not None:
+        return [int(n) for n in lengths]
+    if isinstance(dataset, Dataset):
+        return [len(ids) for ids in dataset['input_ids']]
+    return [len(item['input_ids']) for item in dataset]
+
+
+class GISHFTrainer(Trainer):
+    """
+    Trainer扩展
+
+    - train_batch_sampler: 自定义batch采样器（如按token预算分组），替代默认的固定batch大小
+    - train_sampler: 自定义样本采样器（如按步骤类型加权）
+    - throughput: 吞吐监测回调，每个micro-batch前后通知它（记录token数和数据等待时间）
+    - async_checkpoint: 后台异步保存adapter checkpoint，替代同步的完整checkpoint
+    - batch中带loss_weights时使用逐token加权损失
+    """
+
+    def __init__(self, *args, train_batch_sampler=None, train_sampler=None,
+                 throughput: Optional[ThroughputCallback] = None,
+                 async_checkpoint: Optional[AsyncCheckpointCallback] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.train_batch_sampler = train_batch_sampler
+        self.train_sampler = train_sampler
+        self.throughput = throughput
+        if throughput is not None:
+            self.add_callback(throughput)
+        if async_checkpoint is not None:
+            # 在DefaultFlowCallback之后，接管它设置的 should_save
+            self.add_callback(async_checkpoint)
+    
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.train_sampler is not None:
+            return self.train_sampler
+        return super()._get_train_sampler(*args, **kwargs)
+
+    def get_train_dataloader(self):
+        if self.train_batch_sampler is None:
+            return super().get_train_dataloader()
+
+        train_dataset = self.train_dataset
+        if isinstance(train_dataset, Dataset):
+            train_dataset = self._remove_unused_columns(train_dataset, description="training")
+
+        dataloader = torch.utils.data.DataLoader(
+            train_dataset,
+            batch_sampler=self.train_batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        if self.throughput is None:
+            return super().training_step(model, inputs, *args, **kwargs)
+        self.throughput.batch_start(inputs)
+        loss = super().training_step(model, inputs, *args, **kwargs)
+        self.throughput.batch_end()
+        return loss
+
+    def _set_signature_columns_if_needed(self):
+        # loss_weights不是模型forward的参数，默认会被remove_unused_columns丢掉
+        super()._set_signature_columns_if_needed()
+        if 'loss_weights' not in self._signature_columns:
+            self._signature_columns = list(self._signature_columns) + ['loss_weights']
+    
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        weights = inputs.pop('loss_weights', None)
+        if weights is None:
+            return super().compute_loss(model, inputs, return_outputs=return_outputs, **kwargs)
+        
+        labels = inputs.pop('labels')
+        outputs = model(**inputs)
+        loss = weighted_causal_lm_loss(outputs.logits, labels, weights)
+        
+        # 模型接受num_items_in_batch时，HF认为loss已按整个梯度累积窗口归一化，不再除以累积步数。
+        # 加权损失是micro-batch内的均值，这里补上累积步数的缩放。多卡时HF乘以进程数是因为它的
+        # loss除以了所有卡的token总数；这里是每卡的均值，DDP本身对梯度取平均，不需要再除
+        if getattr(self, 'model_accepts_loss_kwargs', False) and kwargs.get('num_items_in_batch') is not None:
+            loss = loss / getattr(self, 'current_gradient_accumulation_steps', self.args.gradient_accumulation_steps)
+        return (loss, outputs) if return_outputs else loss
+    
+    def log(self, logs: Dict[str, float], *args, **kwargs):
+        if self.train_batch_sampler is not None and 'loss' in logs:
+            # 采样器按本epoch的分桶计划算出的平均值（不是当前这几步实际的值，实际值见throughput统计）
+            stats = self.train_batch_sampler.stats()
+            logs['planned_padding_ratio'] = round(stats['padding_ratio'], 4)
+            logs['planned_tokens_per_step'] = round(
+                stats['padded_tokens_per_batch'] * self.args.gradient_accumulation_steps, 1
+            )
+        super().log(logs, *args, **kwargs)
+
+
 class GISTrainer:
     """GIS代码生成模型训练器"""
     
@@ -109,12 +296,16 @@ class GISTrainer:
         model_args: ModelArguments,
         data_args: DataArguments,
         lora_args: LoraArguments,
-        training_args: TrainingArguments
+        training_args: TrainingArguments,
+        throughput_log: Optional[str] = None,
+        async_checkpoint: bool = False
     ):
         self.model_args = model_args
         self.data_args = data_args
         self.lora_args = lora_args
         self.training_args = training_args
+        self.throughput_log = throughput_log
+        self.async_checkpoint = async_checkpoint
         
         self.tokenizer = None
         self.model = None
@@ -163,7 +354,7 @@ class GISTrainer:
             quantization_config=quantization_config,
             device_map="auto",
             trust_remote_code=True,
-            torch_dtype=torch.float16,
+            torch_dtype=getattr(torch, self.model_args.torch_dtype),
         )
         
         logger.info("✅ Base model loaded")
@@ -193,69 +384,46 @@ class GISTrainer:
         """准备训练和验证数据集"""
         logger.info("📊 Preparing datasets")
         
+        if self.data_args.streaming:
+            self._prepare_streaming_datasets()
+            return
+        
+        if self.data_args.multi_turn:
+            if self.data_args.keyword_weighted_loss:
+                logger.warning("⚠️  多轮格式暂不支持关键词加权损失，忽略 --keyword-weighted-loss")
+            self._prepare_multi_turn_datasets()
+            return
+        
+        if self.data_args.keyword_weighted_loss:
+            self._prepare_weighted_datasets()
+            return
+        
+        if self.data_args.token_cache_dir:
+            self._prepare_cached_datasets()
+            return
+        
         # 加载数据
-        train_data = load_dataset('json', data_files=self.data_args.train_file, split='train')
-        eval_data = load_dataset('json', data_files=self.data_args.val_file, split='train')
+        train_data = load_raw_dataset(self.data_args.train_file, self.data_args.num_proc)
+        eval_data = load_raw_dataset(self.data_args.val_file, self.data_args.num_proc)
         
         logger.info(f"  Train: {len(train_data)} samples")
         logger.info(f"  Val: {len(eval_data)} samples")
         
-        # 格式化prompt
-        def format_prompt(example):
-            """格式化为Qwen的对话格式"""
-            instruction = example['instruction']
-            input_text = example.get('input', '')
-            output = example['output']
-            
-            # 构建prompt
-            if input_text:
-                prompt = f"""Below is an instruction that describes a task, paired with context information. Write a response that appropriately completes the request.
-
-### Instruction:
-{instruction}
-
-### Context:
-{input_text}
-
-### Response:
-{output}"""
-            else:
-                prompt = f"""Below is an instruction that describes a task. Write a response that appropriately completes the request.
-
-### Instruction:
-{instruction}
-
-### Response:
-{output}"""
-            
-            return {"text": prompt}
-        
         # 应用格式化
         train_data = train_data.map(format_prompt, remove_columns=train_data.column_names)
         eval_data = eval_data.map(format_prompt, remove_columns=eval_data.column_names)
         
         # Tokenize
-        def tokenize_function(examples):
-            tokenized = self.tokenizer(
-                examples['text'],
-                truncation=True,
-                max_length=self.data_args.max_length,
-                padding=False,
-                return_tensors=None
-            )
-            tokenized["labels"] = tokenized["input_ids"].copy()
-            return tokenized
-        
         logger.info("🔄 Tokenizing datasets...")
         self.train_dataset = train_data.map(
-            tokenize_function,
+            self._tokenize_function,
             batched=True,
             remove_columns=train_data.column_names,
             desc="Tokenizing train"
         )
         
         self.eval_dataset = eval_data.map(
-            tokenize_function,
+            self._tokenize_function,
             batched=True,
             remove_columns=eval_data.column_names,
             desc="Tokenizing val"
@@ -263,25 +431,281 @@ class GISTrainer:
         
         logger.info("✅ Datasets prepared")
     
+    def _tokenize_function(self, examples):
+        tokenized = self.tokenizer(
+            examples['text'],
+            truncation=True,
+            max_length=self.data_args.max_length,
+            padding=False,
+            return_tensors=None
+        )
+        tokenized["labels"] = tokenized["input_ids"].copy()
+        return tokenized
+    
+    def _format_and_tokenize(self, examples):
+        """批量格式化 + tokenize（流式数据集只过一遍map）"""
+        texts = [
+            format_prompt({name: examples[name][i] for name in examples})['text']
+            for i in range(len(examples['output']))
+        ]
+        return self._tokenize_function({'text': texts})
+    
+    def _prepare_streaming_datasets(self):
+        """
+        流式读取数据（JSONL或列式分片）：样本在训练时按分片惰性读取和tokenize，
+        不需要把数据集读进内存，也不建token缓存
+        """
+        # 以下选项需要随机访问或预先知道全部样本，流式时关闭
+        args = self.data_args
+        unsupported = {
+            '--multi-turn': args.multi_turn,
+            '--keyword-weighted-loss': args.keyword_weighted_loss,
+            '--packing': args.packing,
+            '--max-tokens-per-batch': args.max_tokens_per_batch,
+            'step-type weighted sampling': (args.step_type_rates or args.module_rates
+                                            or args.sampling_temperature or args.high_quality_boost != 1.0),
+        }
+        ignored = [name for name, enabled in unsupported.items() if enabled]
+        if ignored:
+            logger.warning(f"⚠️  流式数据集不支持 {', '.join(ignored)}，已忽略")
+        args.multi_turn = args.keyword_weighted_loss = args.packing = False
+        args.max_tokens_per_batch = args.step_type_rates = args.module_rates = args.sampling_temperature = None
+        args.high_quality_boost = 1.0
+        if self.training_args.max_steps <= 0:
+            raise ValueError("流式数据集没有长度，需要设置 --max-steps")
+        
+        datasets = []
+        for data_file in (self.data_args.train_file, self.data_args.val_file):
+            data = load_raw_dataset(data_file, streaming=True)
+            data = data.map(self._format_and_tokenize, batched=True, remove_columns=data.column_names)
+            datasets.append(data)
+        self.train_dataset = datasets[0].shuffle(seed=self.training_args.seed, buffer_size=10000)
+        self.eval_dataset = datasets[1]
+        logger.info(f"  Train: streaming {len(resolve_data_files(self.data_args.train_file))} file(s)")
+        logger.info(f"  Val: streaming {len(resolve_data_files(self.data_args.val_file))} file(s)")
+        logger.info("✅ Datasets prepared (streaming)")
+    
+    def _load_or_build_cached(self, cache: TokenizedDatasetCache, data_file: str, split: str):
+        """命中缓存时直接内存映射，否则tokenize一遍并写入缓存"""
+        key = cache.key(
+            resolve_data_files(data_file), self.tokenizer, self.data_args.max_length,
+            prompt_template=PROMPT_TEMPLATE_WITH_CONTEXT + PROMPT_TEMPLATE
+        )
+        dataset = cache.load(key)
+        if dataset is not None:
+            logger.info(f"⚡ {split}: loaded token cache {cache.path(key)} "
+                        f"({len(dataset)} samples, {dataset.num_tokens} tokens)")
+            return dataset
+        
+        logger.info(f"🔄 {split}: no token cache, tokenizing {data_file}...")
+        data = load_raw_dataset(data_file, self.data_args.num_proc)
+        data = data.map(format_prompt, remove_columns=data.column_names)
+        data = data.map(
+            self._tokenize_function,
+            batched=True,
+            remove_columns=data.column_names,
+            desc=f"Tokenizing {split}"
+        )
+        return cache.build(
+            key, data, columns=('input_ids',),
+            info={'data_file': data_file, 'max_length': self.data_args.max_length}
+        )
+    
+    def _prepare_cached_datasets(self):
+        """通过tokenized缓存准备数据集（数据、模板、tokenizer和max_length都不变时跳过tokenize）"""
+        start = time.time()
+        cache = TokenizedDatasetCache(self.data_args.token_cache_dir)
+        self.train_dataset = self._load_or_build_cached(cache, self.data_args.train_file, 'train')
+        self.eval_dataset = self._load_or_build_cached(cache, self.data_args.val_file, 'val')
+        logger.info(f"  Train: {len(self.train_dataset)} samples")
+        logger.info(f"  Val: {len(self.eval_dataset)} samples")
+        logger.info(f"✅ Datasets prepared in {time.time() - start:.1f}s")
+    
+    def _tokenize_weighted(self, example: Dict) -> Dict[str, List]:
+        """tokenize单个样本，并通过offset mapping把关键词字符区间映射成逐token权重"""
+        text = format_prompt(example)['text']
+        encoded = self.tokenizer(
+            text,
+            truncation=True,
+            max_length=self.data_args.max_length,
+            return_offsets_mapping=True
+        )
+        spans = keyword_char_spans(text, get_keywords(example))
+        return {
+            'input_ids': encoded['input_ids'],
+            'loss_weights': token_weights(encoded['offset_mapping'], spans)
+        }
+    
+    def _build_weighted(self, data_file: str, split: str):
+        """带逐token关键词权重的数据集（命中token缓存时直接内存映射）"""
+        samples = (self._tokenize_weighted(example) for example in iter_samples(data_file))
+        if not self.data_args.token_cache_dir:
+            return [
+                {**s, 'labels': list(s['input_ids']), 'attention_mask': [1] * len(s['input_ids'])}
+                for s in samples
+            ]
+        
+        cache = TokenizedDatasetCache(self.data_args.token_cache_dir)
+        key = cache.key(
+            resolve_data_files(data_file), self.tokenizer, self.data_args.max_length,
+            prompt_template=PROMPT_TEMPLATE_WITH_CONTEXT + PROMPT_TEMPLATE,
+            extra={'loss_weights': 'keywords'}
+        )
+        dataset = cache.load(key)
+        if dataset is not None:
+            logger.info(f"⚡ {split}: loaded weighted token cache {cache.path(key)} "
+                        f"({len(dataset)} samples, {dataset.num_tokens} tokens)")
+            return dataset
+        logger.info(f"🔄 {split}: tokenizing {data_file} with keyword weights...")
+        return cache.build(key, samples, columns=('input_ids', 'loss_weights'),
+                           info={'data_file': data_file, 'loss_weights': 'keywords'})
+    
+    def _prepare_weighted_datasets(self):
+        """关键词加权损失所需的数据集（input_ids + loss_weights）"""
+        self.train_dataset = self._build_weighted(self.data_args.train_file, 'train')
+        self.eval_dataset = self._build_weighted(self.data_args.val_file, 'val')
+        logger.info(f"  Train: {len(self.train_dataset)} samples")
+        logger.info(f"  Val: {len(self.eval_dataset)} samples")
+        logger.info("✅ Datasets prepared (keyword-weighted loss)")
+    
+    def _build_multi_turn(self, data_file: str, split: str):
+        """多轮序列（命中token缓存时直接内存映射）"""
+        cache = TokenizedDatasetCache(self.data_args.token_cache_dir) if self.data_args.token_cache_dir else None
+        key = None
+        if cache is not None:
+            key = cache.key(
+                resolve_data_files(data_file), self.tokenizer, self.data_args.max_length,
+                prompt_template=MULTI_TURN_HEADER + MULTI_TURN_STEP,
+                extra={'format': 'multi_turn'}
+            )
+            dataset = cache.load(key)
+            if dataset is not None:
+                logger.info(f"⚡ {split}: loaded multi-turn token cache {cache.path(key)} "
+                            f"({len(dataset)} sequences, {dataset.num_tokens} tokens)")
+                return dataset
+        
+        stats = {}
+        sequences = build_multi_turn_sequences(self.tokenizer, data_file, self.data_args.max_length, stats)
+        if cache is not None:
+            dataset = cache.build(key, sequences, columns=('input_ids', 'labels'),
+                                  info={'data_file': data_file, 'format': 'multi_turn'})
+        else:
+            dataset = Dataset.from_list([
+                {**seq, 'attention_mask': [1] * len(seq['input_ids'])} for seq in sequences
+            ])
+        
+        saving = 1 - stats['tokens'] / stats['per_step_tokens'] if stats['per_step_tokens'] else 0.0
+        logger.info(f"🧵 {split}: {stats['workflows']} workflows / {stats['steps']} steps -> "
+                    f"{stats['windows']} sequences, {stats['tokens']} tokens "
+                    f"(single-step samples: {stats['per_step_tokens']}, saved {saving:.1%})")
+        return dataset
+    
+    def _prepare_multi_turn_datasets(self):
+        """每个工作流一条（或按max_length切分成多条）多轮序列"""
+        self.train_dataset = self._build_multi_turn(self.data_args.train_file, 'train')
+        self.eval_dataset = self._build_multi_turn(self.data_args.val_file, 'val')
+        logger.info(f"  Train: {len(self.train_dataset)} sequences")
+        logger.info(f"  Val: {len(self.eval_dataset)} sequences")
+        logger.info("✅ Datasets prepared")
+    
+    def _build_step_type_sampler(self) -> Optional[StepTypeWeightedSampler]:
+        """按step_type/module采样率和高质量提升构建采样器，并预先报告每个epoch的分布和token数"""
+        args = self.data_args
+        if not (args.step_type_rates or args.module_rates or args.sampling_temperature
+                or args.high_quality_boost != 1.0):
+            return None
+        
+        attributes = load_attributes(iter_samples(args.train_file))
+        if len(attributes) != len(self.train_dataset):
+            logger.warning(f"⚠️  训练样本数({len(self.train_dataset)})与原始数据({len(attributes)})不一致"
+                           f"（如多轮格式），不使用按步骤类型加权采样")
+            return None
+        
+        sampler = StepTypeWeightedSampler(
+            attributes,
+            step_type_rates=parse_rates(args.step_type_rates),
+            module_rates=parse_rates(args.module_rates),
+            high_quality_boost=args.high_quality_boost,
+            temperature=args.sampling_temperature,
+            seed=self.training_args.seed
+        )
+        sampler.report(dataset_lengths(self.train_dataset))
+        return sampler
+    
     def train(self):
         """开始训练"""
         logger.info("🚀 Starting training...")
         
+        train_dataset, eval_dataset = self.train_dataset, self.eval_dataset
+        
+        train_batch_sampler = None
+        if self.data_args.max_tokens_per_batch and self.data_args.packing:
+            logger.warning("⚠️  --packing 已生成定长行，忽略 --max-tokens-per-batch")
+        elif self.data_args.max_tokens_per_batch:
+            train_batch_sampler = TokenBudgetBatchSampler(
+                dataset_lengths(self.train_dataset),
+                max_tokens=self.data_args.max_tokens_per_batch,
+                seed=self.training_args.seed
+            )
+            stats = train_batch_sampler.stats()
+            logger.info(f"🪣 Token-budget batches: {stats['num_batches']} batches/epoch, "
+                        f"{stats['samples_per_batch']:.1f} samples and "
+                        f"{stats['padded_tokens_per_batch']:.0f} tokens per batch, "
+                        f"padding ratio {stats['padding_ratio']:.1%}")
+        
+        train_sampler = self._build_step_type_sampler()
+        if train_sampler is not None and (self.data_args.packing or train_batch_sampler is not None):
+            logger.warning("⚠️  按步骤类型加权采样不能与 --packing / --max-tokens-per-batch 同时使用，已忽略")
+            train_sampler = None
+        
         # Data collator
-        data_collator = DataCollatorForSeq2Seq(
-            tokenizer=self.tokenizer,
-            model=self.model,
-            padding=True
-        )
+        if self.data_args.packing:
+            train_dataset = PackedDataset(self.train_dataset, self.data_args.max_length)
+            eval_dataset = PackedDataset(self.eval_dataset, self.data_args.max_length)
+            logger.info(f"📦 Packing: {len(self.train_dataset)} samples -> {len(train_dataset)} rows "
+                        f"of {self.data_args.max_length} tokens, "
+                        f"efficiency {train_dataset.efficiency:.1%} (real tokens / total tokens)")
+            # flash_attention_2按position_ids区分样本，其它实现需要块对角mask
+            attn_implementation = getattr(self.model.config, '_attn_implementation', 'eager')
+            data_collator = PackedDataCollator(
+                pad_token_id=self.tokenizer.pad_token_id,
+                block_diagonal_mask=attn_implementation != 'flash_attention_2',
+                mask_dtype=getattr(torch, self.model_args.torch_dtype)
+            )
+        else:
+            data_collator = DataCollatorForSeq2Seq(
+                tokenizer=self.tokenizer,
+                model=self.model,
+                padding=True
+            )
+            if self.data_args.keyword_weighted_loss and not self.data_args.multi_turn:
+                data_collator = WeightedDataCollator(data_collator)
+        
+        throughput = None
+        if self.throughput_log:
+            throughput = ThroughputCallback(
+                self.throughput_log,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+        
+        async_checkpoint = None
+        if self.async_checkpoint:
+            async_checkpoint = AsyncCheckpointCallback(throughput=throughput)
+            logger.info("💾 异步checkpoint: 每 save_steps 后台保存adapter权重（safetensors），"
+                        "不含优化器状态，不能用于resume")
         
         # 创建Trainer
-        trainer = Trainer(
+        trainer = GISHFTrainer(
             model=self.model,
             args=self.training_args,
-            train_dataset=self.train_dataset,
-            eval_dataset=self.eval_dataset,
+            train_dataset=train_dataset,
+            eval_dataset=eval_dataset,
             tokenizer=self.tokenizer,
             data_collator=data_collator,
+            train_batch_sampler=train_batch_sampler,
+            train_sampler=train_sampler,
+            throughput=throughput,
+            async_checkpoint=async_checkpoint,
         )
         
         # 训练
@@ -289,8 +713,10 @@ class GISTrainer:
         
         # 保存最终模型
         logger.info(f"💾 Saving final model to {self.training_args.output_dir}")
+        start = time.time()
         trainer.save_model()
         self.tokenizer.save_pretrained(self.training_args.output_dir)
+        logger.info(f"💾 Final model saved in {time.time() - start:.1f}s")
         
         logger.info("🎉 Training completed!")
         
@@ -311,13 +737,36 @@ def main():
     
     # 数据参数
     parser.add_argument('--train-file', type=str,
-                       default='data/training/training_data_train.json',
-                       help='训练数据文件')
+                       help='训练数据文件（JSON/JSONL，或Parquet/Arrow分片的glob/目录；'
+                            '默认 data/training/training_data_train.json(l) 中较新的一个）')
     parser.add_argument('--val-file', type=str,
-                       default='data/training/training_data_val.json',
-                       help='验证数据文件')
+                       help='验证数据文件（同上）')
+    parser.add_argument('--num-proc', type=int,
+                       help='并行加载数据分片的进程数')
+    parser.add_argument('--streaming', action='store_true',
+                       help='流式读取数据（数据放不进内存时使用，需要 --max-steps）')
     parser.add_argument('--max-length', type=int, default=2048,
                        help='最大序列长度')
+    parser.add_argument('--token-cache-dir', type=str, default='data/cache/tokenized',
+                       help='tokenized数据集缓存目录')
+    parser.add_argument('--no-token-cache', action='store_true',
+                       help='不使用tokenized缓存，每次重新tokenize')
+    parser.add_argument('--packing', action='store_true',
+                       help='打包短样本为定长行，并报告打包效率')
+    parser.add_argument('--keyword-weighted-loss', action='store_true',
+                       help='关键词权重 × 逐token损失（权重在tokenize时预计算并缓存）')
+    parser.add_argument('--multi-turn', action='store_true',
+                       help='层次化数据按工作流组成多轮序列（共享前缀，只在输出上计算loss）')
+    parser.add_argument('--step-type-rates', type=str,
+                       help="按step_type的采样率，如 'navigation=0.2,validation=0.5'")
+    parser.add_argument('--module-rates', type=str,
+                       help="按module的采样率，如 'Tabs=0.2,Buttons=0.2'")
+    parser.add_argument('--high-quality-boost', type=float, default=1.0,
+                       help='高质量模板样本的采样权重倍数')
+    parser.add_argument('--sampling-temperature', type=float,
+                       help='按step_type做温度重平衡（T>1提升小类别）')
+    parser.add_argument('--max-tokens-per-batch', type=int,
+                       help='按token预算组batch（长度分桶，替代固定batch size）')
     
     # LoRA参数
     parser.add_argument('--lora-r', type=int, default=64,
@@ -333,6 +782,8 @@ def main():
                        help='模型输出目录')
     parser.add_argument('--num-epochs', type=int, default=3,
                        help='训练轮数')
+    parser.add_argument('--max-steps', type=int, default=-1,
+                       help='最大训练步数（>0时覆盖--num-epochs，流式数据必须设置）')
     parser.add_argument('--batch-size', type=int, default=4,
                        help='训练batch size')
     parser.add_argument('--gradient-accumulation-steps', type=int, default=4,
@@ -345,9 +796,34 @@ def main():
                        help='日志输出频率')
     parser.add_argument('--save-steps', type=int, default=500,
                        help='模型保存频率')
+    parser.add_argument('--throughput-log', type=str, nargs='?', const='',
+                       help='逐step记录吞吐（tokens/s、数据等待、峰值内存、保存耗时）到JSONL，'
+                            '不给路径时写到 {output_dir}/throughput.jsonl')
+    parser.add_argument('--async-checkpoint', action='store_true',
+                       help='中间checkpoint改为后台线程保存adapter权重（safetensors，原子重命名），'
+                            '训练只停顿快照时间；不含优化器状态，不能resume')
+    parser.add_argument('--benchmark', action='store_true',
+                       help='CPU小模型基准：本地随机初始化的小模型 + 固定语料，跑 --max-steps 步（默认20），'
+                            '结果写到 benchmarks/（更多选项见 src/training/benchmark.py）')
     
     args = parser.parse_args()
     
+    if args.benchmark:
+        from training.benchmark import main as benchmark_main
+        benchmark_argv = ['--steps', str(args.max_steps if args.max_steps > 0 else 20),
+                          '--batch-size', str(args.batch_size)]
+        if args.packing:
+            benchmark_argv.append('--packing')
+        if args.max_tokens_per_batch:
+            benchmark_argv += ['--max-tokens-per-batch', str(args.max_tokens_per_batch)]
+        if args.async_checkpoint:
+            benchmark_argv += ['--save-steps', str(args.save_steps), '--async-checkpoint']
+        benchmark_main(benchmark_argv)
+        return
+    
+    args.train_file = args.train_file or default_data_file('train')
+    args.val_file = args.val_file or default_data_file('val')
+    
     # 创建参数对象
     model_args = ModelArguments(
         model_name_or_path=args.model_name,
@@ -358,7 +834,18 @@ def main():
     data_args = DataArguments(
         train_file=args.train_file,
         val_file=args.val_file,
-        max_length=args.max_length
+        max_length=args.max_length,
+        token_cache_dir=None if args.no_token_cache else args.token_cache_dir,
+        packing=args.packing,
+        keyword_weighted_loss=args.keyword_weighted_loss,
+        multi_turn=args.multi_turn,
+        step_type_rates=args.step_type_rates,
+        module_rates=args.module_rates,
+        high_quality_boost=args.high_quality_boost,
+        sampling_temperature=args.sampling_temperature,
+        num_proc=args.num_proc,
+        streaming=args.streaming,
+        max_tokens_per_batch=args.max_tokens_per_batch
     )
     
     lora_args = LoraArguments(
@@ -370,6 +857,7 @@ def main():
     training_args = TrainingArguments(
         output_dir=args.output_dir,
         num_train_epochs=args.num_epochs,
+        max_steps=args.max_steps,
         per_device_train_batch_size=args.batch_size,
         per_device_eval_batch_size=args.batch_size,
         gradient_accumulation_steps=args.gradient_accumulation_steps,
@@ -389,7 +877,7 @@ def main():
     )
     
     # 检查输入文件
-    if not Path(args.train_file).exists():
+    if not resolve_data_files(args.train_file):
         logger.error(f"❌ Train file not found: {args.train_file}")
         logger.info("💡 请先运行: python src/training/prepare_training_data.py")
         return
@@ -406,7 +894,11 @@ def main():
     logger.info(f"💾 输出: {args.output_dir}")
     logger.info("="*70)
     
-    trainer = GISTrainer(model_args, data_args, lora_args, training_args)
+    throughput_log = args.throughput_log
+    if throughput_log == '':
+        throughput_log = str(Path(args.output_dir) / 'throughput.jsonl')
+    trainer = GISTrainer(model_args, data_args, lora_args, training_args, throughput_log=throughput_log,
+                         async_checkpoint=args.async_checkpoint)
     
     # 执行训练流程
     trainer.load_tokenizer()
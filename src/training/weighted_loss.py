@@ -0,0 +1,123 @@
+"""
+关键词加权损失（keyword importance × token loss）
+
+WeightedInstructionGenerator 为每条指令输出 keywords: [[关键词, 权重], ...]（3.0/2.0/1.5）。
+权重在tokenize时一次性算好：在格式化后的prompt中找到每个关键词的字符区间（整词匹配，
+跳过JSON键，例如每个样本都有的 "create": {} 不加权），通过
+offset mapping映射到token，得到与input_ids对齐的逐token权重（未命中关键词的token为1.0）。
+训练时损失只多一次逐元素乘法：
+
+    loss = Σ(w_t · CE_t) / Σ(w_t)    （只统计labels != -100 的位置）
+"""
+
+import bisect
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+
+IGNORE_INDEX = -100
+DEFAULT_WEIGHT = 1.0
+
+# JSON对象的键（"...": ），关键词出现在键里时不加权
+JSON_KEY_RE = re.compile(r'"(?:[^"\\]|\\.)*"\s*:')
+
+
+def get_keywords(example: Dict) -> List[Tuple[str, float]]:
+    """样本的关键词（顶层keywords字段，或层次化样本的metadata.keywords）"""
+    keywords = example.get('keywords')
+    if keywords is None:
+        keywords = (example.get('metadata') or {}).get('keywords')
+    return [(kw, float(w)) for kw, w in (keywords or []) if kw]
+
+
+def keyword_char_spans(text: str, keywords: Sequence[Tuple[str, float]]) -> List[Tuple[int, int, float]]:
+    """
+    关键词在文本中作为完整单词出现的所有字符区间（不区分大小写）
+
+    只匹配指令文本和JSON字符串值：block 中的 lock、target 中的 get 不算，
+    JSON键（如 test_data 的 "create"/"update"）也不算
+    """
+    keys = [(m.start(), m.end()) for m in JSON_KEY_RE.finditer(text)]
+    key_starts = [start for start, _ in keys]
+    spans = []
+    for keyword, weight in keywords:
+        pattern = r'(?<!\w)' + re.escape(keyword) + r'(?!\w)'
+        for m in re.finditer(pattern, text, flags=re.IGNORECASE):
+            i = bisect.bisect_right(key_starts, m.start()) - 1
+            if i >= 0 and m.start() < keys[i][1]:
+                continue
+            spans.append((m.start(), m.end(), weight))
+    return spans
+
+
+def token_weights(offsets: Sequence[Tuple[int, int]], spans: Sequence[Tuple[int, int, float]],
+                  default: float = DEFAULT_WEIGHT) -> List[float]:
+    """
+    逐token权重：token与关键词区间有重叠时取最大关键词权重，否则为default
+
+    Args:
+        offsets: tokenizer返回的offset_mapping（每个token的字符区间）
+    """
+    if not spans:
+        return [default] * len(offsets)
+
+    end = max(e for _, e in offsets) if offsets else 0
+    char_weights = [default] * (end + 1)
+    for start, stop, weight in spans:
+        for i in range(start, min(stop, end)):
+            if weight > char_weights[i]:
+                char_weights[i] = weight
+
+    weights = []
+    for start, stop in offsets:
+        weights.append(max(char_weights[start:stop]) if stop > start else default)
+    return weights
+
+
+def weighted_causal_lm_loss(logits: torch.Tensor, labels: torch.Tensor,
+                            weights: torch.Tensor) -> torch.Tensor:
+    """
+    逐token加权的因果语言模型损失
+
+    Args:
+        logits: [batch, seq, vocab]
+        labels: [batch, seq]，-100表示不计算loss
+        weights: [batch, seq]，与labels对齐
+    """
+    shift_logits = logits[..., :-1, :].contiguous()
+    shift_labels = labels[..., 1:].contiguous()
+    shift_weights = weights[..., 1:].to(torch.float32)
+
+    token_loss = F.cross_entropy(
+        shift_logits.view(-1, shift_logits.size(-1)).float(),
+        shift_labels.view(-1),
+        ignore_index=IGNORE_INDEX,
+        reduction='none'
+    ).view_as(shift_labels)
+
+    valid = (shift_labels != IGNORE_INDEX).to(torch.float32)
+    shift_weights = shift_weights * valid
+    return (token_loss * shift_weights).sum() / shift_weights.sum().clamp(min=1e-8)
+
+
+class WeightedDataCollator:
+    """在基础collator之外把loss_weights右侧补0到与labels同长"""
+
+    def __init__(self, base_collator):
+        self.base_collator = base_collator
+
+    def __call__(self, features: List[Dict]) -> Dict[str, torch.Tensor]:
+        weights: Optional[List[List[float]]] = None
+        if features and 'loss_weights' in features[0]:
+            weights = [list(f.pop('loss_weights')) for f in features]
+        batch = self.base_collator(features)
+        if weights is not None:
+            length = batch['labels'].shape[1]
+            padded = torch.zeros((len(weights), length), dtype=torch.float32)
+            for row, w in enumerate(weights):
+                w = w[:length]
+                padded[row, :len(w)] = torch.tensor(w, dtype=torch.float32)
+            batch['loss_weights'] = padded
+        return batch
@@ -0,0 +1,83 @@
+"""
+关键词加权：权重只落在指令文本和JSON字符串值中完整出现的关键词上
+"""
+
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+pytest.importorskip("torch")
+
+from training.prepare_hierarchical_training_data import build_hierarchical_training_sample
+from training.prompts import format_prompt
+from training.weighted_loss import get_keywords, keyword_char_spans, token_weights
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def tokenize_with_offsets(text):
+    """按单词/标点切分的offset mapping（代替HF tokenizer的 return_offsets_mapping）"""
+    return [(m.start(), m.end()) for m in TOKEN_RE.finditer(text)]
+
+
+def hierarchical_sample():
+    step = {
+        'file_id': 'file_id_00001',
+        'step_index': 2,
+        'step_type': 'crud',
+        'instruction': 'Create E LS Kabel in elektra and select the target widget',
+        'keywords': [['create', 3.0], ['update', 3.0], ['E LS Kabel', 2.0], ['elektra', 1.5],
+                     ['lock', 1.5], ['get', 1.5], ['select', 1.5]],
+    }
+    context = {
+        'file_task': 'Workflow: create, update multiple objects in elektra',
+        'progress': {'current_step': 3, 'total_steps': 7},
+        'previous_steps': [],
+        'remaining_objects': ['E MS Kabel'],
+    }
+    output_json = {
+        'step_index': 2,
+        'database': 'elektra',
+        'object': 'E LS Kabel',
+        'object_id': '',
+        'module': 'Datamodel CRUD',
+        'method': 'Create',
+        'command': 'Selected block',
+        'test_data': {'create': {'Lock': 'yes'}, 'update': {}, 'editor': {}},
+    }
+    return build_hierarchical_training_sample(step, context, output_json, 'NRG Beheerkaart Elektra MS')
+
+
+def weighted_tokens(sample):
+    text = format_prompt(sample)['text']
+    offsets = tokenize_with_offsets(text)
+    weights = token_weights(offsets, keyword_char_spans(text, get_keywords(sample)))
+    return [(text[start:end], weight) for (start, end), weight in zip(offsets, weights) if weight != 1.0]
+
+
+def test_weights_land_only_on_intended_tokens():
+    assert weighted_tokens(hierarchical_sample()) == [
+        # File Task: create, update ... in elektra
+        ('create', 3.0), ('update', 3.0), ('elektra', 1.5),
+        # Current Step: Create E LS Kabel in elektra and select ...
+        ('Create', 3.0), ('E', 2.0), ('LS', 2.0), ('Kabel', 2.0), ('elektra', 1.5), ('select', 1.5),
+        # JSON字符串值："database"、"object"、"method"（键 "create"/"update"/"Lock" 不加权）
+        ('elektra', 1.5), ('E', 2.0), ('LS', 2.0), ('Kabel', 2.0), ('Create', 3.0),
+    ]
+
+
+def test_keywords_match_whole_words_only():
+    text = 'unlock the selected block, target widget'
+    spans = keyword_char_spans(text, [('lock', 1.5), ('get', 1.5), ('select', 1.5)])
+    assert spans == []
+
+
+def test_json_keys_are_not_weighted():
+    text = '{"create": {}, "update": {"name": "update"}, "editor": {}}'
+    spans = keyword_char_spans(text, [('create', 3.0), ('update', 3.0)])
+    assert [text[start:end] for start, end, _ in spans] == ['update']
+    assert spans[0][0] == text.rindex('update')
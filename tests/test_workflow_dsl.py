@@ -0,0 +1,98 @@
+"""
+Round-trip property of the compact DSL: decode(encode(x)) == x for steps and workflows.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from data_processing.step_classification import compute_has_data
+from data_processing.workflow_dsl import decode_step, decode_workflow, encode_step, encode_workflow
+
+
+def parsed_step(step_index, module, method, database="", obj="", object_id="", command="",
+                create=None, update=None, editor=None):
+    """A step in WorkflowParser's schema"""
+    test_data = {"create": create or {}, "update": update or {}, "editor": editor or {}}
+    return {
+        "step_index": step_index,
+        "database": database,
+        "object": obj,
+        "object_id": object_id,
+        "module": module,
+        "method": method,
+        "command": command,
+        "test_data": test_data,
+        "has_data": compute_has_data(test_data),
+    }
+
+
+def without(step, *keys):
+    return {k: v for k, v in step.items() if k not in keys}
+
+
+STEPS = {
+    "known": parsed_step(0, "Tabs", "Select Tab", command="Elektra"),
+    "crud_with_data": parsed_step(1, "Datamodel CRUD", "Create", database="elektra", obj="E LS Kabel",
+                                  create={"Naam": "Kabel 1", "Lengte": 12}, editor={"Status": "ñ"}),
+    "unknown_module": parsed_step(2, "Custom Module", "Do Something", command="x"),
+    "unknown_method": parsed_step(3, "Editor(s)", "Unknown Method", database="gas", obj="G Leiding"),
+    "missing_standard_keys": without(parsed_step(4, "Buttons", "Click Oneshot Button"),
+                                     "object_id", "command", "has_data"),
+    "missing_step_index": without(parsed_step(5, "Tabs", "Select Tab"), "step_index"),
+    "extra_keys": {**parsed_step(6, "Hierarchy Viewer", "Select first HV object"),
+                   "note": "generated", "score": [1, 2]},
+    "mismatched_has_data": {**parsed_step(7, "Datamodel CRUD", "Update", update={"Naam": "x"}),
+                            "has_data": False},
+    "non_positional_step_index": parsed_step(42, "Datamodel CRUD", "Delete", object_id="7"),
+    "null_step_index": parsed_step(None, "Tabs", "Select Tab"),
+    "nonstandard_test_data": {**parsed_step(9, "Datamodel CRUD", "Create"),
+                              "test_data": {"create": {"a": 1}, "custom": {}}, "has_data": True},
+}
+
+
+@pytest.mark.parametrize("name", sorted(STEPS))
+@pytest.mark.parametrize("position", [None, 0, 9])
+def test_step_roundtrip(name, position):
+    step = STEPS[name]
+    line = encode_step(step, position)
+    assert "\n" not in line
+    assert decode_step(line, position) == step
+
+
+def test_defaults_are_omitted():
+    assert encode_step(STEPS["known"], 0) == 'TAB.SEL {"cmd":"Elektra"}'
+    assert encode_step(STEPS["unknown_module"], 2) == '_ {"m":"Custom Module","f":"Do Something","cmd":"x"}'
+
+
+@pytest.mark.parametrize("metadata", [
+    None,
+    {"test_app": "NRG Beheerkaart Elektra MS", "database": "elektra", "total_steps": len(STEPS)},
+    {"test_app": "NRG Beheerkaart Gas", "database": "", "total_steps": 99, "source": "generated"},
+])
+def test_workflow_roundtrip(metadata):
+    steps = [STEPS[name] for name in sorted(STEPS)]
+    text = encode_workflow(steps, metadata)
+    decoded_metadata, decoded_steps = decode_workflow(text)
+    assert decoded_steps == steps
+    expected = {"test_app": "", "database": "", "total_steps": len(steps), **(metadata or {})}
+    assert decoded_metadata == expected
+
+
+def test_positional_steps_roundtrip():
+    steps = [parsed_step(i, "Tabs", "Select Tab") for i in range(3)]
+    text = encode_workflow(steps)
+    assert text == "@\nTAB.SEL\nTAB.SEL\nTAB.SEL"
+    assert decode_workflow(text) == ({"test_app": "", "database": "", "total_steps": 3}, steps)
+
+
+def test_empty_workflow_roundtrip():
+    assert decode_workflow(encode_workflow([])) == ({"test_app": "", "database": "", "total_steps": 0}, [])
+
+
+def test_missing_header_raises():
+    with pytest.raises(ValueError):
+        decode_workflow("TAB.SEL")
@@ -0,0 +1,103 @@
+"""
+Round-trip property of the flat-format encoder: parse(encode(x)) == x (ignoring file_path).
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from data_processing.workflow_encoder import RawWorkflowWriter, encode_flat, verify_roundtrip
+from data_processing.workflow_parser import WorkflowParser
+
+
+def flat_step(data, step_idx, module, method, database="", obj="", object_id="", command="",
+              create=None, update=None, editor=None):
+    suffix = f"0_{step_idx}"
+    data[f"testdbs{suffix}"] = database
+    data[f"testobjs{suffix}"] = obj
+    data[f"testobj_ids{suffix}"] = object_id
+    data[f"testmodules{suffix}"] = module
+    data[f"testmethodes{suffix}"] = method
+    data[f"testcommands{suffix}"] = command
+    data[f"testdata_cr{suffix}"] = create or {}
+    data[f"testdata_upd{suffix}"] = update or {}
+    data[f"testdata_editor{suffix}"] = editor or {}
+
+
+def flat_files():
+    """(相对路径, 扁平JSON)：模板/非模板文件夹、空/非空test_data、未知模块、有/无test_env"""
+    crud = {"testenvs0": ["ACC"], "testapps0": ["NRG Beheerkaart Elektra MS"], "teststeps0": [3],
+            "testcases": ["TC-1"]}
+    flat_step(crud, 0, "Tabs", "Select Tab", command="Elektra")
+    flat_step(crud, 1, "Datamodel CRUD", "Create", database="elektra", obj="E LS Kabel",
+              create={"Naam": "Kabel 1", "Lengte": 12})
+    flat_step(crud, 2, "Datamodel CRUD", "Update", database="elektra", obj="E LS Kabel", object_id="42",
+              update={"Naam": "Kabel 2"}, editor={"Status": "Actief"})
+
+    custom = {"testapps0": ["NRG Beheerkaart Gas"], "teststeps0": [2], "testcases": []}
+    flat_step(custom, 0, "Custom Module", "Do Something", command="x ñ")
+    flat_step(custom, 1, "Editor(s)", "Unknown Method", database="gas", obj="G Leiding")
+
+    empty = {"testenvs0": ["PROD"], "testapps0": ["NRG Beheerkaart Water"], "teststeps0": [0],
+             "testcases": []}
+
+    return [
+        ("template/template_insert_kabels", crud),
+        ("test_data/test_automat0", custom),
+        ("test_data/empty_workflow", empty),
+    ]
+
+
+@pytest.fixture
+def parsed_workflows(tmp_path):
+    raw_dir = tmp_path / "raw"
+    paths = []
+    for name, data in flat_files():
+        path = raw_dir / f"{name}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        paths.append(path)
+    parser = WorkflowParser(str(raw_dir))
+    return [parser.parse_file(path) for path in paths]
+
+
+def without_path(workflow):
+    return {k: v for k, v in workflow.items() if k != "file_path"}
+
+
+def test_fixture_covers_cases(parsed_workflows):
+    template, custom, empty = parsed_workflows
+    assert template["is_high_quality"] and not custom["is_high_quality"]
+    assert template["test_env"] == "ACC" and custom["test_env"] == "Unknown"
+    assert custom["steps"][0]["module"] == "Custom Module"
+    assert template["steps"][0]["has_data"] is False and template["steps"][1]["has_data"] is True
+    assert empty["steps"] == []
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_parse_encode_roundtrip(parsed_workflows, tmp_path, indent):
+    out_dir = tmp_path / "encoded"
+    writer = RawWorkflowWriter(str(out_dir), indent=indent)
+    parser = WorkflowParser(str(out_dir))
+    for workflow, path in zip(parsed_workflows, writer.write_batch(parsed_workflows)):
+        assert path == out_dir / f"{workflow['file_id']}.json"
+        assert without_path(parser.parse_file(path)) == without_path(workflow)
+
+
+def test_encode_flat_matches_source(parsed_workflows):
+    sources = [data for _, data in flat_files()]
+    for workflow, data in zip(parsed_workflows, sources):
+        assert encode_flat(workflow) == data
+
+
+def test_verify_roundtrip_corpus(parsed_workflows, tmp_path):
+    workflows_file = tmp_path / "parsed_workflows.jsonl"
+    with open(workflows_file, "w", encoding="utf-8") as f:
+        for workflow in parsed_workflows:
+            f.write(json.dumps(workflow, ensure_ascii=False) + "\n")
+    result = verify_roundtrip(str(workflows_file), batch_size=2)
+    assert result == {"checked": len(parsed_workflows), "failures": []}